@@ -3,17 +3,17 @@ import taskplan
 from src.Trainer import Trainer
 from src.Model import Model
 from src.Data import Data
-import tensorflow as tf
 import pickle
 
 class Task(taskplan.Task):
 
     def __init__(self, config, logger, metadata):
-        super(Task, self).__init__(config, logger, metadata)
+        # TensorFlow is only used for the model, the scalars are written with taskplan's own event writer
+        super(Task, self).__init__(config, logger, metadata, use_tensorflow=False)
         self.sum = 0
 
         self.model = Model(config.get_with_prefix("model"))
-        self.data = Data(config.get_with_prefix("data"))
+        self.data = Data(config.get_with_prefix("data"), self.shared_array)
         self.trainer = Trainer(config.get_with_prefix("trainer"), self.model, self.data)
         self.best_val_acc = 0
         self.number_worse_iterations = 0
@@ -23,20 +23,19 @@ class Task(taskplan.Task):
         pickle.dump(self.best_val_acc, open(str(path / "best_model.pkl"), "wb"))
 
     def step(self, tensorboard_writer, current_iteration):
-        with tensorboard_writer.as_default():
-            val_acc = self.trainer.step(current_iteration)
-            if val_acc is not None:
-                if val_acc > self.best_val_acc:
-                    self.best_val_acc = val_acc
-                    self.model.save_weights(str(self.task_dir / "model.h5py"))
-                    self.number_worse_iterations = 0
-                else:
-                    self.number_worse_iterations += 1
-
-                if self.number_worse_iterations > 5:
-                    self.pause_computation = True
-
-                tf.summary.scalar('val/best_acc', self.best_val_acc, step=current_iteration)
+        val_acc = self.trainer.step(tensorboard_writer, current_iteration)
+        if val_acc is not None:
+            if val_acc > self.best_val_acc:
+                self.best_val_acc = val_acc
+                self.model.save_weights(str(self.task_dir / "model.h5py"))
+                self.number_worse_iterations = 0
+            else:
+                self.number_worse_iterations += 1
+
+            if self.number_worse_iterations > 5:
+                self.pause_computation = True
+
+            tensorboard_writer.add_scalar('val/best_acc', float(self.best_val_acc), current_iteration)
 
     def load(self, path):
         self.model.load_weights(str(path / "model.h5py"))
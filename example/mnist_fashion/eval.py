@@ -1,6 +1,7 @@
 from pathlib import Path
 
 import taskplan
+from taskplan.EventWriter import EventWriter
 
 from src.Model import Model
 from src.Data import Data
@@ -32,6 +33,6 @@ for data in data.build_test_dataset():
 
 print("Acc: " + str(acc.result()))
 
-tensorboard_writer = tf.summary.create_file_writer(str(path))
-with tensorboard_writer.as_default():
-    tf.summary.scalar('test/acc', acc.result(), step=task.finished_iterations)
\ No newline at end of file
+tensorboard_writer = EventWriter(path)
+tensorboard_writer.add_scalar('test/acc', float(acc.result()), task.finished_iterations)
+tensorboard_writer.close()
\ No newline at end of file
@@ -2,19 +2,27 @@ import tensorflow as tf
 
 class Data:
 
-    def __init__(self, config):
+    def __init__(self, config, shared_array=None):
         self.config = config
-        self.fashion_mnist = tf.keras.datasets.fashion_mnist
-        (self.train_images, self.train_labels), (self.test_images, self.test_labels) = tf.keras.datasets.fashion_mnist.load_data()
-        self.val_images = self.train_images[50000:]
-        self.val_labels = self.train_labels[50000:]
-
-        self.train_images = self.train_images[:50000]
-        self.train_labels = self.train_labels[:50000]
-
-        self.train_images = self.train_images / 255.0
-        self.val_images = self.val_images / 255.0
-        self.test_images = self.test_images / 255.0
+        if shared_array is None:
+            shared_array = lambda name, builder, config: builder()
+
+        # The arrays do not depend on the config, so they are shared between all tasks
+        dataset = {}
+        self.train_images = shared_array("fashion_mnist_train_images", lambda: self._load_split(dataset, "train")[0], {})
+        self.train_labels = shared_array("fashion_mnist_train_labels", lambda: self._load_split(dataset, "train")[1], {})
+        self.val_images = shared_array("fashion_mnist_val_images", lambda: self._load_split(dataset, "val")[0], {})
+        self.val_labels = shared_array("fashion_mnist_val_labels", lambda: self._load_split(dataset, "val")[1], {})
+        self.test_images = shared_array("fashion_mnist_test_images", lambda: self._load_split(dataset, "test")[0], {})
+        self.test_labels = shared_array("fashion_mnist_test_labels", lambda: self._load_split(dataset, "test")[1], {})
+
+    def _load_split(self, dataset, split):
+        if len(dataset) == 0:
+            (train_images, train_labels), (test_images, test_labels) = tf.keras.datasets.fashion_mnist.load_data()
+            dataset["train"] = (train_images[:50000] / 255.0, train_labels[:50000])
+            dataset["val"] = (train_images[50000:] / 255.0, train_labels[50000:])
+            dataset["test"] = (test_images / 255.0, test_labels)
+        return dataset[split]
 
     def _build_basic_dataset(self, images, labels):
         dataset = tf.data.Dataset.from_tensor_slices((images, labels))
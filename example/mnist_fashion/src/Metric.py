@@ -14,6 +14,6 @@ class Metric:
         self.loss.reset_states()
         self.acc.reset_states()
 
-    def plot(self, current_iteration):
-        tf.summary.scalar(self.prefix + 'loss', self.loss.result(), step=current_iteration)
-        tf.summary.scalar(self.prefix + 'acc', self.acc.result(), step=current_iteration)
\ No newline at end of file
+    def plot(self, tensorboard_writer, current_iteration):
+        tensorboard_writer.add_scalar(self.prefix + 'loss', float(self.loss.result()), current_iteration)
+        tensorboard_writer.add_scalar(self.prefix + 'acc', float(self.acc.result()), current_iteration)
\ No newline at end of file
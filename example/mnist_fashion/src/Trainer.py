@@ -60,16 +60,16 @@ class Trainer:
             self._val_step(data)
 
 
-    def step(self, current_iteration):
+    def step(self, tensorboard_writer, current_iteration):
         self.train_metric.reset()
         self.val_metric.reset()
 
         self._train(100)
-        self.train_metric.plot(current_iteration)
+        self.train_metric.plot(tensorboard_writer, current_iteration)
 
         if current_iteration % 10 == 0:
             self._val()
-            self.val_metric.plot(current_iteration)
+            self.val_metric.plot(tensorboard_writer, current_iteration)
             return self.val_metric.acc.result()
         else:
             return None
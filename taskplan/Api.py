@@ -1,7 +1,9 @@
 
 from taskplan.Project import Project
 
+from taskplan.ConfigStore import ConfigStore
 from taskplan.EventManager import EventManager
+from taskplan.MetadataJournal import MetadataJournal
 
 try:
   from pathlib2 import Path
@@ -31,9 +33,12 @@ class Api:
 
     @staticmethod
     def load_config_from_task(task_path):
-        with open(str(Path(task_path) / "metadata.json"), "r") as handle:
-            data = json.load(handle)
-            config = Configuration(data['config'], [], None)
+        data = MetadataJournal(Path(task_path)).load()
+        config_data = data['config']
+        if "ref" in config_data:
+            with open(str(ConfigStore.locate(task_path, config_data["ref"])), "r") as handle:
+                config_data = json.load(handle)
+        config = Configuration(config_data, [], None)
         return config
 
     def load_config(self, project_name, config_uuid):
@@ -48,11 +53,11 @@ class Api:
         if use_default:
             for param in self.project.configuration.get_params():
                 if param.has_metadata("deprecated_param_value"):
-                    for param_value in self.project.configuration.get_param_values():
-                        if param.get_metadata("deprecated_param_value") == str(param_value.uuid):
-                            base_configs.append([param_value])
-                            if param_value.has_metadata("template_deprecated"):
-                                base_configs[-1] += param_value.get_metadata("template_deprecated")
+                    param_value = self.project.configuration.find_param_value(param.get_metadata("deprecated_param_value"))
+                    if param_value is not None:
+                        base_configs.append([param_value])
+                        if param_value.has_metadata("template_deprecated"):
+                            base_configs[-1] += param_value.get_metadata("template_deprecated")
             base_configs = {"0": base_configs}
         config = Configuration(data, base_configs)
         return config
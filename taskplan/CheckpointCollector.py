@@ -0,0 +1,40 @@
+import queue
+import shutil
+import threading
+import traceback
+
+
+class CheckpointCollector:
+
+    def __init__(self, checkpoint_store):
+        self.checkpoint_store = checkpoint_store
+        self.jobs = queue.Queue()
+        self.garbage_pending = False
+        self.thread = threading.Thread(target=self._collect_loop, daemon=True)
+        self.thread.start()
+
+    def collect(self, checkpoint_dir, manifest_id=None):
+        self.jobs.put((checkpoint_dir, manifest_id))
+
+    def release(self, manifest_id):
+        self.jobs.put((None, manifest_id))
+
+    def _collect_loop(self):
+        while True:
+            checkpoint_dir, manifest_id = self.jobs.get()
+            try:
+                if checkpoint_dir is not None and checkpoint_dir.exists():
+                    shutil.rmtree(str(checkpoint_dir))
+                if manifest_id is not None and self.checkpoint_store.release(manifest_id):
+                    self.garbage_pending = True
+
+                # Unreferenced chunks are collected once all queued checkpoints have been released
+                if self.garbage_pending and self.jobs.empty():
+                    self.garbage_pending = False
+                    self.checkpoint_store.collect_garbage()
+            except:
+                traceback.print_exc()
+            self.jobs.task_done()
+
+    def wait(self):
+        self.jobs.join()
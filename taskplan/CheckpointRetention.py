@@ -0,0 +1,47 @@
+class CheckpointRetention:
+
+    def __init__(self, keep_last=0, keep_every=0, keep_best=0, metric=None, metric_mode="max", keep_tagged=True):
+        if metric_mode not in ["max", "min"]:
+            raise ValueError("Unknown metric mode " + str(metric_mode))
+        if keep_best > 0 and metric is None:
+            raise ValueError("keep_best requires a metric")
+
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.metric = metric
+        self.metric_mode = metric_mode
+        self.keep_tagged = keep_tagged
+
+    def is_active(self):
+        return self.keep_last > 0 or self.keep_every > 0 or self.keep_best > 0
+
+    @staticmethod
+    def sequence_number(checkpoint):
+        return checkpoint.get("sequence")
+
+    def has_metric(self, checkpoints):
+        return any(self.metric in checkpoint.get("metrics", {}) for checkpoint in checkpoints)
+
+    def checkpoints_to_prune(self, checkpoints):
+        if not self.is_active():
+            return []
+
+        ordered = sorted(range(len(checkpoints)), key=lambda i: checkpoints[i]["finished_iterations"])
+        keep = set()
+        if self.keep_last > 0:
+            keep.update(ordered[-self.keep_last:])
+
+        if self.keep_every > 0:
+            # Checkpoints without a sequence number predate it and are therefore kept
+            keep.update(i for i in ordered if self.sequence_number(checkpoints[i]) is None or (self.sequence_number(checkpoints[i]) + 1) % self.keep_every == 0)
+
+        if self.keep_best > 0:
+            scored = [i for i in ordered if self.metric in checkpoints[i].get("metrics", {})]
+            scored.sort(key=lambda i: checkpoints[i]["metrics"][self.metric], reverse=self.metric_mode == "max")
+            keep.update(scored[:self.keep_best])
+
+        if self.keep_tagged:
+            keep.update(i for i in ordered if len(checkpoints[i].get("tags", [])) > 0)
+
+        return [checkpoints[i] for i in ordered if i not in keep]
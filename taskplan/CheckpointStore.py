@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from filelock import SoftFileLock
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class CheckpointStore:
+
+    def __init__(self, store_dir, chunk_size=4 * 1024 * 1024):
+        self.store_dir = Path(store_dir)
+        self.objects_dir = self.store_dir / "objects"
+        self.manifests_dir = self.store_dir / "manifests"
+        self.lock = SoftFileLock(str(self.store_dir / "store.lock"))
+        self.chunk_size = chunk_size
+
+    def _object_path(self, chunk_hash):
+        return self.objects_dir / chunk_hash[:2] / chunk_hash[2:]
+
+    def _manifest_path(self, manifest_id):
+        return self.manifests_dir / (manifest_id + ".json")
+
+    def _refs_path(self, manifest_id):
+        return self.manifests_dir / (manifest_id + ".refs")
+
+    def _load_refs(self, manifest_id):
+        # A manifest without a refs file is only referenced by the checkpoint it has been stored for
+        try:
+            with open(str(self._refs_path(manifest_id)), "r") as handle:
+                return int(handle.read())
+        except FileNotFoundError:
+            return 1 if self._manifest_path(manifest_id).exists() else 0
+
+    def _save_refs(self, manifest_id, refs):
+        tmp_path = self._refs_path(manifest_id).with_name(manifest_id + ".refs.tmp")
+        with open(str(tmp_path), "w") as handle:
+            handle.write(str(refs))
+        os.replace(str(tmp_path), str(self._refs_path(manifest_id)))
+
+    def _write_object(self, chunk_hash, chunk):
+        path = self._object_path(chunk_hash)
+        if path.exists():
+            return 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+        with open(str(tmp_path), "wb") as handle:
+            handle.write(chunk)
+        os.replace(str(tmp_path), str(path))
+        return len(chunk)
+
+    def _store_file(self, path, size=None):
+        chunks, stored_bytes, read_bytes = [], 0, 0
+        with open(str(path), "rb") as handle:
+            while size is None or read_bytes < size:
+                chunk = handle.read(self.chunk_size if size is None else min(self.chunk_size, size - read_bytes))
+                if len(chunk) == 0:
+                    break
+                read_bytes += len(chunk)
+                chunk_hash = hashlib.sha256(chunk).hexdigest()
+                stored_bytes += self._write_object(chunk_hash, chunk)
+                chunks.append(chunk_hash)
+        return chunks, stored_bytes
+
+    @staticmethod
+    def list_files(source_dir, ignore=[]):
+        source_dir = Path(source_dir)
+        files = {}
+        for root, dirs, filenames in os.walk(str(source_dir)):
+            if Path(root) == source_dir:
+                dirs[:] = [directory for directory in dirs if directory not in ignore]
+                filenames = [filename for filename in filenames if filename not in ignore]
+
+            for filename in filenames:
+                files[str((Path(root) / filename).relative_to(source_dir))] = None
+        return files
+
+    def store(self, source_dir, ignore=[], sizes=None):
+        source_dir = Path(source_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        if sizes is None:
+            sizes = self.list_files(source_dir, ignore)
+
+        # If sizes are given, only the first bytes of each file, which already existed when the sizes were taken, are stored
+        files = {}
+        stored_bytes = 0
+        for relative_path, size in sizes.items():
+            path = source_dir / relative_path
+            try:
+                chunks, file_stored_bytes = self._store_file(path, size)
+                mode = path.stat().st_mode & 0o777
+            except FileNotFoundError:
+                continue
+            stored_bytes += file_stored_bytes
+            files[relative_path] = {
+                "source": path,
+                "size": size,
+                "chunks": chunks,
+                "mode": mode
+            }
+
+        manifest_id = str(uuid.uuid4())
+        with self.lock:
+            for file in files.values():
+                if not all(self._object_path(chunk_hash).exists() for chunk_hash in file["chunks"]):
+                    file["chunks"], file_stored_bytes = self._store_file(file["source"], file["size"])
+                    stored_bytes += file_stored_bytes
+                del file["source"]
+                del file["size"]
+
+            self.manifests_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._manifest_path(manifest_id).with_name(manifest_id + ".json.tmp")
+            with open(str(tmp_path), "w") as handle:
+                json.dump({"files": files}, handle)
+            os.replace(str(tmp_path), str(self._manifest_path(manifest_id)))
+        return manifest_id, stored_bytes
+
+    def load_manifest(self, manifest_id):
+        with open(str(self._manifest_path(manifest_id)), "r") as handle:
+            return json.load(handle)
+
+    def materialize(self, manifest_id, target_dir, prepare=None):
+        target_dir = Path(target_dir)
+        tmp_dir = target_dir.with_name(target_dir.name + "." + str(os.getpid()) + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(str(tmp_dir))
+
+        for relative_path, file in self.load_manifest(manifest_id)["files"].items():
+            path = tmp_dir / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(path), "wb") as handle:
+                for chunk_hash in file["chunks"]:
+                    with open(str(self._object_path(chunk_hash)), "rb") as chunk:
+                        shutil.copyfileobj(chunk, handle)
+            os.chmod(str(path), file["mode"])
+
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        if prepare is not None:
+            prepare(tmp_dir)
+        try:
+            os.rename(str(tmp_dir), str(target_dir))
+        except OSError:
+            shutil.rmtree(str(tmp_dir))
+            if not target_dir.exists():
+                raise
+        return target_dir
+
+    def retain(self, manifest_id):
+        with self.lock:
+            refs = self._load_refs(manifest_id)
+            if refs > 0:
+                self._save_refs(manifest_id, refs + 1)
+
+    def release(self, manifest_id):
+        with self.lock:
+            refs = self._load_refs(manifest_id)
+            if refs > 1:
+                self._save_refs(manifest_id, refs - 1)
+                return False
+            elif refs == 1:
+                self._manifest_path(manifest_id).unlink()
+                try:
+                    self._refs_path(manifest_id).unlink()
+                except FileNotFoundError:
+                    pass
+                return True
+            return False
+
+    def collect_garbage(self):
+        # Chunk references are rebuilt from the remaining manifests, chunks of stores which are still in progress are restored by them under the lock
+        freed_bytes = 0
+        with self.lock:
+            referenced = set()
+            if self.manifests_dir.exists():
+                for path in self.manifests_dir.glob("*.json"):
+                    with open(str(path), "r") as handle:
+                        for file in json.load(handle)["files"].values():
+                            referenced.update(file["chunks"])
+
+            if self.objects_dir.exists():
+                for prefix_dir in self.objects_dir.iterdir():
+                    for path in prefix_dir.iterdir():
+                        if not path.name.endswith(".tmp") and prefix_dir.name + path.name not in referenced:
+                            try:
+                                freed_bytes += path.stat().st_size
+                                path.unlink()
+                            except OSError:
+                                pass
+        return freed_bytes
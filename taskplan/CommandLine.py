@@ -34,8 +34,9 @@ def web(refresh_interval, config, port):
 @click.argument('params', nargs=-1)
 @click.option('--save', type=int, default=0)
 @click.option('--checkpoint', type=int, default=0)
+@click.option('--memory_limit', type=int, default=None)
 @click.option('--config', type=str, default="taskplan.json")
-def start(total_iterations, params, save, checkpoint, config):
+def start(total_iterations, params, save, checkpoint, memory_limit, config):
     event_manager, controller = _start_controller([], config)
 
     try:
@@ -48,7 +49,7 @@ def start(total_iterations, params, save, checkpoint, config):
         for i in range(0, len(params), 2):
             values_per_param[params[i].split(";")[-1]] = params[i + 1].split(":")
 
-        task = controller.start_new_task({"0": values_per_param}, config, total_iterations)
+        task = controller.start_new_task({"0": values_per_param}, config, total_iterations, memory_limit=memory_limit)
         print("Starting task " + str(task.uuid))
 
         console_ui = ConsoleUI(controller, event_manager, str(task.uuid))
@@ -83,8 +84,9 @@ def continue_task(task_uuid, total_iterations, config):
 @click.argument('params', nargs=-1)
 @click.option('--save', type=int, default=0)
 @click.option('--checkpoint', type=int, default=0)
+@click.option('--memory_limit', type=int, default=None)
 @click.option('--config', type=str, default="taskplan.json")
-def test_task(total_iterations, params, save, checkpoint, config):
+def test_task(total_iterations, params, save, checkpoint, memory_limit, config):
     event_manager, controller = _start_controller([], config)
 
     try:
@@ -97,7 +99,7 @@ def test_task(total_iterations, params, save, checkpoint, config):
         for i in range(0, len(params), 2):
             values_per_param[params[i].split(";")[-1]] = params[i + 1].split(":")
 
-        task = controller.start_new_task({"0": values_per_param}, config, total_iterations, is_test=True)
+        task = controller.start_new_task({"0": values_per_param}, config, total_iterations, is_test=True, memory_limit=memory_limit)
 
         if task is not None:
             print("Testing task " + str(task.uuid))
@@ -109,11 +111,28 @@ def test_task(total_iterations, params, save, checkpoint, config):
         controller.stop()
 
 
+@cli.command(name="migrate_layout")
+@click.option('--flat', is_flag=True)
+@click.option('--config', type=str, default="taskplan.json")
+def migrate_layout(flat, config):
+    event_manager, controller = _start_controller(None, config)
+    controller.start()
+    try:
+        controller.migrate_task_layout(not flat, blocking=True)
+        print("Migrated task directories to the " + ("flat" if flat else "sharded") + " layout")
+    finally:
+        controller.stop()
+
+
 @cli.command(name="agent")
 @click.argument('host', default="0.0.0.0")
 @click.option('--port', type=int, default="33333")
-def agent(host, port):
-    agent = RemoteAgent(host, port)
+@click.option('--slot', type=int, default=0)
+@click.option('--slots', type=int, default=1)
+@click.option('--cpu_affinity', type=click.Choice(["none", "packed", "spread", "numa"]), default="none")
+@click.option('--scratch_dir', type=click.Path(file_okay=False), default=None)
+def agent(host, port, slot, slots, cpu_affinity, scratch_dir):
+    agent = RemoteAgent(host, port, slot, slots, cpu_affinity, scratch_dir)
     agent.listen()
 
 
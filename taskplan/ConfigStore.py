@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import threading
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class ConfigStore:
+    DEFAULT_DIR = "config_store"
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.stored_hashes = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def config_hash(config_data):
+        return hashlib.sha256(json.dumps(config_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _path(store_dir, config_hash):
+        return Path(store_dir) / config_hash[:2] / (config_hash + ".json")
+
+    def store(self, config_data):
+        config_hash = self.config_hash(config_data)
+        with self.lock:
+            if config_hash not in self.stored_hashes:
+                path = self._path(self.store_dir, config_hash)
+                if not path.exists():
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+                    with open(str(tmp_path), "w") as handle:
+                        json.dump(config_data, handle, default=str)
+                    os.replace(str(tmp_path), str(path))
+                self.stored_hashes.add(config_hash)
+        return config_hash
+
+    def load(self, config_hash):
+        with open(str(self._path(self.store_dir, config_hash)), "r") as handle:
+            return json.load(handle)
+
+    @staticmethod
+    def locate(task_dir, config_hash, project_file="taskplan.json"):
+        for parent in Path(task_dir).resolve().parents:
+            path = ConfigStore._path(parent / ConfigStore._store_dir_of_project(parent / project_file), config_hash)
+            if path.exists():
+                return path
+        raise LookupError("No stored config with hash " + config_hash + " found for " + str(task_dir))
+
+    @staticmethod
+    def _store_dir_of_project(project_file):
+        # A project can move its store via config_store_dir in its taskplan.json
+        try:
+            with open(str(project_file), "r") as handle:
+                return json.load(handle).get("config_store_dir", ConfigStore.DEFAULT_DIR)
+        except (OSError, ValueError, AttributeError):
+            return ConfigStore.DEFAULT_DIR
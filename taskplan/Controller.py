@@ -7,6 +7,7 @@ from pkg_resources import resource_filename
 from taskconf.config.Configuration import Configuration
 
 from taskplan.EventManager import EventType
+from taskplan.MetadataJournal import MetadataJournal
 from taskplan.Project import Project
 from taskplan.Scheduler import Scheduler
 import queue
@@ -40,6 +41,7 @@ class Controller:
         self.save_metadata()
         self.event_manager = event_manager
         self.last_refresh = 0
+        self.pending_task_layout = None
 
     def save_metadata(self):
         if not self.slim_mode:
@@ -61,6 +63,11 @@ class Controller:
             if not self.slim_mode:
                 self.project.update_clients()
             self.scheduler.schedule()
+            if not self.slim_mode:
+                self.project.apply_task_dir_changes()
+            self.project.trim_on_memory_pressure()
+            if self.pending_task_layout is not None:
+                self._continue_task_layout_migration()
             if not self.slim_mode and self.refresh_interval is not None and time() - self.last_refresh > self.refresh_interval / 1000:
                 self.project.refresh_views()
                 self.last_refresh = time()
@@ -85,12 +92,26 @@ class Controller:
 
         return method
 
+    def _migrate_task_layout(self, sharded, blocking=False):
+        if blocking:
+            self.project.migrate_task_layout(sharded)
+        else:
+            self.pending_task_layout = sharded
+            self.event_manager.log("Started migrating the task directories to the " + ("sharded" if sharded else "flat") + " layout", "Task layout migration started")
+        self.save_metadata()
+
+    def _continue_task_layout_migration(self):
+        moved_tasks, remaining_tasks = self.project.migrate_task_layout(self.pending_task_layout, max_tasks=50)
+        if moved_tasks == 0 and remaining_tasks == 0:
+            self.event_manager.log("All task directories have been migrated to the " + ("sharded" if self.pending_task_layout else "flat") + " layout", "Task layout migration finished")
+            self.pending_task_layout = None
+
     def _update_new_client(self, client):
         self.project.update_new_client(client)
         self.scheduler.update_new_client(client)
 
-    def _start_new_task(self, params, config, total_iterations, is_test=False, device_uuid=None, tags=[]):
-        task = self.project.create_task(params, config, total_iterations, is_test, tags)
+    def _start_new_task(self, params, config, total_iterations, is_test=False, device_uuid=None, tags=[], memory_limit=None):
+        task = self.project.create_task(params, config, total_iterations, is_test, tags, memory_limit)
         self.scheduler.enqueue(task, device_uuid)
         return task
 
@@ -103,6 +124,9 @@ class Controller:
     def _pause_all_tasks(self):
         self.scheduler.pause_and_cancel_all()
 
+    def _preempt_task(self, task_uuid):
+        self.scheduler.preempt(task_uuid)
+
     def _terminate_task(self, task_uuid):
         self.scheduler.terminate(task_uuid)
 
@@ -276,6 +300,22 @@ class Controller:
 
         self.event_manager.log("Task \"" + str(task) + "\" has been cloned", "Task has been cloned")
 
+    def _set_memory_limit(self, task_uuid, memory_limit):
+        task = self.project.find_task_by_uuid(task_uuid)
+        task.set_memory_limit(memory_limit)
+        self.event_manager.throw(EventType.TASK_CHANGED, task)
+
+    def _set_checkpoint_retention(self, task_uuid, checkpoint_retention):
+        task = self.project.find_task_by_uuid(task_uuid)
+        task.set_checkpoint_retention(checkpoint_retention)
+        self.project.prune_checkpoints(task)
+        self.event_manager.throw(EventType.TASK_CHANGED, task)
+
+    def _set_checkpoint_tags(self, task_uuid, checkpoint_id, tags):
+        task = self.project.find_task_by_uuid(task_uuid)
+        task.set_checkpoint_tags(checkpoint_id, tags)
+        self.event_manager.throw(EventType.TASK_CHANGED, task)
+
     def _set_task_notes(self, task_uuid, new_notes):
         task = self.project.find_task_by_uuid(task_uuid)
         task.set_notes(new_notes)
@@ -291,6 +331,9 @@ class Controller:
     def stop(self):
         self.run_update_thread = False
         self.update_thread.join()
+        if self.project.task_dir_watcher is not None:
+            self.project.task_dir_watcher.stop()
+        MetadataJournal.sync_all()
 
     def _connect_device(self, device_uuid):
         self.scheduler.connect_device(device_uuid, self.project)
@@ -315,6 +358,20 @@ class Controller:
     def _get_task_dir(self, task_uuid):
         return self.project.find_task_by_uuid(task_uuid).build_save_dir()
 
+    def _get_task_file(self, task_uuid, name):
+        return self.project.find_task_by_uuid(task_uuid).readable_path(name)
+
+    def _archive_task(self, task_uuid):
+        task = self.project.find_task_by_uuid(task_uuid)
+        if task.archive():
+            self.event_manager.throw(EventType.TASK_CHANGED, task)
+            self.event_manager.log("Task \"" + str(task) + "\" has been archived", "Task has been archived")
+
+    def _unarchive_task(self, task_uuid):
+        task = self.project.find_task_by_uuid(task_uuid)
+        task.unarchive()
+        self.event_manager.throw(EventType.TASK_CHANGED, task)
+
     def _task_exists(self, task_uuid):
         return self.project.find_task_by_uuid(task_uuid) is not None
 
@@ -357,6 +414,9 @@ class Controller:
     def _set_tags(self, task_uuid, tags):
         self.project.set_tags(task_uuid, tags)
 
+    def _disk_usage_summary(self):
+        return self.project.disk_usage_summary()
+
     def _fetch_metrics(self, task_uuid):
         task = self.project.find_task_by_uuid(task_uuid)
         task.update_metrics()
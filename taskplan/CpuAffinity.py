@@ -0,0 +1,83 @@
+import os
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class CpuAffinity:
+    THREAD_ENV_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "TF_NUM_INTRAOP_THREADS"]
+    POLICIES = ["none", "packed", "spread", "numa"]
+
+    @staticmethod
+    def available_cpus():
+        if hasattr(os, "sched_getaffinity"):
+            return sorted(os.sched_getaffinity(0))
+        else:
+            return list(range(os.cpu_count()))
+
+    @staticmethod
+    def parse_cpu_list(cpu_list):
+        cpus = []
+        for part in cpu_list.strip().split(","):
+            if part == "":
+                continue
+            if "-" in part:
+                start, end = part.split("-")
+                cpus.extend(range(int(start), int(end) + 1))
+            else:
+                cpus.append(int(part))
+        return cpus
+
+    @staticmethod
+    def numa_nodes(available_cpus):
+        nodes = []
+        for node_dir in sorted(Path("/sys/devices/system/node").glob("node[0-9]*"), key=lambda path: int(path.name[4:])):
+            try:
+                with open(str(node_dir / "cpulist")) as f:
+                    cpus = [cpu for cpu in CpuAffinity.parse_cpu_list(f.read()) if cpu in available_cpus]
+            except OSError:
+                continue
+            if len(cpus) > 0:
+                nodes.append(cpus)
+
+        if len(nodes) == 0:
+            nodes = [available_cpus]
+        return nodes
+
+    @staticmethod
+    def _chunk(cpus, index, number_of_chunks):
+        if number_of_chunks > len(cpus):
+            return [cpus[index % len(cpus)]]
+        chunk_size, remainder = divmod(len(cpus), number_of_chunks)
+        start = index * chunk_size + min(index, remainder)
+        return cpus[start:start + chunk_size + (1 if index < remainder else 0)]
+
+    @staticmethod
+    def cpus_for_slot(slot, number_of_slots, policy):
+        if policy not in CpuAffinity.POLICIES:
+            raise ValueError("Unknown cpu affinity policy " + str(policy))
+        if policy == "none":
+            return None
+
+        cpus = CpuAffinity.available_cpus()
+        if policy == "packed":
+            return CpuAffinity._chunk(cpus, slot, number_of_slots)
+        elif policy == "spread":
+            return cpus[slot % len(cpus)::max(1, min(number_of_slots, len(cpus)))]
+        else:
+            # Slots are distributed round robin over the nodes and each node's cores are split into disjoint chunks between its slots
+            nodes = CpuAffinity.numa_nodes(cpus)
+            node = slot % len(nodes)
+            slots_on_node = len(range(node, number_of_slots, len(nodes)))
+            return CpuAffinity._chunk(nodes[node], slot // len(nodes), slots_on_node)
+
+    @staticmethod
+    def apply(cpus):
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+
+        for variable in CpuAffinity.THREAD_ENV_VARIABLES:
+            os.environ.setdefault(variable, str(len(cpus)))
+        os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(min(2, len(cpus))))
@@ -1,6 +1,10 @@
+import os
+import signal
 import uuid
 from multiprocessing import Process, Pipe, Lock
 
+from taskplan.CpuAffinity import CpuAffinity
+from taskplan.MemoryWatchdog import MemoryWatchdog
 from taskplan.TaskWrapper import TaskWrapper
 
 
@@ -32,19 +36,34 @@ class Device:
     def run_task(self, task_dir, class_name, config, metadata, print_log):
         raise NotImplemented
 
+    def run_packed_tasks(self, task_dir, class_name, configs, metadatas, print_log):
+        raise NotImplemented
+
+    def supports_packing(self):
+        return False
+
+    def available_memory(self):
+        return None
+
+    def memory_host(self):
+        return str(self.uuid)
+
     def terminate(self):
         raise NotImplemented
 
-    def join(self):
+    def dump_stacks(self):
+        raise NotImplemented
+
+    def join(self, task_uuid=None):
         raise NotImplemented
 
     def is_running(self):
         raise NotImplemented
     
-    def send(self, msg_type, arg=None):
+    def send(self, msg_type, arg=None, task_uuid=None):
         raise NotImplemented
 
-    def recv(self):
+    def recv(self, task_uuid=None):
         raise NotImplemented
 
     def get_name(self):
@@ -54,41 +73,84 @@ class Device:
         raise NotImplemented
 
 class LocalDevice(Device):
-    def __init__(self):
+    def __init__(self, slot=0, number_of_slots=1, cpu_affinity="none", scratch_dir=None):
         super().__init__()
-        self.uuid = "local"
+        self.scratch_dir = scratch_dir
+        self.uuid = "local" if slot == 0 else "local" + str(slot)
+        self.slot = slot
+        self.cpus = CpuAffinity.cpus_for_slot(slot, number_of_slots, cpu_affinity)
         self.process = None
 
         pipe_recv, pipe_send = Pipe(duplex=True)
         self.wrapper_pipe = PipeEnd(pipe_recv)
         self.task_pipe = PipeEnd(pipe_send)
+        self.packed_wrapper_pipes = {}
 
     def run_task(self, task_dir, class_name, config, metadata, print_log):
+        self.packed_wrapper_pipes = {}
         metadata["pipe"] = self.task_pipe
+        metadata["cpus"] = self.cpus
+        metadata["scratch_dir"] = self.scratch_dir
         self.process = Process(target=TaskWrapper._run, args=(task_dir, class_name, config, metadata, print_log))
         self.process.start()
 
+    def run_packed_tasks(self, task_dir, class_name, configs, metadatas, print_log):
+        self.packed_wrapper_pipes = {}
+        for metadata in metadatas:
+            pipe_recv, pipe_send = Pipe(duplex=True)
+            self.packed_wrapper_pipes[metadata["task_uuid"]] = PipeEnd(pipe_recv)
+            metadata["pipe"] = PipeEnd(pipe_send)
+            metadata["cpus"] = self.cpus
+            metadata["scratch_dir"] = self.scratch_dir
+
+        self.process = Process(target=TaskWrapper._run_packed, args=(task_dir, class_name, configs, metadatas, print_log))
+        self.process.start()
+
+    def supports_packing(self):
+        return True
+
+    def available_memory(self):
+        return MemoryWatchdog.available_memory()
+
+    def memory_host(self):
+        # All local slots share the memory of this host
+        return "local"
+
+    def _wrapper_pipe(self, task_uuid):
+        if task_uuid is not None and task_uuid in self.packed_wrapper_pipes:
+            return self.packed_wrapper_pipes[task_uuid]
+        return self.wrapper_pipe
+
     def terminate(self):
-        self.process.terminate()
+        self.process.kill()
+
+    def dump_stacks(self):
+        if self.is_running():
+            os.kill(self.process.pid, signal.SIGUSR1)
 
-    def join(self):
+    def join(self, task_uuid=None):
+        if task_uuid in self.packed_wrapper_pipes:
+            del self.packed_wrapper_pipes[task_uuid]
+            if len(self.packed_wrapper_pipes) > 0:
+                return
         self.process.join(timeout=10)
 
     def is_running(self):
         return self.process is not None and self.process.is_alive()
 
-    def send(self, msg_type, arg=None):
-        self.wrapper_pipe.send(msg_type, arg)
+    def send(self, msg_type, arg=None, task_uuid=None):
+        self._wrapper_pipe(task_uuid).send(msg_type, arg)
 
-    def recv(self):
-        update_available = self.wrapper_pipe.poll(0)
+    def recv(self, task_uuid=None):
+        wrapper_pipe = self._wrapper_pipe(task_uuid)
+        update_available = wrapper_pipe.poll(0)
         if update_available:
-            return self.wrapper_pipe.recv()
+            return wrapper_pipe.recv()
         else:
             return None, None
 
     def get_name(self):
-        return "Local machine"
+        return "Local machine" if self.slot == 0 else "Local machine (slot " + str(self.slot) + ")"
 
     def is_connected(self):
         return -1
@@ -52,6 +52,11 @@ class ServerSentEvent(object):
                 data_client['is_test'] = data.is_test
                 data_client['device'] = None if data.device is None else str(data.device.uuid)
                 data_client['tags'] = data.tags
+                data_client['memory_limit'] = data.memory_limit
+                data_client['peak_memory'] = data.peak_memory
+                data_client['stalled'] = data.stalled
+                data_client['archived'] = data.archived
+                data_client['disk_usage'] = data.total_disk_usage()
                 data_client['name'] = data.name[:-1] if not data.is_test else ["Test"]
                 data_client['try'] = data.name[-1] if not data.is_test and len(data.name) > 0 else 0
         elif event_type in [EventType.PARAM_CHANGED, EventType.PARAM_REMOVED]:
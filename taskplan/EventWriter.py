@@ -0,0 +1,173 @@
+import math
+import socket
+import struct
+import threading
+import time
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+def _build_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC32C_TABLE = _build_crc32c_table()
+
+
+def crc32c(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def _varint(value):
+    if value < 0:
+        value += 1 << 64
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return bytes(result)
+
+
+def _key(field_number, wire_type):
+    return _varint((field_number << 3) | wire_type)
+
+
+def _double_field(field_number, value):
+    return _key(field_number, 1) + struct.pack("<d", value)
+
+
+def _float_field(field_number, value):
+    return _key(field_number, 5) + struct.pack("<f", value)
+
+
+def _int_field(field_number, value):
+    return _key(field_number, 0) + _varint(value)
+
+
+def _bytes_field(field_number, value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return _key(field_number, 2) + _varint(len(value)) + value
+
+
+def _packed_doubles_field(field_number, values):
+    return _bytes_field(field_number, b"".join(struct.pack("<d", value) for value in values))
+
+
+def encode_record(data):
+    header = struct.pack("<Q", len(data))
+    return header + struct.pack("<I", masked_crc32c(header)) + data + struct.pack("<I", masked_crc32c(data))
+
+
+def encode_event(wall_time, step, file_version=None, summary_values=None):
+    event = _double_field(1, wall_time) + _int_field(2, step)
+    if file_version is not None:
+        event += _bytes_field(3, file_version)
+    if summary_values is not None:
+        event += _bytes_field(5, b"".join(_bytes_field(1, value) for value in summary_values))
+    return event
+
+
+def encode_scalar_value(tag, value):
+    return _bytes_field(1, tag) + _float_field(2, float(value))
+
+
+def encode_histogram_value(tag, values, bins):
+    if hasattr(values, "ravel"):
+        values = values.ravel().tolist()
+    values = [float(value) for value in values]
+    if len(values) == 0:
+        raise ValueError("Cannot create a histogram of an empty sequence")
+
+    min_value, max_value = min(values), max(values)
+    bins = max(1, bins) if max_value > min_value else 1
+    width = (max_value - min_value) / bins
+    bucket_limits = [min_value + width * (i + 1) for i in range(bins - 1)] + [max_value]
+    buckets = [0.0] * bins
+    for value in values:
+        index = min(bins - 1, int((value - min_value) / width)) if width > 0 else 0
+        buckets[index] += 1
+
+    histogram = _double_field(1, min_value)
+    histogram += _double_field(2, max_value)
+    histogram += _double_field(3, len(values))
+    histogram += _double_field(4, math.fsum(values))
+    histogram += _double_field(5, math.fsum(value * value for value in values))
+    histogram += _packed_doubles_field(6, bucket_limits)
+    histogram += _packed_doubles_field(7, buckets)
+    return _bytes_field(1, tag) + _bytes_field(5, histogram)
+
+
+class EventWriter:
+
+    def __init__(self, logdir, flush_secs=10, filename_suffix=""):
+        self.logdir = Path(logdir)
+        self.logdir.mkdir(parents=True, exist_ok=True)
+        self.path = self.logdir / ("events.out.tfevents." + str(int(time.time())) + "." + socket.gethostname() + filename_suffix)
+        self.flush_secs = flush_secs
+
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self.file = open(str(self.path), "ab")
+        self._add_event(encode_event(time.time(), 0, file_version="brain.Event:2"))
+
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def _add_event(self, event):
+        record = encode_record(event)
+        with self.pending_lock:
+            self.pending.append(record)
+
+    def add_scalar(self, tag, scalar_value, global_step=0, walltime=None):
+        self._add_event(encode_event(time.time() if walltime is None else walltime, int(global_step), summary_values=[encode_scalar_value(tag, scalar_value)]))
+
+    # Unlike tensorboardX's add_scalars, all values are written into one event of this run, so they show up as separate plots
+    def add_scalar_dict(self, tag_scalar_dict, global_step=0, walltime=None):
+        values = [encode_scalar_value(tag, scalar_value) for tag, scalar_value in tag_scalar_dict.items()]
+        self._add_event(encode_event(time.time() if walltime is None else walltime, int(global_step), summary_values=values))
+
+    def add_histogram(self, tag, values, global_step=0, bins=30, walltime=None):
+        self._add_event(encode_event(time.time() if walltime is None else walltime, int(global_step), summary_values=[encode_histogram_value(tag, values, bins)]))
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_secs):
+            self.flush()
+
+    def flush(self):
+        with self.pending_lock:
+            records, self.pending = self.pending, []
+
+        with self.file_lock:
+            if len(records) > 0 and not self.file.closed:
+                self.file.write(b"".join(records))
+                self.file.flush()
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        with self.file_lock:
+            self.file.close()
@@ -0,0 +1,114 @@
+import errno
+import fcntl
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class FileCloner:
+    FICLONE = 0x40049409
+
+    def __init__(self, max_workers=8, chunk_size=64 * 1024 * 1024):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def _reflink(self, src, dst):
+        with open(str(src), "rb") as src_handle, open(str(dst), "wb") as dst_handle:
+            try:
+                fcntl.ioctl(dst_handle.fileno(), FileCloner.FICLONE, src_handle.fileno())
+                return True
+            except OSError:
+                return False
+
+    def _copy_range(self, src, dst, offset, length):
+        src_fd = os.open(str(src), os.O_RDONLY)
+        dst_fd = os.open(str(dst), os.O_WRONLY)
+        try:
+            end = offset + length
+            while offset < end:
+                if hasattr(os, "copy_file_range"):
+                    copied = os.copy_file_range(src_fd, dst_fd, end - offset, offset, offset)
+                else:
+                    data = os.pread(src_fd, min(end - offset, 1024 * 1024), offset)
+                    copied = os.pwrite(dst_fd, data, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+
+    def _chunked_copy(self, executor, src, dst):
+        size = os.stat(str(src)).st_size
+        with open(str(dst), "wb") as handle:
+            handle.truncate(size)
+        return [executor.submit(self._copy_range, src, dst, offset, min(self.chunk_size, size - offset)) for offset in range(0, size, self.chunk_size)]
+
+    def _clone_file(self, executor, src, dst, immutable):
+        if immutable:
+            try:
+                os.link(str(src), str(dst))
+                return []
+            except OSError:
+                pass
+
+        if self._reflink(src, dst):
+            shutil.copystat(str(src), str(dst))
+            return []
+
+        return self._chunked_copy(executor, src, dst)
+
+    def clone_file_prefix(self, src, dst, length):
+        if self._reflink(src, dst):
+            os.truncate(str(dst), length)
+        else:
+            with open(str(dst), "wb") as handle:
+                handle.truncate(length)
+            self._copy_range(src, dst, 0, length)
+        shutil.copystat(str(src), str(dst))
+
+    def clone_tree(self, src_dir, dst_dir, immutable=None, ignore=[]):
+        src_dir, dst_dir = Path(src_dir), Path(dst_dir)
+        copied_files = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for root, dirs, filenames in os.walk(str(src_dir)):
+                if Path(root) == src_dir:
+                    dirs[:] = [directory for directory in dirs if directory not in ignore]
+                    filenames = [filename for filename in filenames if filename not in ignore]
+
+                relative_root = Path(root).relative_to(src_dir)
+                (dst_dir / relative_root).mkdir(parents=True, exist_ok=True)
+
+                for filename in filenames:
+                    src, dst = Path(root) / filename, dst_dir / relative_root / filename
+                    if src.is_symlink():
+                        os.symlink(os.readlink(str(src)), str(dst))
+                        continue
+
+                    file_futures = self._clone_file(executor, src, dst, immutable is not None and immutable(str(relative_root / filename)))
+                    if len(file_futures) > 0:
+                        futures.extend(file_futures)
+                        copied_files.append((src, dst))
+
+            for future in futures:
+                future.result()
+
+        for src, dst in copied_files:
+            shutil.copystat(str(src), str(dst))
+
+    def move_tree(self, src_dir, dst_dir):
+        try:
+            Path(dst_dir).parent.mkdir(parents=True, exist_ok=True)
+            os.rename(str(src_dir), str(dst_dir))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.clone_tree(src_dir, dst_dir)
+            shutil.rmtree(str(src_dir))
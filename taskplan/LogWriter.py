@@ -0,0 +1,74 @@
+import logging
+import queue
+import threading
+import time
+
+
+class LogWriter:
+
+    def __init__(self, logger, flush_interval=0.5, max_lines_per_interval=0, overflow_policy="drop", sample_every=100):
+        if overflow_policy not in ["drop", "sample"]:
+            raise ValueError("Unknown overflow policy " + str(overflow_policy))
+
+        self.loggers = [logger]
+        self.flush_interval = flush_interval
+        self.max_lines_per_interval = max_lines_per_interval
+        self.overflow_policy = overflow_policy
+        self.sample_every = max(1, sample_every)
+
+        self.lines = queue.SimpleQueue()
+        self.interval_start = time.monotonic()
+        self.lines_in_interval = 0
+        self.skipped_lines = 0
+
+        self.write_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def select(self, loggers):
+        self.loggers = list(loggers)
+
+    def write(self, line, level=logging.INFO, loggers=None):
+        if self.max_lines_per_interval > 0:
+            now = time.monotonic()
+            if now - self.interval_start > self.flush_interval:
+                self.interval_start = now
+                self.lines_in_interval = 0
+
+            self.lines_in_interval += 1
+            over_budget = self.lines_in_interval - self.max_lines_per_interval
+            if over_budget > 0 and level < logging.WARNING:
+                if self.overflow_policy == "drop" or over_budget % self.sample_every != 0:
+                    self.skipped_lines += 1
+                    return
+
+        # The target loggers are determined at write time, as the selection might change until the line is flushed
+        self.lines.put((self.loggers if loggers is None else loggers, line, level))
+
+    def _write_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            batch = []
+            try:
+                while True:
+                    batch.append(self.lines.get_nowait())
+            except queue.Empty:
+                pass
+
+            for loggers, line, level in batch:
+                for logger in loggers:
+                    logger.log(line, level)
+
+            if self.skipped_lines > 0:
+                skipped_lines, self.skipped_lines = self.skipped_lines, 0
+                for logger in self.loggers:
+                    logger.log("Skipped " + str(skipped_lines) + " log lines due to the log volume (policy: " + self.overflow_policy + ")\n", logging.WARNING)
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
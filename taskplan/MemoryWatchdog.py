@@ -0,0 +1,51 @@
+import os
+import resource
+import threading
+
+
+class MemoryWatchdog:
+
+    def __init__(self, memory_limit, on_exceeded, interval=0.5):
+        self.memory_limit = memory_limit
+        self.on_exceeded = on_exceeded
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def current_memory():
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+    @staticmethod
+    def peak_memory():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    @staticmethod
+    def available_memory():
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def start(self):
+        if self.memory_limit is not None:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            memory = self.current_memory()
+            if memory > self.memory_limit:
+                self.on_exceeded(max(memory, self.peak_memory()))
+                os._exit(1)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
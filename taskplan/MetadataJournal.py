@@ -0,0 +1,208 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from filelock import SoftFileLock
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class MetadataJournal:
+    pending_syncs = {}
+    sync_condition = threading.Condition()
+    sync_thread = None
+
+    def __init__(self, task_dir, min_compaction_size=64 * 1024, fsync_interval=1.0, on_write=None):
+        self.task_dir = Path(task_dir)
+        self.snapshot_path = self.task_dir / "metadata.json"
+        self.journal_path = self.task_dir / "metadata.journal"
+        self.lock = SoftFileLock(str(self.task_dir / "metadata.json.lock"))
+        self.min_compaction_size = min_compaction_size
+        self.fsync_interval = fsync_interval
+        self.on_write = on_write
+        self.last_fsync = 0
+
+    def exists(self):
+        return self.snapshot_path.exists() or self.journal_path.exists()
+
+    def load(self):
+        data = {}
+        if self.snapshot_path.exists():
+            with open(str(self.snapshot_path), "r") as handle:
+                data = json.load(handle)
+
+        if self.journal_path.exists():
+            appended = {}
+            with open(str(self.journal_path), "r") as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._apply(data, record, appended)
+        return data
+
+    @staticmethod
+    def _value_key(value):
+        return json.dumps(value, sort_keys=True)
+
+    @staticmethod
+    def _apply(data, record, appended):
+        for key, value in record.get("set", {}).items():
+            data[key] = value
+            appended.pop(key, None)
+
+        for key, values in record.get("remove", {}).items():
+            if key in data:
+                removed = set(MetadataJournal._value_key(value) for value in values)
+                data[key] = [value for value in data[key] if MetadataJournal._value_key(value) not in removed]
+                if key in appended:
+                    appended[key] -= removed
+
+        # Appends are deduplicated, as a journal is replayed on top of its own compaction if the process died in between
+        for key, value in record.get("append", {}).items():
+            if key not in data:
+                data[key] = []
+            if key not in appended:
+                appended[key] = set(MetadataJournal._value_key(existing) for existing in data[key])
+
+            value_key = MetadataJournal._value_key(value)
+            if value_key not in appended[key]:
+                data[key].append(value)
+                appended[key].add(value_key)
+
+    def update(self, values=None, appends=None, removes=None):
+        record = {}
+        if values:
+            record["set"] = values
+        if appends:
+            record["append"] = appends
+        if removes:
+            record["remove"] = removes
+        line = (json.dumps(record) + "\n").encode("utf-8")
+
+        with self.lock:
+            fd = os.open(str(self.journal_path), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                journal_size = os.fstat(fd).st_size
+                if journal_size > 0 and os.pread(fd, 1, journal_size - 1) != b"\n":
+                    line = b"\n" + line
+                os.write(fd, line)
+                if time.time() - self.last_fsync >= self.fsync_interval:
+                    os.fsync(fd)
+                    self.last_fsync = time.time()
+                    MetadataJournal._discard_sync(self.journal_path)
+                else:
+                    MetadataJournal._defer_sync(self.journal_path, self.fsync_interval)
+                journal_size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+            snapshot_size = self.snapshot_path.stat().st_size if self.snapshot_path.exists() else 0
+            if journal_size > max(self.min_compaction_size, snapshot_size):
+                self.compact()
+            elif self.on_write is not None:
+                self.on_write(self.task_dir)
+
+    def sync(self):
+        MetadataJournal._fsync_file(self.journal_path)
+        MetadataJournal._discard_sync(self.journal_path)
+        self.last_fsync = time.time()
+
+    @staticmethod
+    def _fsync_file(path):
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _discard_sync(path):
+        with MetadataJournal.sync_condition:
+            MetadataJournal.pending_syncs.pop(str(path), None)
+
+    @staticmethod
+    def _defer_sync(path, delay):
+        with MetadataJournal.sync_condition:
+            MetadataJournal.pending_syncs.setdefault(str(path), time.time() + delay)
+            if MetadataJournal.sync_thread is None:
+                MetadataJournal.sync_thread = threading.Thread(target=MetadataJournal._sync_loop, daemon=True)
+                MetadataJournal.sync_thread.start()
+            MetadataJournal.sync_condition.notify()
+
+    @staticmethod
+    def _sync_loop():
+        while True:
+            with MetadataJournal.sync_condition:
+                while len(MetadataJournal.pending_syncs) == 0:
+                    MetadataJournal.sync_condition.wait()
+
+                now = time.time()
+                next_deadline = min(MetadataJournal.pending_syncs.values())
+                if next_deadline > now:
+                    MetadataJournal.sync_condition.wait(next_deadline - now)
+                    continue
+
+                due_paths = [path for path, deadline in MetadataJournal.pending_syncs.items() if deadline <= now]
+                for path in due_paths:
+                    del MetadataJournal.pending_syncs[path]
+
+            for path in due_paths:
+                MetadataJournal._fsync_file(path)
+
+    @staticmethod
+    def sync_all():
+        with MetadataJournal.sync_condition:
+            paths = list(MetadataJournal.pending_syncs.keys())
+            MetadataJournal.pending_syncs.clear()
+
+        for path in paths:
+            MetadataJournal._fsync_file(path)
+
+    @staticmethod
+    def _reset_after_fork():
+        MetadataJournal.pending_syncs = {}
+        MetadataJournal.sync_condition = threading.Condition()
+        MetadataJournal.sync_thread = None
+
+    def compact(self):
+        with self.lock:
+            data = self.load()
+
+            tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+            with open(str(tmp_path), "w") as handle:
+                json.dump(data, handle)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(str(tmp_path), str(self.snapshot_path))
+            self._sync_dir()
+
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+                self._sync_dir()
+            MetadataJournal._discard_sync(self.journal_path)
+
+            if self.on_write is not None:
+                self.on_write(self.task_dir)
+
+    def _sync_dir(self):
+        fd = os.open(str(self.task_dir), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+atexit.register(MetadataJournal.sync_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=MetadataJournal._reset_after_fork)
@@ -1,7 +1,8 @@
 import sys
 import threading
 import traceback
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from taskplan.Utility import Utility
@@ -13,7 +14,16 @@ try:
 except ImportError:
   from pathlib import Path
 
+from taskplan.CheckpointCollector import CheckpointCollector
+from taskplan.CheckpointRetention import CheckpointRetention
+from taskplan.CheckpointStore import CheckpointStore
+from taskplan.ConfigStore import ConfigStore
 from taskplan.EventManager import EventType
+from taskplan.FileCloner import FileCloner
+from taskplan.MemoryWatchdog import MemoryWatchdog
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.TaskCatalog import TaskCatalog
+from taskplan.TaskDirWatcher import TaskDirWatcher
 from taskplan.TaskWrapper import TaskWrapper, State
 from taskplan.ProjectConfiguration import ProjectConfiguration
 import subprocess
@@ -21,18 +31,19 @@ import time
 import uuid
 import json
 import shutil
-import tensorflow as tf
 import math
 import ast
 
 class Project:
 
-    def __init__(self, event_manager, metadata, task_dir=".", task_class_name="Task", tasks_dir="tasks", config_dir="config", test_dir="tests", views_dir="views", tasks_to_load=None, git_white_list=[], slim_mode=False, taskconfig_path=""):
+    def __init__(self, event_manager, metadata, task_dir=".", task_class_name="Task", tasks_dir="tasks", config_dir="config", test_dir="tests", views_dir="views", tasks_to_load=None, git_white_list=[], slim_mode=False, taskconfig_path="", log_settings={}, shared_array_settings={}, checkpoint_store_dir="checkpoint_store", copy_settings={}, checkpoint_retention={}, archive_settings={}, shard_tasks_dir=False, task_catalog="task_catalog.sqlite", load_workers=16, watch_settings={}, max_hydrated_tasks=1000, min_available_memory=256, config_store_dir=ConfigStore.DEFAULT_DIR):
         self.task_dir = Path(task_dir).resolve()
         self.task_class_name = task_class_name
         self.event_manager = event_manager
         self.slim_mode = slim_mode
         self.taskconfig_path = taskconfig_path
+        self.log_settings = log_settings
+        self.shared_array_settings = shared_array_settings
 
         self.config_dir = self.task_dir / Path(config_dir)
         if not self.config_dir.exists() or len(list(self.config_dir.iterdir())) == 0:
@@ -45,7 +56,22 @@ class Project:
         self.test_dir.mkdir(exist_ok=True, parents=True)
         self.views_dir = self.task_dir / Path(views_dir)
         self.views_dir.mkdir(exist_ok=True, parents=True)
+        self.checkpoint_store = CheckpointStore(self.task_dir / Path(checkpoint_store_dir))
+        self.config_store = ConfigStore(self.task_dir / Path(config_store_dir))
+        self.file_cloner = FileCloner(**copy_settings)
+        self.checkpoint_retention = checkpoint_retention
+        self.retention_metric_warnings = set()
+        self.archive_settings = archive_settings
+        self.shard_tasks_dir = shard_tasks_dir
+        self.load_workers = load_workers
+        self.task_dir_watcher = TaskDirWatcher(self.tasks_dir, **watch_settings) if watch_settings is not None and not slim_mode else None
+        self.checkpoint_collector = CheckpointCollector(self.checkpoint_store)
+        self.task_catalog = TaskCatalog(self.task_dir / Path(task_catalog) if task_catalog is not None else None)
         self.tasks = []
+        self.tasks_by_uuid = {}
+        self.hydrated_tasks = OrderedDict()
+        self.max_hydrated_tasks = max_hydrated_tasks
+        self.min_available_memory = min_available_memory
         self.tensorboard_ports = {}
         self.tensorboard_threads = {}
         self.next_tensorboard_port = 7000
@@ -60,6 +86,8 @@ class Project:
 
         self.all_tags = Counter()
 
+        if self.task_dir_watcher is not None and tasks_to_load is None:
+            self.task_dir_watcher.start()
         self._load_saved_tasks(tasks_to_load)
 
     def _refresh_default_view(self):
@@ -92,11 +120,14 @@ class Project:
 
     def save_metadata(self):
         return {**{
-            "views": self.views_data
+            "views": self.views_data,
+            "shard_tasks_dir": self.shard_tasks_dir
         }, **self.version_control.save_metadata()}
 
     def _load_metadata(self, metadata):
         self.version_control.load_metadata(metadata)
+        if 'shard_tasks_dir' in metadata:
+            self.shard_tasks_dir = metadata['shard_tasks_dir']
         if not self.slim_mode:
             if 'views' in metadata:
                 self.views_data = metadata['views']
@@ -107,35 +138,114 @@ class Project:
             #    self.add_view("results", {"filter": {}, "collapse": [], "group": [], "collapse_sorting": ["saved", True], "sorting_tasks": ["saved", True], "param_sorting": {}, "version_in_name": "label", "force_param_in_name": [], "collapse_enabled": False, "path": null}, True)
 
     def _load_saved_tasks(self, tasks_to_load):
+        timings = {}
         if tasks_to_load is None or len(tasks_to_load) > 0:
-            for task in self.tasks_dir.iterdir():
-                if task.is_dir() and (tasks_to_load is None or task.name in tasks_to_load):
-                    self._load_saved_task(task)
+            start_time = time.time()
+            task_dirs = list(self._saved_task_dirs())
+            timings["scan"] = time.time() - start_time
 
+            paths = [path for path in task_dirs if tasks_to_load is None or path.name in tasks_to_load]
+            timings["read"], timings["register"], loaded_tasks = self._load_saved_task_batch(paths)
+
+            start_time = time.time()
+            if tasks_to_load is None:
+                self.task_catalog.prune(task_dirs)
+            self.task_catalog.commit()
+            timings["catalog"] = time.time() - start_time
+
+            start_time = time.time()
             if not self.slim_mode:
                 self.refresh_all_views(False)
+            timings["views"] = time.time() - start_time
 
             if self.test_dir.exists() and len(list(self.test_dir.iterdir())) > 0:
                 self._load_saved_task(self.test_dir, is_test=True)
-        print("Loaded " + str(len(self.tasks)) + " tasks.")
-
-    def _load_saved_task(self, path, is_test=False):
-        if not any(path.iterdir()):
-            try:
-                shutil.rmtree(path)
-                print("Removed empty directory " + str(path))
-            except OSError:
-                print(str(path) + " is empty but could not be removed.")
+        print("Loaded " + str(len(self.tasks)) + " tasks" + ("" if len(timings) == 0 else " (" + ", ".join(phase + ": " + "{:.2f}s".format(duration) for phase, duration in timings.items()) + ")"))
+
+    def _load_saved_task_batch(self, paths):
+        read_time, register_time = 0, 0
+        loaded_tasks = []
+        with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+            saved_data = executor.map(self._read_saved_task, paths)
+            for i, path in enumerate(paths):
+                start_time = time.time()
+                data = next(saved_data)
+                read_time += time.time() - start_time
+
+                start_time = time.time()
+                if data is not None:
+                    task = self._load_saved_task(path, data=data)
+                    if task is not None:
+                        loaded_tasks.append(task)
+                register_time += time.time() - start_time
+
+                if (i + 1) % 1000 == 0:
+                    print("Loading tasks: " + str(i + 1) + "/" + str(len(paths)))
+        return read_time, register_time, loaded_tasks
+
+    def _read_saved_task(self, path, is_test=False):
+        try:
+            data = None if is_test else self.task_catalog.load(path)
+            if data is None and not any(path.iterdir()):
+                try:
+                    shutil.rmtree(path)
+                    print("Removed empty directory " + str(path))
+                except OSError:
+                    print(str(path) + " is empty but could not be removed.")
+                return None
+
+            if data is None and not MetadataJournal(path).exists():
+                print(str(path) + " does not contain a metadata.json, so probably not a task.")
+                return None
+
+            if data is None:
+                data = MetadataJournal(path).load(), TaskCatalog.read_metrics(path)
+            return data
+        except:
+            print("Warning: Could not read task: " + str(path))
+            print(traceback.format_exc())
             return None
 
-        if not (path / "metadata.json").exists():
-            print(str(path) + " does not contain a metadata.json, so probably not a task.")
-            return None
+    def _saved_task_dirs(self):
+        for path in self.tasks_dir.iterdir():
+            if not path.is_dir() or path.is_symlink():
+                continue
+
+            if len(path.name) == 2 and not MetadataJournal(path).exists():
+                for task_path in path.iterdir():
+                    if task_path.is_dir() and not task_path.is_symlink():
+                        yield task_path
+            else:
+                yield path
+
+    def migrate_task_layout(self, sharded, max_tasks=None):
+        self.shard_tasks_dir = sharded
+        moved_tasks, remaining_tasks = 0, 0
+        for task in self.tasks:
+            if task.is_test or task.sharded == sharded:
+                continue
+
+            if (max_tasks is None or moved_tasks < max_tasks) and task.set_sharded(sharded):
+                moved_tasks += 1
+                # Only the links of the moved task are updated, as rebuilding all views per batch would be quadratic in the number of tasks
+                if not self.slim_mode:
+                    for view in list(self.views.values()) + [self.default_view]:
+                        view.relink_task(task)
+            else:
+                remaining_tasks += 1
+        return moved_tasks, remaining_tasks
+
+    def _load_saved_task(self, path, is_test=False, data=None):
+        if data is None:
+            data = self._read_saved_task(path, is_test)
+            if data is None:
+                return None
 
         try:
             task = TaskWrapper(self.task_dir, self.task_class_name, None, self, 0, is_test=is_test, tasks_dir=self.test_dir if is_test else self.tasks_dir)
-            task.load_metadata(path)
-            task.load_metric_cache(path)
+            task.sharded = not is_test and path.parent != self.tasks_dir
+            task.load_metadata(path, data=data[0], hydrate=False)
+            task.load_metric_cache(path, data=data[1])
         except:
             print("Warning: Could not load task: " + str(path))
             print(traceback.format_exc())
@@ -149,6 +259,7 @@ class Project:
 
         self._register_tags_from_task(task)
         self.tasks.append(task)
+        self.tasks_by_uuid[str(task.uuid)] = task
         self.configuration.register_task(task)
         return task
 
@@ -162,7 +273,7 @@ class Project:
             if tag in self.all_tags:
                 del self.all_tags[tag]
 
-    def create_task(self, param_values, config, total_iterations, is_test=False, tags=[]):
+    def create_task(self, param_values, config, total_iterations, is_test=False, tags=[], memory_limit=None):
         params = self.configuration.get_params()
 
         base_uuids = {}
@@ -179,7 +290,7 @@ class Project:
                     base_uuids[iteration].append([param_values[iteration][str(param.uuid)][0]] + param_values[iteration][str(param.uuid)][1:])
 
         task_config = self.configuration.add_task(base_uuids, config)
-        task = self._create_task_from_config(task_config, total_iterations, is_test, tags)
+        task = self._create_task_from_config(task_config, total_iterations, is_test, tags, memory_limit)
 
         self.event_manager.throw(EventType.PROJECT_CHANGED, self)
         return task
@@ -234,24 +345,31 @@ class Project:
 
         return self.configuration.add_task(selected_base_uuids, {}), param_visibility
 
-    def _create_task_from_config(self, task_config, total_iterations, is_test=False, tags=[]):
+    def _create_task_from_config(self, task_config, total_iterations, is_test=False, tags=[], memory_limit=None):
         if is_test:
             tasks_dir = self.test_dir
         else:
             tasks_dir = self.tasks_dir
 
         if is_test:
-            for task in self.tasks:
-                if task.is_test:
-                    if task.state in [State.RUNNING, State.QUEUED]:
-                        raise Exception("A test is already running")
-                    self.remove_task(task)
-                    self.event_manager.throw(EventType.TASK_REMOVED, task)
-                    break
-
-        task = TaskWrapper(self.task_dir, self.task_class_name, task_config, self, total_iterations, tasks_dir=tasks_dir, is_test=is_test, tags=tags)
+            previous_test = next((task for task in self.tasks if task.is_test), None)
+            if previous_test is not None:
+                if previous_test.state in [State.RUNNING, State.QUEUED]:
+                    raise Exception("A test is already running")
+                self.remove_task(previous_test)
+                self.event_manager.throw(EventType.TASK_REMOVED, previous_test)
+            elif MetadataJournal(self.test_dir).exists():
+                # The checkpoints of a test which has not been loaded would otherwise never be released, as its metadata is overwritten by the new test
+                for checkpoint in MetadataJournal(self.test_dir).load().get("checkpoints", []):
+                    if "manifest" in checkpoint:
+                        self.checkpoint_collector.release(checkpoint["manifest"])
+                shutil.rmtree(str(self.test_dir), ignore_errors=True)
+
+        task = TaskWrapper(self.task_dir, self.task_class_name, task_config, self, total_iterations, tasks_dir=tasks_dir, is_test=is_test, tags=tags, memory_limit=memory_limit)
         task.save_metadata()
         self.tasks.append(task)
+        self.tasks_by_uuid[str(task.uuid)] = task
+        self.note_hydrated(task)
         self.configuration.register_task(task)
         self._register_tags_from_task(task)
 
@@ -264,10 +382,36 @@ class Project:
         if not isinstance(uuid, str):
             uuid = str(uuid)
 
-        for task in self.tasks:
-            if str(task.uuid) == uuid:
-                return task
-        return None
+        return self.tasks_by_uuid.get(uuid)
+
+    def load_task_config(self, config_data):
+        if "ref" in config_data:
+            task_config = self.configuration.interned_task_config(config_data["ref"])
+            if task_config is None:
+                task_config = self.configuration.load_task(self.config_store.load(config_data["ref"]))
+            return task_config
+        return self.configuration.load_task(config_data)
+
+    def note_hydrated(self, task):
+        self.hydrated_tasks[str(task.uuid)] = task
+        self.hydrated_tasks.move_to_end(str(task.uuid))
+        if len(self.hydrated_tasks) > self.max_hydrated_tasks:
+            self.trim_hydrated_tasks(self.max_hydrated_tasks)
+
+    def trim_hydrated_tasks(self, max_tasks):
+        for task_uuid, task in list(self.hydrated_tasks.items()):
+            if len(self.hydrated_tasks) <= max_tasks:
+                break
+            if task.dehydrate():
+                del self.hydrated_tasks[task_uuid]
+
+    def trim_on_memory_pressure(self):
+        available_memory = MemoryWatchdog.available_memory()
+        if available_memory is not None and available_memory < self.min_available_memory:
+            self.trim_hydrated_tasks(0)
+
+    def _has_task(self, task):
+        return self.tasks_by_uuid.get(str(task.uuid)) is task
 
     def find_test_task_by_config(self, config_uuid):
         for task in self.tasks:
@@ -310,8 +454,10 @@ class Project:
                 self.event_manager.throw(EventType.PROJECT_CHANGED, self)
 
     def remove_task(self, task):
-        if task in self.tasks:
+        if self._has_task(task):
             self.tasks.remove(task)
+            del self.tasks_by_uuid[str(task.uuid)]
+            self.hydrated_tasks.pop(str(task.uuid), None)
             self.configuration.deregister_task(task)
             if not self.slim_mode:
                 self.refresh_all_views()
@@ -358,20 +504,22 @@ class Project:
                 break
 
     def clone_task(self, task):
-        if task in self.tasks and not task.is_test:
+        if self._has_task(task) and not task.is_test:
             task_config = self.configuration.add_task({"0": []}, {})
 
             cloned_task = self._create_task_from_config(task_config, task.total_iterations)
             new_uuid = cloned_task.uuid
 
             shutil.rmtree(str(cloned_task.build_save_dir()))
-            shutil.copytree(str(task.build_save_dir()), str(cloned_task.build_save_dir()))
+            self.file_cloner.clone_tree(task.build_save_dir(), cloned_task.build_save_dir(), immutable=lambda path: Path(path).parts[0] == "checkpoints", ignore=["metadata.json.lock"])
 
-            cloned_task.load_metadata(cloned_task.build_save_dir())
+            # The task is hydrated only after it got its own uuid, as it would otherwise take the place of the original task among the hydrated tasks
+            cloned_task.load_metadata(cloned_task.build_save_dir(), hydrate=False)
 
             cloned_task.state = State.STOPPED
             cloned_task.uuid = new_uuid
             cloned_task.creation_time = datetime.now()
+            cloned_task.retain_checkpoints()
             cloned_task.save_metadata()
             cloned_task.metrics = task.metrics
             cloned_task.last_metrics_update = task.last_metrics_update
@@ -382,8 +530,8 @@ class Project:
             return cloned_task
 
     def extract_checkpoint(self, task, checkpoint_id):
-        if task in self.tasks and not task.is_test:
-            checkpoint_dir = task.build_checkpoint_dir(checkpoint_id)
+        if self._has_task(task) and not task.is_test:
+            checkpoint = task.checkpoints[checkpoint_id]
             task_config = self.configuration.add_task({"0": []}, {})
 
             new_task = self._create_task_from_config(task_config, task.total_iterations)
@@ -391,24 +539,64 @@ class Project:
 
             new_task_dir = new_task.build_save_dir()
             shutil.rmtree(str(new_task_dir))
-            shutil.copytree(str(checkpoint_dir), str(new_task_dir))
-            for file in new_task_dir.glob("events.out.checkpoint.*"):
-                file.rename(str(file).replace("events.out.checkpoint", "events.out.tfevents"))
+            if "manifest" in checkpoint:
+                # Stored checkpoints are materialized right into the new task, so their files are only written once
+                task.materialize_checkpoint(checkpoint_id, new_task_dir)
+                # Checkpoints materialized inside the task by earlier extractions are not needed anymore
+                shutil.rmtree(str(task.checkpoint_dir(checkpoint)), ignore_errors=True)
+            else:
+                self.file_cloner.clone_tree(task.build_checkpoint_dir(checkpoint_id), new_task_dir)
+                for file in new_task_dir.glob("events.out.checkpoint.*"):
+                    file.rename(str(file).replace("events.out.checkpoint", "events.out.tfevents"))
 
-            new_task.load_metadata(new_task.build_save_dir())
+            new_task.load_metadata(new_task.build_save_dir(), hydrate=False)
             new_task.load_metric_cache(new_task.build_save_dir())
 
             new_task.state = State.STOPPED
             new_task.uuid = new_uuid
             new_task.creation_time = datetime.now()
+            # The metadata inside the checkpoint might have been stored after the task made further progress
+            new_task.finished_iterations = task.checkpoints[checkpoint_id]["finished_iterations"]
             new_task.checkpoints = []
+            new_task.checkpoint_sequence = 0
             new_task.save_metadata()
+            new_task.refresh_disk_usage(recount=True)
 
             if not self.slim_mode:
                 self.add_task_to_views(new_task)
 
             return new_task
 
+    def prune_checkpoints(self, task):
+        retention = CheckpointRetention(**(task.checkpoint_retention if task.checkpoint_retention is not None else self.checkpoint_retention))
+        if retention.keep_best > 0 and not retention.has_metric(task.checkpoints) and task.uuid not in self.retention_metric_warnings:
+            self.retention_metric_warnings.add(task.uuid)
+            print("Warning: keep_best is configured for task " + str(task.uuid) + ", but none of its checkpoints contains the metric " + str(retention.metric) + ". Checkpoint metrics have to be returned by Task.checkpoint_metrics().")
+        pruned_checkpoints = retention.checkpoints_to_prune(task.checkpoints)
+        if len(pruned_checkpoints) > 0:
+            task.remove_checkpoints(pruned_checkpoints)
+            for checkpoint in pruned_checkpoints:
+                self.checkpoint_collector.collect(task.checkpoint_dir(checkpoint), checkpoint.get("manifest"))
+            self.event_manager.throw(EventType.TASK_CHANGED, task)
+
+    def disk_usage_summary(self):
+        summary = {"total": 0, "tags": Counter(), "param_values": Counter(), "views": Counter()}
+        for task in self.tasks:
+            disk_usage = task.total_disk_usage()
+            if disk_usage is None:
+                continue
+
+            summary["total"] += disk_usage
+            for tag in task.tags:
+                summary["tags"][tag] += disk_usage
+            if "0" in task.config.base_configs:
+                for param_value in task.config.base_configs["0"]:
+                    summary["param_values"][str(param_value[0].uuid)] += disk_usage
+            for name, view in self.views.items():
+                if str(task.uuid) in view.task_by_uuid:
+                    summary["views"][name] += disk_usage
+        return summary
+
     def add_task_to_views(self, new_task):
         for view in self.views.values():
             view.add_task(new_task)
@@ -441,30 +629,88 @@ class Project:
             self._default_view_refresh_names()
 
     def reload(self):
-        task_uuids = []
-        for task in self.tasks[:]:
-            success = task.reload()
+        tasks = self.tasks[:]
+        with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+            saved_metadata = list(executor.map(lambda task: task.read_saved_metadata(), tasks))
+
+        task_uuids = set()
+        for task, data in zip(tasks, saved_metadata):
+            success = data is not None and task.reload(data)
             if success:
-                task_uuids.append(str(task.uuid))
+                task_uuids.add(str(task.uuid))
                 #self.event_manager.throw(EventType.TASK_CHANGED, task)
             else:
                 self.remove_task(task)
 
-        added_tasks = []
-        for task in self.tasks_dir.iterdir():
-            if task.is_dir() and task.name not in task_uuids:
-                task = self._load_saved_task(task)
-                if task is None:
+        read_time, register_time, added_tasks = self._load_saved_task_batch([path for path in self._saved_task_dirs() if path.name not in task_uuids])
+        self.task_catalog.commit()
+        for task in added_tasks:
+            for view in self.views.values():
+                view.add_task(task)
+            self.default_view.add_task(task)
+
+        self._default_view_refresh_names()
+        for task in added_tasks:
+            self.event_manager.throw(EventType.TASK_CHANGED, task)
+
+    def note_task_dir_written(self, path):
+        if self.task_dir_watcher is not None and self.task_dir_watcher.thread is not None:
+            self.task_dir_watcher.note_written(path)
+
+    def apply_task_dir_changes(self):
+        if self.task_dir_watcher is None or self.task_dir_watcher.thread is None:
+            return
+
+        changed_dirs, rescan = self.task_dir_watcher.pop_changes()
+        if rescan:
+            self.reload()
+            return
+        if len(changed_dirs) == 0:
+            return
+
+        for path in changed_dirs:
+            task = self.tasks_by_uuid.get(path.name)
+            if task is not None and not task.is_test and task.build_save_dir() != path and not task.build_save_dir().exists() and MetadataJournal(path).exists():
+                task.set_save_dir_layout(path.parent != self.tasks_dir)
+
+        changed_tasks, new_paths, config_changed = [], [], False
+        for path in changed_dirs:
+            task = self.tasks_by_uuid.get(path.name)
+            if task is not None and (task.is_test or task.build_save_dir() != path):
+                continue
+            if task is None:
+                if MetadataJournal(path).exists():
+                    new_paths.append(path)
+            elif task.state not in [State.RUNNING, State.QUEUED]:
+                data = task.read_saved_metadata()
+                if data is None:
+                    self.remove_task(task)
                     continue
 
-                for view in self.views.values():
-                    view.add_task(task)
+                old_config = task.config.data
+                self.configuration.deregister_task(task)
+                self._deregister_tags_from_task(task)
+                task.reload(data)
+                task.load_metric_cache(path)
+                self.configuration.register_task(task)
+                self._register_tags_from_task(task)
+                config_changed = config_changed or task.config.data != old_config
+                changed_tasks.append(task)
+
+        read_time, register_time, added_tasks = self._load_saved_task_batch(new_paths)
+        self.task_catalog.commit()
+        if not self.slim_mode:
+            if config_changed:
+                self.refresh_all_views()
+            else:
+                for task in added_tasks:
+                    for view in self.views.values():
+                        view.add_task(task)
                     self.default_view.add_task(task)
+                if len(added_tasks) > 0:
+                    self._default_view_refresh_names()
 
-                added_tasks.append(task)
-
-        self._default_view_refresh_names()
-        for task in added_tasks:
+        for task in changed_tasks + added_tasks:
             self.event_manager.throw(EventType.TASK_CHANGED, task)
 
     def add_param(self, new_data):
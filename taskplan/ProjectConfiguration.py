@@ -1,8 +1,11 @@
 import collections
+import copy
+import weakref
 
 from taskconf.config.ConfigurationManager import ConfigurationManager
 import json
 
+from taskplan.ConfigStore import ConfigStore
 from taskplan.EventManager import EventType
 from taskplan.Utility import Utility
 
@@ -14,11 +17,21 @@ class ProjectConfiguration:
 
     def _reset(self, config_dir):
         self.configuration = ConfigurationManager(str(config_dir))
+        self.task_configs = weakref.WeakValueDictionary()
+        self.built_task_configs = weakref.WeakValueDictionary()
+        self.revision = 0
         self.params_conf_path = "taskplan_params.json"
         self.param_values_conf_path = "taskplan_param_values.json"
         self.code_versions_conf_path = "taskplan_codeversions.json"
         self.settings = []
 
+        self.param_values_by_param = {}
+        self.param_of_param_value = {}
+        for param in self.get_params():
+            self.param_values_by_param[str(param.uuid)] = []
+        for param_value in self.get_param_values():
+            self._index_param_value(param_value, param_value.get_metadata('param'))
+
         self.param_groups = {}
         for param in self.get_params():
             self._recalc_param_group(param)
@@ -28,6 +41,10 @@ class ProjectConfiguration:
 
         self.number_of_tasks_per_param_value_key = {}
 
+    def _save_configuration(self):
+        self.revision += 1
+        self.configuration.save()
+
     def register_task(self, task):
         if "0" in task.config.base_configs:
             for param_value in task.config.base_configs["0"]:
@@ -77,7 +94,7 @@ class ProjectConfiguration:
                 save_necessary = True
 
         if save_necessary:
-            self.configuration.save()
+            self._save_configuration()
 
     def _max_sorting(self):
         max_sorting = 0
@@ -111,14 +128,14 @@ class ProjectConfiguration:
                 changed_params.append(sorted_params[i])
 
         changed_params.append(param)
-        self.configuration.save()
+        self._save_configuration()
 
         return changed_params
 
     def force_param(self, param_uuid, enabled):
         param = self.get_config(param_uuid)
         param.set_metadata("force", enabled)
-        self.configuration.save()
+        self._save_configuration()
         return param
 
     def _swap_sorting(self, first_param, second_param):
@@ -127,12 +144,29 @@ class ProjectConfiguration:
         second_param.set_metadata("sorting", first_sorting)
 
 
+    def _index_param_value(self, param_value, param_uuid):
+        self.param_values_by_param.setdefault(str(param_uuid), []).append(param_value)
+        self.param_of_param_value[str(param_value.uuid)] = str(param_uuid)
+
+    def _unindex_param_value(self, param_value):
+        param_uuid = self.param_of_param_value.pop(str(param_value.uuid), None)
+        if param_uuid is not None:
+            self.param_values_by_param[param_uuid] = [other for other in self.param_values_by_param[param_uuid] if other is not param_value]
+        return param_uuid
+
+    def get_param_values_of_param(self, param_uuid):
+        return self.param_values_by_param.get(str(param_uuid), [])
+
+    def find_param_value(self, param_value_uuid):
+        if str(param_value_uuid) in self.param_of_param_value:
+            return self.configuration.configs_by_uuid.get(str(param_value_uuid))
+        return None
+
     def _recalc_param_group(self, param):
         merged_config = {}
 
-        for param_value in self.get_param_values():
-            if param_value.get_metadata('param') == str(param.uuid):
-                self._deep_update(merged_config, param_value.get_merged_config(True))
+        for param_value in self.get_param_values_of_param(param.uuid):
+            self._deep_update(merged_config, param_value.get_merged_config(True))
 
         merged_timesteps = {}
         for timestep in merged_config.keys():
@@ -160,6 +194,7 @@ class ProjectConfiguration:
         new_data["sorting"] = self._max_sorting() + 1
         param = self.configuration.add_config(new_data, self.params_conf_path)
         self.param_groups[str(param.uuid)] = []
+        self.param_values_by_param[str(param.uuid)] = []
         return param
 
     def add_param_batch(self, config):
@@ -203,15 +238,16 @@ class ProjectConfiguration:
             metadata["isTemplate"] = new_data["isTemplate"]
 
         param_value = self.configuration.add_config(new_data, self.param_values_conf_path, metadata)
+        self._index_param_value(param_value, param_uuid)
 
         param = self.get_config(param_uuid)
         self._recalc_param_group(param)
         if param.get_metadata("deprecated_param_value") == "":
             param.set_metadata("deprecated_param_value", str(param_value.uuid))
-            self.configuration.save()
+            self._save_configuration()
         if param.get_metadata("default_param_value") == "":
             param.set_metadata("default_param_value", str(param_value.uuid))
-            self.configuration.save()
+            self._save_configuration()
 
         return param, param_value
 
@@ -228,7 +264,7 @@ class ProjectConfiguration:
         param.set_metadata("default_param_value", new_data["default_param_value"])
         param.set_metadata("sorting", new_data["sorting"])
 
-        self.configuration.save()
+        self._save_configuration()
         return param
 
     def edit_param_value(self, param_uuid, param_value_uuid, new_data):
@@ -238,10 +274,15 @@ class ProjectConfiguration:
         new_data['param'] = param_uuid
         param_value.set_data(new_data)
 
+        old_param_uuid = self._unindex_param_value(param_value)
+        self._index_param_value(param_value, param_uuid)
+        if old_param_uuid is not None and old_param_uuid != str(param_uuid) and old_param_uuid in self.configuration.configs_by_uuid:
+            self._recalc_param_group(self.get_config(old_param_uuid))
+
         param = self.get_config(param_uuid)
         self._recalc_param_group(param)
 
-        self.configuration.save()
+        self._save_configuration()
         return param, param_value
 
     def add_task(self, base_uuids, config):
@@ -250,14 +291,37 @@ class ProjectConfiguration:
         config_data['config'] = config
         config_data['base'] = base_uuids
 
+        return self._build_task_config(config_data)
+
+    def _build_task_config(self, config_data):
+        # Configs built from the same data are reused before building them again, the revision makes sure changed params and param values lead to a new config
+        build_hash = ConfigStore.config_hash([config_data, self.revision])
+        task_config = self.built_task_configs.get(build_hash)
+        if task_config is not None:
+            return task_config
+
         task_config = self.configuration.add_config(config_data, None)
         config_data['config'] = task_config.get_merged_config()
         if task_config.dynamic:
             config_data['dynamic'] = True
         task_config.set_data(config_data)
 
+        task_config = self.intern_task_config(task_config)
+        self.built_task_configs[build_hash] = task_config
         return task_config
 
+    def intern_task_config(self, task_config):
+        config_hash = ConfigStore.config_hash(task_config.data)
+        interned_config = self.task_configs.get(config_hash)
+        if interned_config is not None:
+            return interned_config
+
+        self.task_configs[config_hash] = task_config
+        return task_config
+
+    def interned_task_config(self, config_hash):
+        return self.task_configs.get(config_hash)
+
     def collect_visible_bases(self, base_uuids, param_uuids):
         task_config = self.add_task(base_uuids, {})
         full_config = task_config.get_merged_config()
@@ -288,16 +352,13 @@ class ProjectConfiguration:
 
     def renew_task_config(self, task):
         config = task.config
-        left_params = self.get_params()[:]
 
         param_uuids = []
         if "0" in config.base_configs:
             for param_value in config.base_configs["0"]:
                 param_uuids.append(param_value[0].get_metadata('param'))
-                for left_param in left_params:
-                    if param_value[0].get_metadata('param') == str(left_param.uuid):
-                        left_params.remove(left_param)
-                        break
+        used_param_uuids = set(param_uuids)
+        left_params = [param for param in self.get_params() if str(param.uuid) not in used_param_uuids]
 
         if len(left_params) > 0:
             new_param_values = []
@@ -325,23 +386,27 @@ class ProjectConfiguration:
 
             new_param_values = config.base_configs[:] + selected_new_param_value"""
 
+            # The config is shared with other tasks, so it is copied instead of being changed
             new_bases = config.base_configs.copy()
             new_bases["0"] = new_bases["0"][:] + new_param_values
-            config.set_base_configs(new_bases)
-            data = config.data
-            data['config'] = config.get_merged_config()
+            data = copy.deepcopy(config.data)
             data['base'] = {}
             for iteration in new_bases:
                 data['base'][iteration] = []
                 for param_value in new_bases[iteration]:
                     data['base'][iteration].append([param_value[0].uuid] + param_value[1:])
-            config.set_data(data)
+            task.config = self._build_task_config(data)
             return True
         else:
             return False
 
     def load_task(self, config):
-        return self.configuration.add_config(config, None)
+        config_hash = ConfigStore.config_hash(config)
+        task_config = self.task_configs.get(config_hash)
+        if task_config is None:
+            task_config = self.configuration.add_config(config, None)
+            self.task_configs[config_hash] = task_config
+        return task_config
 
     def get_params(self):
         return self.configuration.configs_by_file[self.params_conf_path] if self.params_conf_path in self.configuration.configs_by_file else []
@@ -362,32 +427,26 @@ class ProjectConfiguration:
             param_value = self.configuration.configs_by_uuid[param_value_uuid]
             if self.is_param_value_removable(param_value):
                 self.configuration.remove_config(param_value)
+                self._unindex_param_value(param_value)
 
                 param = self.configuration.configs_by_uuid[param_value.get_metadata('param')]
 
-                one_other_param_value = ""
-                for other_param_value in self.get_param_values():
-                    if other_param_value.get_metadata('param') == str(param.uuid):
-                        one_other_param_value = str(other_param_value.uuid)
+                other_param_values = self.get_param_values_of_param(param.uuid)
+                one_other_param_value = str(other_param_values[-1].uuid) if len(other_param_values) > 0 else ""
 
                 if param.get_metadata("deprecated_param_value") == str(param_value.uuid):
                     param.set_metadata("deprecated_param_value", one_other_param_value)
-                    self.configuration.save()
+                    self._save_configuration()
                 if param.get_metadata("default_param_value") == str(param_value.uuid):
                     param.set_metadata("default_param_value", one_other_param_value)
-                    self.configuration.save()
+                    self._save_configuration()
 
                 return param_value, param
 
         return None, None
 
     def has_param_values(self, param_uuid):
-        has_param_values = False
-        for param_value in self.get_param_values():
-            if param_value.get_metadata('param') == param_uuid:
-                has_param_values = True
-                break
-        return has_param_values
+        return len(self.get_param_values_of_param(param_uuid)) > 0
 
     def remove_param(self, param_uuid):
         if param_uuid in self.configuration.configs_by_uuid:
@@ -395,6 +454,7 @@ class ProjectConfiguration:
 
             if not self.has_param_values(param_uuid):
                 self.configuration.remove_config(param)
+                self.param_values_by_param.pop(str(param_uuid), None)
                 return param
         return None
 
@@ -24,6 +24,7 @@ class RemoteMsg(Enum):
     RECV = 5
     CURRENT_TASK = 6
     PING = 7
+    DUMP_STACKS = 8
 
 class Connection:
     def __init__(self):
@@ -124,16 +125,19 @@ class RemoteDevice(Device):
     def terminate(self):
         self._send_msg(RemoteMsg.TERMINATE)
 
-    def join(self):
+    def dump_stacks(self):
+        self._send_msg(RemoteMsg.DUMP_STACKS)
+
+    def join(self, task_uuid=None):
         self._send_msg(RemoteMsg.JOIN)
 
     def is_running(self):
         return self._send_msg(RemoteMsg.IS_RUNNING)[0]
 
-    def send(self, msg_type, arg=None):
+    def send(self, msg_type, arg=None, task_uuid=None):
         self._send_msg(RemoteMsg.SEND, [msg_type, arg])
 
-    def recv(self):
+    def recv(self, task_uuid=None):
         return self._send_msg(RemoteMsg.RECV)
 
     def get_name(self):
@@ -151,10 +155,10 @@ class RemoteDevice(Device):
         return 1 if self.socket is not None else 0
 
 class RemoteAgent:
-    def __init__(self, host, port):
+    def __init__(self, host, port, slot=0, number_of_slots=1, cpu_affinity="none", scratch_dir=None):
         self.host = host
         self.port = port
-        self.local_device = LocalDevice()
+        self.local_device = LocalDevice(slot, number_of_slots, cpu_affinity, scratch_dir)
         self.current_task = None
         self.start_time = None
         self.connection = Connection()
@@ -200,6 +204,9 @@ class RemoteAgent:
             elif msq_type == RemoteMsg.TERMINATE:
                 self.local_device.terminate()
                 print("Terminated task")
+            elif msq_type == RemoteMsg.DUMP_STACKS:
+                self.local_device.dump_stacks()
+                print("Dumped stacks of task")
             elif msq_type == RemoteMsg.JOIN:
                 self.local_device.join()
                 print("Joined task")
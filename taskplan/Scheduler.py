@@ -1,17 +1,37 @@
 import logging
+import shutil
+import time
 
 import taskplan.EventManager as EventManager
 from taskplan.Device import LocalDevice
 from taskplan.Remote import RemoteDevice
-from taskplan.TaskWrapper import State
+from taskplan.TaskWrapper import State, TaskWrapper
 import json
 
 class Scheduler:
 
     def __init__(self, event_manager, metadata, allow_remote, print_log):
         self.event_manager = event_manager
-        self.devices = [LocalDevice()]
         self.print_log = print_log
+        self.pack_size = metadata["pack_size"] if "pack_size" in metadata else 1
+        self.local_slots = metadata["local_slots"] if "local_slots" in metadata else 1
+        self.cpu_affinity = metadata["cpu_affinity"] if "cpu_affinity" in metadata else "none"
+        self.max_oom_requeues = metadata["max_oom_requeues"] if "max_oom_requeues" in metadata else 1
+        self.oom_limit_growth = metadata["oom_limit_growth"] if "oom_limit_growth" in metadata else 1.5
+        self.stall_factor = metadata["stall_factor"] if "stall_factor" in metadata else 20
+        self.min_stall_time = metadata["min_stall_time"] if "min_stall_time" in metadata else 600
+        self.stall_action = metadata["stall_action"] if "stall_action" in metadata else "flag"
+        self.preemption_timeout = metadata["preemption_timeout"] if "preemption_timeout" in metadata else 300
+        self.max_retries = metadata["max_retries"] if "max_retries" in metadata else 3
+        self.retry_backoff = metadata["retry_backoff"] if "retry_backoff" in metadata else 30
+        self.retry_backoff_factor = metadata["retry_backoff_factor"] if "retry_backoff_factor" in metadata else 2
+        self.retry_on_other_device = metadata["retry_on_other_device"] if "retry_on_other_device" in metadata else False
+        self.transient_errors = metadata["transient_errors"] if "transient_errors" in metadata else ["OSError", "EOFError"]
+        self.scratch_dir = metadata["scratch_dir"] if "scratch_dir" in metadata else None
+        self.min_free_space = metadata["min_free_space"] if "min_free_space" in metadata else 0
+        self.devices = [LocalDevice(slot, self.local_slots, self.cpu_affinity, self.scratch_dir) for slot in range(self.local_slots)]
+        self.held_tasks = set()
+        self.scheduled_tasks = {}
 
         if allow_remote:
             if "remote_devices" not in metadata:
@@ -22,7 +42,23 @@ class Scheduler:
 
     def save_metadata(self):
         return {
-            "remote_devices":  [(remote_device.host + ":" + str(remote_device.port)) for remote_device in self.devices[1:]]
+            "remote_devices":  [(remote_device.host + ":" + str(remote_device.port)) for remote_device in self.devices if type(remote_device) == RemoteDevice],
+            "pack_size": self.pack_size,
+            "local_slots": self.local_slots,
+            "cpu_affinity": self.cpu_affinity,
+            "max_oom_requeues": self.max_oom_requeues,
+            "oom_limit_growth": self.oom_limit_growth,
+            "stall_factor": self.stall_factor,
+            "min_stall_time": self.min_stall_time,
+            "stall_action": self.stall_action,
+            "preemption_timeout": self.preemption_timeout,
+            "max_retries": self.max_retries,
+            "retry_backoff": self.retry_backoff,
+            "retry_backoff_factor": self.retry_backoff_factor,
+            "retry_on_other_device": self.retry_on_other_device,
+            "transient_errors": self.transient_errors,
+            "scratch_dir": self.scratch_dir,
+            "min_free_space": self.min_free_space
         }
 
     def start(self, project_manager):
@@ -31,6 +67,7 @@ class Scheduler:
     def enqueue(self, task, device_uuid=None):
         device = self.device_with_uuid(device_uuid)
         device.queue.append(task)
+        self.scheduled_tasks[str(task.uuid)] = task
         task.device = device
         task.queue_index = len(device.queue) - 1
         task.state = State.QUEUED
@@ -39,36 +76,195 @@ class Scheduler:
 
 
     def schedule(self):
+        free_spaces, available_memories = {}, {}
         for device in self.devices:
             if device.is_connected():
                 for running in device.runnings[:]:
                     if not running.is_running():
                         running.stop()
+                        self.scheduled_tasks.pop(str(running.uuid), None)
                         self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
-                        if running.had_error:
+                        failed = running.memory_exceeded or running.had_error or running.was_killed()
+                        if running.memory_exceeded:
+                            self._on_memory_exceeded(running, device)
+                        elif running.had_error:
                             self.event_manager.log("The task \"" + str(running) + "\" has been stopped due to an error after " + str(running.finished_iterations) + " finished iterations", "Error occurred in task", logging.ERROR)
+                            self._on_failure(running, device)
+                        elif running.was_killed():
+                            self.event_manager.log("The process of task \"" + str(running) + "\" died unexpectedly after " + str(running.finished_iterations) + " finished iterations", "Task process died", logging.ERROR)
+                            self._on_failure(running, device)
                         elif running.finished_iterations < running.total_iterations:
                             self.event_manager.log("The task \"" + str(running) + "\" has been paused after " + str(running.finished_iterations) + " finished iterations", "Task has been paused")
                         else:
                             self.event_manager.log("The task \"" + str(running) + "\" has been finished after " + str(running.finished_iterations) + " finished iterations", "Task has been finished")
                         device.runnings.remove(running)
 
+                        if not running.had_error and not running.was_killed() and running.retries > 0:
+                            running.retries = 0
+                            running.previous_failure = None
+                            running.save_metadata(["retries"])
+
+                        # Failed tasks have already been requeued or given up on by the failure handling
+                        if running.requeue_after_stop and not failed:
+                            self.enqueue(running, str(device.uuid))
+                            if running.requeue_index is not None:
+                                self.reorder(str(running.uuid), running.requeue_index)
+                        running.requeue_after_stop = False
+                        running.requeue_index = None
+                    elif running.preemption_timed_out():
+                        self.event_manager.log("The task \"" + str(running) + "\" did not stop within " + str(self.preemption_timeout) + " seconds after being preempted, so it is terminated and resumes from iteration " + str(running.saved_finished_iterations) + " later", "Preemption timed out", logging.WARNING)
+                        running.preempt_deadline = None
+                        running.terminate()
+                    else:
+                        self._check_stalled(running)
+
                 if len(device.queue) > 0 and len(device.runnings) < 1:
-                    device.runnings.append(device.queue.pop(0))
+                    tasks = self._pop_tasks_to_start(device, free_spaces, available_memories)
+                    if len(tasks) == 0:
+                        continue
+                    device.runnings.extend(tasks)
                     self._update_indices()
-                    device.runnings[-1].start(self.print_log)
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, device.runnings[-1])
-                    self.event_manager.throw(EventManager.EventType.PROJECT_CHANGED, device.runnings[-1].project)
-                    self.event_manager.log("The task \"" + str(device.runnings[-1]) + "\" has been started, beginning with iteration " + str(device.runnings[-1].finished_iterations), "Next task has been started")
+                    if len(tasks) == 1:
+                        tasks[0].start(self.print_log)
+                    else:
+                        TaskWrapper.start_packed(tasks, self.print_log)
+
+                    for task in tasks:
+                        self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
+                        self.event_manager.log("The task \"" + str(task) + "\" has been started, beginning with iteration " + str(task.finished_iterations), "Next task has been started")
+                    self.event_manager.throw(EventManager.EventType.PROJECT_CHANGED, tasks[0].project)
+
+    def _free_space(self, path, free_spaces):
+        if path not in free_spaces:
+            free_spaces[path] = shutil.disk_usage(str(path)).free / 1024 / 1024
+        return free_spaces[path]
+
+    def _available_memory(self, device, available_memories):
+        if device.memory_host() not in available_memories:
+            available_memories[device.memory_host()] = device.available_memory()
+        return available_memories[device.memory_host()]
+
+    def _pop_tasks_to_start(self, device, free_spaces, available_memories):
+        available_memory = self._available_memory(device, available_memories)
+        tasks = []
+        for task in device.queue[:]:
+            if len(tasks) >= (self.pack_size if device.supports_packing() else 1):
+                break
+            if task.retry_after is not None and task.retry_after > time.time():
+                continue
+
+            if self.min_free_space > 0:
+                free_space = self._free_space(task.tasks_dir, free_spaces)
+                if free_space < self.min_free_space:
+                    if task not in self.held_tasks:
+                        self.held_tasks.add(task)
+                        self.event_manager.log("The task \"" + str(task) + "\" is held back, as only " + str(int(free_space)) + "MB are free in " + str(task.tasks_dir) + " (minimum: " + str(self.min_free_space) + "MB)", "Task is waiting for free disk space", logging.WARNING)
+                    continue
+            if len(tasks) > 0 and not task.is_packable_with(tasks[0]):
+                continue
+
+            if available_memory is not None and task.memory_requirement() is not None:
+                if task.memory_requirement() > available_memory:
+                    if task not in self.held_tasks:
+                        self.held_tasks.add(task)
+                        self.event_manager.log("The task \"" + str(task) + "\" is held back, as it requires " + str(int(task.memory_requirement())) + "MB but only " + str(int(available_memory)) + "MB are available", "Task is waiting for free memory")
+                    continue
+                available_memory -= task.memory_requirement()
+
+            self.held_tasks.discard(task)
+            device.queue.remove(task)
+            tasks.append(task)
+
+        # Tasks started in this tick do not use their memory yet, so it is reserved for them until the next snapshot
+        available_memories[device.memory_host()] = available_memory
+        return tasks
+
+    def _on_failure(self, task, device):
+        if task.last_error is not None:
+            failure = (task.last_error["signature"], task.saved_finished_iterations)
+            deterministic = not self._is_transient(task.last_error) or failure == task.previous_failure
+            task.previous_failure = failure
+        else:
+            deterministic = False
+
+        if deterministic:
+            self.event_manager.log("The task \"" + str(task) + "\" is not retried, as its " + task.last_error["type"] + " does not look transient", "Task will not be retried")
+        elif task.retries < self.max_retries:
+            task.retries += 1
+            task.save_metadata(["retries"])
+            delay = self.retry_backoff * self.retry_backoff_factor ** (task.retries - 1)
+            self.enqueue(task, str(self._retry_device(device).uuid))
+            task.retry_after = time.time() + delay
+            self.event_manager.log("The task \"" + str(task) + "\" will be retried from iteration " + str(task.finished_iterations) + " in " + str(int(delay)) + " seconds (retry " + str(task.retries) + " of " + str(self.max_retries) + ")", "Task will be retried")
+
+    def _is_transient(self, error):
+        # Errors are transient if their type or one of its base classes is configured as such
+        return any(error_type in self.transient_errors for error_type in error.get("types", [error["type"]]))
+
+    def _retry_device(self, device):
+        if self.retry_on_other_device:
+            other_devices = [other for other in self.devices if other is not device and other.is_connected()]
+            if len(other_devices) > 0:
+                return min(other_devices, key=lambda other: len(other.queue) + len(other.runnings))
+        return device
+
+    def _check_stalled(self, task):
+        seconds_since_progress = task.seconds_since_progress()
+        if seconds_since_progress is None:
+            return
+
+        stall_threshold = max(self.min_stall_time, self.stall_factor * task.iteration_rate if task.iteration_rate is not None else 0)
+        if seconds_since_progress <= stall_threshold:
+            if task.stalled:
+                task.stalled = False
+                self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
+        elif not task.stalled:
+            task.stalled = True
+            task.dump_stacks()
+            self.event_manager.log("The task \"" + str(task) + "\" made no progress for " + str(int(seconds_since_progress)) + " seconds, its stack traces have been written to its log", "Task seems to be stalled", logging.WARNING)
+
+            if self.stall_action == "requeue":
+                task.requeue_after_stop = True
+                task.terminate()
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
+
+    def _on_memory_exceeded(self, task, device):
+        self.event_manager.log("The task \"" + str(task) + "\" has been stopped after " + str(task.finished_iterations) + " finished iterations, as its memory usage of " + str(int(task.peak_memory)) + "MB exceeded its limit of " + str(task.memory_limit) + "MB", "Task exceeded its memory limit", logging.ERROR)
+        if task.oom_requeues < self.max_oom_requeues:
+            task.oom_requeues += 1
+            task.set_memory_limit(int(max(task.memory_limit, task.peak_memory) * self.oom_limit_growth))
+            self.enqueue(task, str(device.uuid))
+
+
+    def _running_task(self, task_uuid):
+        task = self.scheduled_tasks.get(task_uuid)
+        if task is not None and task in task.device.runnings:
+            return task
+        return None
+
+    def _queued_task(self, task_uuid):
+        task = self.scheduled_tasks.get(task_uuid)
+        if task is None:
+            return None
 
+        queue = task.device.queue
+        if task.queue_index < len(queue) and queue[task.queue_index] is task:
+            return task
+        return task if task in queue else None
 
     def pause(self, task_uuid):
-        for device in self.devices:
-            for running in device.runnings:
-                if str(running.uuid) == task_uuid:
-                    running.pause()
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
-                    return
+        running = self._running_task(task_uuid)
+        if running is not None:
+            running.pause()
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
+
+    def preempt(self, task_uuid):
+        running = self._running_task(task_uuid)
+        if running is not None:
+            running.preempt(self.preemption_timeout)
+            running.requeue_after_stop = True
+            running.requeue_index = 1
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
 
     def pause_and_cancel_all(self):
         for device in self.devices:
@@ -77,58 +273,51 @@ class Scheduler:
                 self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
 
         for device in self.devices:
-            for task in device.queue:
+            for task in device.queue[:]:
                 device.queue.remove(task)
+                self.scheduled_tasks.pop(str(task.uuid), None)
                 removed_task = task
                 removed_task.state = State.STOPPED
                 self.event_manager.log("The task \"" + str(removed_task) + "\" has been cancelled", "Task has been cancelled")
                 self.event_manager.throw(EventManager.EventType.TASK_CHANGED, removed_task)
 
     def terminate(self, task_uuid):
-        for device in self.devices:
-            for running in device.runnings:
-                if str(running.uuid) == task_uuid:
-                    running.terminate()
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
-                    return
+        running = self._running_task(task_uuid)
+        if running is not None:
+            running.terminate()
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
 
     def save_now(self, task_uuid):
-        for device in self.devices:
-            for running in device.runnings:
-                if str(running.uuid) == task_uuid:
-                    running.save_now()
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
-                    return
+        running = self._running_task(task_uuid)
+        if running is not None:
+            running.save_now()
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
 
     def create_checkpoint_now(self, task_uuid):
-        for device in self.devices:
-            for running in device.runnings:
-                if str(running.uuid) == task_uuid:
-                    running.create_checkpoint_now()
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
-                    return True
+        running = self._running_task(task_uuid)
+        if running is not None:
+            running.create_checkpoint_now()
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
+            return True
         return False
 
     def run_now(self, task_uuid):
-        for device in self.devices:
-            for task in device.queue:
-                if str(task.uuid) == task_uuid:
-                    self.reorder(task_uuid, 0)
-                    for i in range(0, len(device.runnings)):
-                        self.pause(str(device.runnings[i].uuid))
-                    self.event_manager.log("The task \"" + str(task) + "\" will be started as soon as possible", "Task has been prioritized")
-                    break
+        task = self._queued_task(task_uuid)
+        if task is not None:
+            device = task.device
+            self.reorder(task_uuid, 0)
+            for i in range(0, len(device.runnings)):
+                self.preempt(str(device.runnings[i].uuid))
+            self.event_manager.log("The task \"" + str(task) + "\" will be started as soon as possible", "Task has been prioritized")
 
     def cancel(self, task_uuid):
-        for device in self.devices:
-            for task in device.queue:
-                if str(task.uuid) == task_uuid:
-                    device.queue.remove(task)
-                    removed_task = task
-                    removed_task.state = State.STOPPED
-                    self.event_manager.log("The task \"" + str(removed_task) + "\" has been cancelled", "Task has been cancelled")
-                    return removed_task
-        return None
+        removed_task = self._queued_task(task_uuid)
+        if removed_task is not None:
+            removed_task.device.queue.remove(removed_task)
+            del self.scheduled_tasks[task_uuid]
+            removed_task.state = State.STOPPED
+            self.event_manager.log("The task \"" + str(removed_task) + "\" has been cancelled", "Task has been cancelled")
+        return removed_task
 
     def _update_indices(self):
         for device in self.devices:
@@ -137,13 +326,7 @@ class Scheduler:
                 self.event_manager.throw(EventManager.EventType.TASK_CHANGED, device.queue[i])
 
     def reorder(self, task_uuid, new_index):
-        task_to_reorder = None
-        for device in self.devices:
-            for index, task in enumerate(device.queue):
-                if str(task.uuid) == task_uuid:
-                    task_to_reorder = task
-                    break
-
+        task_to_reorder = self._queued_task(task_uuid)
         if task_to_reorder is not None:
             new_index = max(0, min(len(task_to_reorder.device.queue) - 1, new_index))
             task_to_reorder.device.queue.remove(task_to_reorder)
@@ -175,22 +358,15 @@ class Scheduler:
                 self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running)
 
     def change_total_iterations(self, task_uuid, total_iterations):
-        for device in self.devices:
-            for task in device.runnings:
-                if str(task.uuid) == task_uuid:
-                    task.set_total_iterations(total_iterations)
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
-                    return
-
-            for task in device.queue:
-                if str(task.uuid) == task_uuid:
-                    task.set_total_iterations(total_iterations)
-                    self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
-                    return
+        task = self.scheduled_tasks.get(task_uuid)
+        if task is not None:
+            task.set_total_iterations(total_iterations)
+            self.event_manager.throw(EventManager.EventType.TASK_CHANGED, task)
 
     def device_with_uuid(self, device_uuid):
         if device_uuid is None:
-            return self.devices[0]
+            local_devices = [device for device in self.devices if type(device) == LocalDevice]
+            return min(local_devices, key=lambda device: len(device.queue) + len(device.runnings))
 
         for device in self.devices:
             if device_uuid == str(device.uuid):
@@ -203,14 +379,19 @@ class Scheduler:
         if current_task is not None:
             running_task = project_manager.find_task_by_uuid(current_task)
             device.runnings = [running_task]
+            self.scheduled_tasks[str(running_task.uuid)] = running_task
             running_task.set_as_running(device, start_time)
             self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running_task)
 
-    def _on_device_disconnect(self, device):
+    def _on_device_disconnect(self, device, lost=True):
         for running_task in device.runnings:
+            self.scheduled_tasks.pop(str(running_task.uuid), None)
             running_task.set_as_stopped()
             self.event_manager.throw(EventManager.EventType.TASK_CHANGED, running_task)
-            device.runnings = []
+            if lost:
+                self.event_manager.log("The device running task \"" + str(running_task) + "\" has been lost after " + str(running_task.finished_iterations) + " finished iterations", "Device lost", logging.ERROR)
+                self._on_failure(running_task, device)
+        device.runnings = []
 
     def connect_device(self, device_uuid, project_manager):
         device = self.device_with_uuid(device_uuid)
@@ -224,7 +405,7 @@ class Scheduler:
         device = self.device_with_uuid(device_uuid)
         if type(device) == RemoteDevice and device.is_connected():
             device.disconnect()
-            self._on_device_disconnect(device)
+            self._on_device_disconnect(device, lost=False)
             self.event_manager.throw(EventManager.EventType.SCHEDULER_OPTIONS, self)
 
     def add_device(self, device_address, project_manager):
@@ -0,0 +1,91 @@
+import os
+import queue
+import shutil
+import threading
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class ScratchFlusher:
+
+    def __init__(self, scratch_dir, max_pending=2):
+        self.scratch_dir = Path(scratch_dir)
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.next_staging_id = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def staging_dir(self, name):
+        self.next_staging_id += 1
+        path = self.scratch_dir / name / str(self.next_staging_id)
+        if path.exists():
+            shutil.rmtree(str(path))
+        path.mkdir(parents=True)
+        return path
+
+    @staticmethod
+    def move_files(staging_dir, target_dir, copy=True):
+        staging_dir, target_dir = Path(staging_dir), Path(target_dir)
+        written_bytes = 0
+        for root, dirs, filenames in os.walk(str(staging_dir)):
+            target_root = target_dir / Path(root).relative_to(staging_dir)
+            target_root.mkdir(parents=True, exist_ok=True)
+            for filename in filenames:
+                written_bytes += os.lstat(os.path.join(root, filename)).st_size
+                try:
+                    written_bytes -= os.lstat(str(target_root / filename)).st_size
+                except OSError:
+                    pass
+
+                if copy:
+                    tmp_path = target_root / (filename + ".flushing")
+                    shutil.copyfile(str(Path(root) / filename), str(tmp_path))
+                    with open(str(tmp_path), "rb") as handle:
+                        os.fsync(handle.fileno())
+                    os.replace(str(tmp_path), str(target_root / filename))
+                else:
+                    os.replace(os.path.join(root, filename), str(target_root / filename))
+
+        fd = os.open(str(target_dir), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        shutil.rmtree(str(staging_dir))
+        return written_bytes
+
+    def submit(self, job):
+        self._raise_error()
+        self.jobs.put(job)
+
+    def _flush_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+
+            try:
+                if self.error is None:
+                    job()
+            except BaseException as e:
+                self.error = e
+            self.jobs.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        self.jobs.join()
+        self._raise_error()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise_error()
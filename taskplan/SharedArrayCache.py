@@ -0,0 +1,121 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class SharedArrayCache:
+
+    def __init__(self, cache_dir=None, max_size_mb=4096):
+        if cache_dir is None:
+            cache_dir = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+            cache_dir = cache_dir / "taskplan_shared_arrays"
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size_mb * 1024 * 1024
+
+    def _key(self, name, config):
+        if config is not None and hasattr(config, "get_merged_config"):
+            config = config.get_merged_config()
+        config_hash = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", name) + "-" + config_hash
+
+    def _lock(self, key, operation):
+        lock_path = self.cache_dir / (key + ".lock")
+        while True:
+            lock_file = open(str(lock_path), "a")
+            try:
+                fcntl.flock(lock_file, operation)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+
+            # The lock file might have been removed by an eviction while waiting for the lock
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(str(lock_path)).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def _load(self, path):
+        import numpy as np
+
+        try:
+            os.utime(str(path))
+        except OSError:
+            pass
+        return np.load(str(path), mmap_mode="r")
+
+    def get(self, name, builder, config=None):
+        import numpy as np
+
+        key = self._key(name, config)
+        path = self.cache_dir / (key + ".npy")
+
+        # The shared lock prevents an eviction of the entry while it is being loaded, once mapped it stays readable
+        with self._lock(key, fcntl.LOCK_SH):
+            if path.exists():
+                return self._load(path)
+
+        with self._lock(key, fcntl.LOCK_EX):
+            if not path.exists():
+                self._materialize(path, np.asarray(builder()))
+            array = self._load(path)
+        self._evict(path)
+        return array
+
+    def _materialize(self, path, array):
+        import numpy as np
+
+        tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+        try:
+            mapped = np.lib.format.open_memmap(str(tmp_path), mode="w+", dtype=array.dtype, shape=array.shape)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+            os.replace(str(tmp_path), str(path))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _evict(self, keep):
+        entries = []
+        for path in self.cache_dir.glob("*.npy"):
+            try:
+                entries.append((path.stat().st_mtime, path.stat().st_size, path))
+            except OSError:
+                pass
+
+        total_size = sum(entry[1] for entry in entries)
+        for mtime, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_size:
+                break
+            if path != keep and self._remove(path.stem, path):
+                total_size -= size
+
+        # Lock files of entries which have not been built, e.g. because their builder failed
+        for lock_path in self.cache_dir.glob("*.lock"):
+            if not lock_path.with_suffix(".npy").exists():
+                self._remove(lock_path.stem, None)
+
+    def _remove(self, key, path):
+        lock_file = self._lock(key, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if lock_file is None:
+            return False
+
+        with lock_file:
+            try:
+                if path is not None:
+                    path.unlink()
+                (self.cache_dir / (key + ".lock")).unlink()
+            except OSError:
+                return False
+        return True
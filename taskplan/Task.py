@@ -1,24 +1,17 @@
 import datetime
+import sys
 from collections import defaultdict
 
+from taskplan.EventWriter import EventWriter
+from taskplan.SharedArrayCache import SharedArrayCache
 from taskplan.TaskWrapper import PipeMsg
 
-try:
-    import tensorflow as tf
-except ImportError:
-    tf = None
-
-try:
-    import tensorboardX as tbX
-except ImportError:
-    tbX = None
-
 from datetime import datetime
 import time
 
 class Task(object):
 
-    def __init__(self, config, logger, metadata, use_tensorboardX=False):
+    def __init__(self, config, logger, metadata, use_tensorboardX=False, use_tensorflow=None):
         self.config = config
         self.logger = logger
         self.finished_iterations = metadata["finished_iterations"]
@@ -30,8 +23,13 @@ class Task(object):
         self.save_now = False
         self.creating_checkpoint = False
         self.use_tensorboardX = use_tensorboardX
+        # By default, TensorFlow's writer is only used if the task has imported TensorFlow
+        self.use_tensorflow = use_tensorflow
         self.param_change_callbacks = defaultdict(lambda: [])
         self.last_iteration_param_cache = {}
+        self.shared_array_settings = metadata.get("shared_array_settings", {})
+        self.shared_array_cache = None
+        self.preemption = metadata.get("preemption")
 
     def on_param_change(self, param_name, callback):
         self.param_change_callbacks[param_name].append(callback)
@@ -49,28 +47,39 @@ class Task(object):
                     callback(self.last_iteration_param_cache[key] if self.finished_iterations > 0 else None, new_value)
                 self.last_iteration_param_cache[key] = new_value
 
+    def shared_array(self, name, builder, config=None):
+        if self.shared_array_cache is None:
+            self.shared_array_cache = SharedArrayCache(**self.shared_array_settings)
+        # Without an explicit config, arrays are only shared between tasks with the same config
+        return self.shared_array_cache.get(name, builder, self.config if config is None else config)
+
     def load(self, path):
         raise NotImplementedError()
 
     def _create_tensorboard_writer(self, task_dir):
         if self.use_tensorboardX:
-            if tbX is not None:
-                return tbX.SummaryWriter(task_dir)
-            else:
+            try:
+                import tensorboardX as tbX
+            except ImportError:
                 return None
-        else:
-            if tf is not None:
-                if hasattr(tf.summary, "FileWriter"):
-                    return tf.summary.FileWriter(task_dir)
-                else:
-                    return tf.summary.create_file_writer(task_dir)
+            return tbX.SummaryWriter(task_dir)
+        elif self.use_tensorflow or (self.use_tensorflow is None and "tensorflow" in sys.modules):
+            import tensorflow as tf
+            if hasattr(tf.summary, "FileWriter"):
+                return tf.summary.FileWriter(task_dir)
             else:
-                return None
+                return tf.summary.create_file_writer(task_dir)
+        else:
+            return EventWriter(task_dir)
 
     def _flush_tensorboard_writer(self, tensorboard_writer):
         if tensorboard_writer is not None:
             tensorboard_writer.flush()
 
+    def _close_tensorboard_writer(self, tensorboard_writer):
+        if tensorboard_writer is not None:
+            tensorboard_writer.close()
+
     def receive_updates(self):
         update_available = self.pipe.poll(0)
         while update_available:
@@ -102,64 +111,147 @@ class Task(object):
   
     def run(self, save_func, checkpoint_func):
         tensorboard_writer = self._create_tensorboard_writer(str(self.task_dir))
-
-        last_t = time.time()
-        self.start()
-        while self.finished_iterations < self.total_iterations:
-            self.receive_updates()
-            self.config.iteration_cursor = self.finished_iterations
-            self.perform_param_change_callbacks()
-            save_interval = self.config.get_int('save_interval')
-            checkpoint_interval = self.config.get_int('checkpoint_interval')
-
-
-            if self.finished_iterations == 0:
-                self.before_first_iteration()
-
-            self.step(tensorboard_writer, self.finished_iterations)
-
-            self.finished_iterations = self.finished_iterations + 1
-            self.iteration_rate = self.exp_moving_average((time.time() - last_t) / 1, self.iteration_rate)
-            last_t = time.time()
-            self.iteration_update_time = time.time()
-            self.pipe.send(PipeMsg.FINISHED_ITERATIONS, {"finished_iterations": self.finished_iterations, "iteration_rate": self.iteration_rate, "iteration_update_time": self.iteration_update_time})
-
-            if self.pause_computation:
+        try:
+            self.last_step_time = time.time()
+            self.start()
+            while self.finished_iterations < self.total_iterations:
+                self._before_step()
+                self.step(tensorboard_writer, self.finished_iterations)
+                if not self._after_step(tensorboard_writer, save_func, checkpoint_func):
+                    break
+
+            self.stop()
+        finally:
+            self._close_tensorboard_writer(tensorboard_writer)
+
+    @classmethod
+    def run_packed(cls, tasks, save_funcs, checkpoint_funcs, finish_funcs, select_func, error_funcs):
+        tensorboard_writers = [None] * len(tasks)
+
+        def run_for_task(i, func):
+            select_func([i])
+            try:
+                return func(i)
+            except:
+                fail(i)
+                return False
+
+        def close_writer(i):
+            writer, tensorboard_writers[i] = tensorboard_writers[i], None
+            tasks[i]._close_tensorboard_writer(writer)
+
+        def fail(i):
+            error_funcs[i]()
+            close_writer(i)
+
+        def finish(i):
+            tasks[i].stop()
+            close_writer(i)
+            finish_funcs[i]()
+            return False
+
+        def start(i):
+            tensorboard_writers[i] = tasks[i]._create_tensorboard_writer(str(tasks[i].task_dir))
+            tasks[i].last_step_time = time.time()
+            tasks[i].start()
+            return tasks[i].finished_iterations < tasks[i].total_iterations or finish(i)
+
+        def before_step(i):
+            tasks[i]._before_step()
+            return True
+
+        def step(i):
+            tasks[i].step(tensorboard_writers[i], tasks[i].finished_iterations)
+            return True
+
+        def after_step(i):
+            if not tasks[i]._after_step(tensorboard_writers[i], save_funcs[i], checkpoint_funcs[i]) or tasks[i].finished_iterations >= tasks[i].total_iterations:
+                return finish(i)
+            return True
+
+        active = [i for i in range(len(tasks)) if run_for_task(i, start)]
+        while len(active) > 0:
+            active = [i for i in active if run_for_task(i, before_step)]
+            if len(active) == 0:
                 break
 
-            if self.save_now or (save_interval > 0 and self.finished_iterations % save_interval == 0):
-                if self.save_now:
-                    self.logger.log("Doing a manual save after " + str(self.finished_iterations) + " iterations")
-                else:
-                    self.logger.log("Auto-Saving after " + str(self.finished_iterations) + " iterations")
+            if cls.step_packed.__func__ is Task.step_packed.__func__:
+                active = [i for i in active if run_for_task(i, step)]
+            else:
+                # A custom packed step runs all tasks at once, so its output and errors cannot be attributed to a single task
+                select_func(active)
+                try:
+                    cls.step_packed([tasks[i] for i in active], [tensorboard_writers[i] for i in active], [tasks[i].finished_iterations for i in active])
+                except:
+                    for i in active:
+                        fail(i)
+                    break
+
+            active = [i for i in active if run_for_task(i, after_step)]
+
+    def _before_step(self):
+        self.receive_updates()
+        self.config.iteration_cursor = self.finished_iterations
+        self.perform_param_change_callbacks()
+
+        if self.finished_iterations == 0:
+            self.before_first_iteration()
+
+    def _after_step(self, tensorboard_writer, save_func, checkpoint_func):
+        save_interval = self.config.get_int('save_interval')
+        checkpoint_interval = self.config.get_int('checkpoint_interval')
+
+        self.finished_iterations = self.finished_iterations + 1
+        self.iteration_rate = self.exp_moving_average((time.time() - self.last_step_time) / 1, self.iteration_rate)
+        self.last_step_time = time.time()
+        self.iteration_update_time = time.time()
+        self.pipe.send(PipeMsg.FINISHED_ITERATIONS, {"finished_iterations": self.finished_iterations, "iteration_rate": self.iteration_rate, "iteration_update_time": self.iteration_update_time})
+
+        if self.pause_computation or (self.preemption is not None and self.preemption.is_set()):
+            return False
+
+        if self.save_now or (save_interval > 0 and self.finished_iterations % save_interval == 0):
+            if self.save_now:
+                self.logger.log("Doing a manual save after " + str(self.finished_iterations) + " iterations")
+            else:
+                self.logger.log("Auto-Saving after " + str(self.finished_iterations) + " iterations")
 
-                save_func(self.finished_iterations)
-                self._flush_tensorboard_writer(tensorboard_writer)
+            save_func(self.finished_iterations)
+            self._flush_tensorboard_writer(tensorboard_writer)
 
-                if self.save_now:
-                    self.save_now = False
-                    self.pipe.send(PipeMsg.SAVING, False)
+            if self.save_now:
+                self.save_now = False
+                self.pipe.send(PipeMsg.SAVING, False)
 
-            if self.creating_checkpoint or (checkpoint_interval > 0 and self.finished_iterations % checkpoint_interval == 0):
-                self.logger.log("Creating checkpoint after " + str(self.finished_iterations) + " iterations")
+        if self.creating_checkpoint or (checkpoint_interval > 0 and self.finished_iterations % checkpoint_interval == 0):
+            self.logger.log("Creating checkpoint after " + str(self.finished_iterations) + " iterations")
 
-                self._flush_tensorboard_writer(tensorboard_writer)
-                checkpoint = checkpoint_func(self.finished_iterations)
+            self._flush_tensorboard_writer(tensorboard_writer)
+            checkpoint = checkpoint_func(self.finished_iterations)
+            if checkpoint is not None:
                 self.pipe.send(PipeMsg.NEW_CHECKPOINT, checkpoint)
 
-                if self.creating_checkpoint:
-                    self.creating_checkpoint = False
-                    self.pipe.send(PipeMsg.CREATE_CHECKPOINT, False)
+            if self.creating_checkpoint:
+                self.creating_checkpoint = False
+                self.pipe.send(PipeMsg.CREATE_CHECKPOINT, False)
 
-        self.stop()
-        self._flush_tensorboard_writer(tensorboard_writer)
+        return True
 
     def step(self, tensorboard_writer, current_iteration):
         raise NotImplementedError()
 
+    @classmethod
+    def step_packed(cls, tasks, tensorboard_writers, current_iterations):
+        for task, tensorboard_writer, current_iteration in zip(tasks, tensorboard_writers, current_iterations):
+            task.step(tensorboard_writer, current_iteration)
+
     def save(self, path):
         raise NotImplementedError()
 
+    def checkpoint_metrics(self):
+        # The metrics returned here are stored with each checkpoint and are required by the keep_best retention rule
+        return {}
+
     def start(self):
         pass
 
@@ -0,0 +1,84 @@
+import atexit
+import os
+import shutil
+import tempfile
+import zipfile
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class TaskArchive:
+    ARCHIVE_NAME = "archive.zip"
+    KEEP_OUTSIDE = ["metadata.json", "metadata.journal", "metadata.json.lock", "metrics_cache.json", ARCHIVE_NAME, ARCHIVE_NAME + ".tmp"]
+    COMPRESSIONS = {"lzma": zipfile.ZIP_LZMA, "deflate": zipfile.ZIP_DEFLATED, "bzip2": zipfile.ZIP_BZIP2, "none": zipfile.ZIP_STORED}
+    extract_root = None
+
+    def __init__(self, task_dir):
+        self.task_dir = Path(task_dir)
+        self.path = self.task_dir / TaskArchive.ARCHIVE_NAME
+
+    def is_archived(self):
+        return self.path.exists()
+
+    def _loose_paths(self):
+        return [path for path in self.task_dir.iterdir() if path.name not in TaskArchive.KEEP_OUTSIDE]
+
+    def pack(self, compression="lzma", exclude=[]):
+        if compression not in TaskArchive.COMPRESSIONS:
+            raise ValueError("Unknown compression " + str(compression))
+        exclude = [Path(path) for path in exclude]
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with zipfile.ZipFile(str(tmp_path), "w", compression=TaskArchive.COMPRESSIONS[compression]) as archive:
+            for path in self._loose_paths():
+                for root, dirs, filenames in os.walk(str(path)) if path.is_dir() else [(str(path.parent), [], [path.name])]:
+                    dirs[:] = [directory for directory in dirs if Path(root) / directory not in exclude]
+                    for filename in filenames:
+                        file_path = Path(root) / filename
+                        archive.write(str(file_path), str(file_path.relative_to(self.task_dir)))
+
+        with open(str(tmp_path), "rb") as handle:
+            os.fsync(handle.fileno())
+        os.replace(str(tmp_path), str(self.path))
+
+        for path in self._loose_paths():
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(str(path))
+            else:
+                path.unlink()
+
+    def unpack(self):
+        with zipfile.ZipFile(str(self.path), "r") as archive:
+            archive.extractall(str(self.task_dir))
+        self.path.unlink()
+        self.remove_extracted()
+
+    def list_files(self):
+        with zipfile.ZipFile(str(self.path), "r") as archive:
+            return archive.namelist()
+
+    def read(self, name):
+        with zipfile.ZipFile(str(self.path), "r") as archive:
+            return archive.read(name)
+
+    @staticmethod
+    def _extract_root():
+        # Extracted files are kept in one temporary dir per process, which is removed on exit, independent of the archive objects
+        if TaskArchive.extract_root is None:
+            TaskArchive.extract_root = Path(tempfile.mkdtemp(prefix="taskplan_archive_"))
+            atexit.register(shutil.rmtree, str(TaskArchive.extract_root), True)
+        return TaskArchive.extract_root
+
+    def _extract_dir(self):
+        return TaskArchive._extract_root() / self.task_dir.name
+
+    def extract_file(self, name):
+        with zipfile.ZipFile(str(self.path), "r") as archive:
+            return Path(archive.extract(name, str(self._extract_dir())))
+
+    def remove_extracted(self):
+        if TaskArchive.extract_root is not None:
+            shutil.rmtree(str(self._extract_dir()), ignore_errors=True)
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.TaskDetails import TaskDetails
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class TaskCatalog:
+    SIGNATURE_FILES = ["metadata.json", "metadata.journal", "metrics_cache.json"]
+    DETAIL_KEYS = ["code_versions", "checkpoints", "notes"]
+
+    def __init__(self, path):
+        self.path = None if path is None else Path(path)
+        self.lock = threading.Lock()
+        self.connection = None
+        if self.path is not None:
+            self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS tasks (path TEXT PRIMARY KEY, uuid TEXT, signature TEXT, metadata TEXT, metrics TEXT)")
+            self.connection.commit()
+
+    @staticmethod
+    def signature(path):
+        signature = []
+        for name in TaskCatalog.SIGNATURE_FILES:
+            try:
+                stat = (path / name).stat()
+                signature.append([stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                signature.append(None)
+        return signature
+
+    @staticmethod
+    def summary(metadata):
+        # Only the fields needed for dehydrated tasks are kept, the details are read from the task dir when needed
+        summary = {key: value for key, value in metadata.items() if key not in TaskCatalog.DETAIL_KEYS}
+        if "code_versions" in metadata:
+            summary["latest_code_version"] = TaskDetails(code_versions=metadata["code_versions"]).latest_code_version()
+        if "checkpoints" in metadata:
+            summary["checkpoint_bytes"] = TaskDetails(checkpoints=metadata["checkpoints"]).checkpoint_bytes()
+        return summary
+
+    @staticmethod
+    def read_metrics(path):
+        if (path / "metrics_cache.json").exists():
+            with open(str(path / "metrics_cache.json"), "r") as handle:
+                return json.load(handle)
+        return None
+
+    def load(self, path):
+        signature = self.signature(path)
+        if signature[0] is None and signature[1] is None:
+            return None
+
+        if self.connection is not None:
+            with self.lock:
+                row = self.connection.execute("SELECT signature, metadata, metrics FROM tasks WHERE path = ?", (str(path),)).fetchone()
+            if row is not None and row[1] is not None and row[2] is not None and json.loads(row[0]) == signature:
+                return json.loads(row[1]), json.loads(row[2])
+
+        metadata, metrics = MetadataJournal(path).load(), self.read_metrics(path)
+        self._store(path, signature, metadata, metrics, commit=False)
+        return metadata, metrics
+
+    def _store(self, path, signature, metadata, metrics, commit=True):
+        if self.connection is None:
+            return
+
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO tasks (path, uuid, signature, metadata, metrics) VALUES (?, ?, ?, ?, ?)", (str(path), metadata["uuid"], json.dumps(signature), json.dumps(self.summary(metadata)), json.dumps(metrics)))
+            if commit:
+                self.connection.commit()
+
+    def update(self, path, metadata=None, metrics=None, partial=False, previous_signature=None):
+        if self.connection is None:
+            return
+
+        signature = self.signature(path)
+        with self.lock:
+            row = self.connection.execute("SELECT signature, metadata, metrics FROM tasks WHERE path = ?", (str(path),)).fetchone()
+        if row is None or row[1] is None:
+            if metadata is None or partial:
+                return
+            self._store(path, signature, metadata, metrics if metrics is not None else self.read_metrics(path))
+            return
+
+        # If the files were changed since the row was stored, e.g. by the task process, the row must not be merged into
+        stale = previous_signature is not None and json.loads(row[0]) != previous_signature
+        if metadata is None or partial:
+            if stale:
+                return
+            metadata = json.loads(row[1]) if metadata is None else dict(json.loads(row[1]), **self.summary(metadata))
+        if metrics is None:
+            metrics = json.loads(row[2]) if row[2] is not None and not stale else self.read_metrics(path)
+        self._store(path, signature, metadata, metrics)
+
+    def remove(self, path):
+        if self.connection is None:
+            return
+
+        with self.lock:
+            self.connection.execute("DELETE FROM tasks WHERE path = ?", (str(path),))
+            self.connection.commit()
+
+    def prune(self, existing_paths):
+        if self.connection is None:
+            return
+
+        existing_paths = set(str(path) for path in existing_paths)
+        with self.lock:
+            stale_paths = [(row[0],) for row in self.connection.execute("SELECT path FROM tasks") if row[0] not in existing_paths]
+            self.connection.executemany("DELETE FROM tasks WHERE path = ?", stale_paths)
+            self.connection.commit()
+
+    def commit(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.commit()
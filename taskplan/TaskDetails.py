@@ -0,0 +1,17 @@
+class TaskDetails:
+    __slots__ = ["code_versions", "checkpoints", "notes"]
+
+    def __init__(self, code_versions=None, checkpoints=None, notes=""):
+        self.code_versions = {} if code_versions is None else code_versions
+        self.checkpoints = [] if checkpoints is None else checkpoints
+        self.notes = notes
+
+    @staticmethod
+    def from_metadata(data):
+        return TaskDetails(data['code_versions'], sorted(data['checkpoints'], key=lambda checkpoint: checkpoint["finished_iterations"]), data['notes'])
+
+    def latest_code_version(self):
+        return max(self.code_versions.items(), key=lambda x: int(x[0]))[1] if len(self.code_versions) > 0 else None
+
+    def checkpoint_bytes(self):
+        return sum(checkpoint.get("stored_bytes", 0) for checkpoint in self.checkpoints)
@@ -0,0 +1,318 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+
+class TaskDirWatcher:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct("iIII")
+    WATCHED_FILES = ["metadata.json", "metadata.journal", "metrics_cache.json"]
+    NETWORK_FILESYSTEMS = ["nfs", "nfs4", "cifs", "smbfs", "smb3", "afs", "9p", "lustre", "gpfs", "beegfs", "ceph", "glusterfs", "panfs", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs"]
+
+    def __init__(self, tasks_dir, mode="auto", poll_interval=1.0):
+        self.tasks_dir = Path(tasks_dir)
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.changed_dirs = set()
+        self.rescan = False
+        self.inotify_fd = None
+        self.libc = None
+        self.watches = {}
+        self.watched_paths = {}
+        self.written_signatures = {}
+        self.signatures = {}
+        self.dir_mtimes = {}
+        self.dir_entries = {}
+        self.shard_dirs = set()
+
+    def start(self):
+        # inotify only reports changes made on this host, so on network filesystems the directory is polled instead
+        if self.mode == "inotify" or (self.mode == "auto" and not self.is_network_filesystem()):
+            try:
+                self._init_inotify()
+            except (OSError, AttributeError) as e:
+                if self.mode == "inotify":
+                    raise
+                self._close_inotify()
+                if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                    print("Warning: The inotify watch limit (fs.inotify.max_user_watches) is too low for all task directories, falling back to polling")
+
+        if self.inotify_fd is not None:
+            self.thread = threading.Thread(target=self._watch_inotify, daemon=True)
+        else:
+            self._poll_dir(self.tasks_dir, False)
+            self.thread = threading.Thread(target=self._watch_poll, daemon=True)
+        self.thread.start()
+
+    def is_network_filesystem(self):
+        return self.filesystem_type(self.tasks_dir) in TaskDirWatcher.NETWORK_FILESYSTEMS
+
+    @staticmethod
+    def filesystem_type(path):
+        path = os.path.realpath(str(path))
+        mount_point, filesystem_type = "", None
+        try:
+            with open("/proc/self/mounts", "r") as handle:
+                for line in handle:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+
+                    candidate = fields[1].replace("\\040", " ")
+                    if (path == candidate or path.startswith(candidate.rstrip("/") + "/")) and len(candidate) >= len(mount_point):
+                        mount_point, filesystem_type = candidate, fields[2]
+        except OSError:
+            return None
+        return filesystem_type
+
+    def note_written(self, path):
+        signature = self._signature(path)
+        with self.lock:
+            self.written_signatures[path] = signature
+        if path in self.signatures:
+            self.signatures[path] = self._poll_signature(path)
+
+    def pop_changes(self):
+        with self.lock:
+            changed_dirs, rescan = self.changed_dirs, self.rescan
+            self.changed_dirs, self.rescan = set(), False
+            written_signatures = {path: self.written_signatures[path] for path in changed_dirs if path in self.written_signatures}
+
+        # Changes whose files still look exactly like after the last write of this process are its own
+        for path, signature in written_signatures.items():
+            if self._signature(path) == signature:
+                changed_dirs.discard(path)
+            else:
+                with self.lock:
+                    if self.written_signatures.get(path) == signature:
+                        del self.written_signatures[path]
+        return changed_dirs, rescan
+
+    def _mark_changed(self, path):
+        with self.lock:
+            self.changed_dirs.add(path)
+
+    def _init_inotify(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = self.libc.inotify_init1(TaskDirWatcher.IN_NONBLOCK | TaskDirWatcher.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.inotify_fd = fd
+        self._watch_dir(self.tasks_dir, 0, False)
+
+    def _close_inotify(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        self.watches = {}
+        self.watched_paths = {}
+
+    def _add_watch(self, path, depth):
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(str(path)), TaskDirWatcher.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + str(path))
+        self.watches[wd] = (path, depth)
+        self.watched_paths[path] = wd
+
+    def _remove_watch(self, path):
+        if path in self.watched_paths:
+            wd = self.watched_paths.pop(path)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.inotify_fd, wd)
+
+    def _watch_dir(self, path, depth, mark_changed):
+        self._add_watch(path, depth)
+        try:
+            entries = list(os.scandir(str(path)))
+        except OSError:
+            return
+
+        descend = depth == 0 or (depth == 1 and self._is_shard(path))
+        for entry in entries:
+            if descend and entry.is_dir(follow_symlinks=False):
+                self._watch_dir(path / entry.name, depth + 1, mark_changed)
+            elif mark_changed and entry.name in TaskDirWatcher.WATCHED_FILES:
+                self._mark_changed(path)
+
+    @staticmethod
+    def _is_shard(path):
+        return len(path.name) == 2 and not any((path / name).exists() for name in TaskDirWatcher.WATCHED_FILES)
+
+    def _watch_inotify(self):
+        error = None
+        try:
+            while not self.stopped.is_set():
+                readable, _, _ = select.select([self.inotify_fd], [], [], self.poll_interval)
+                if len(readable) == 0:
+                    continue
+
+                try:
+                    buffer = os.read(self.inotify_fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset < len(buffer):
+                    wd, mask, cookie, length = TaskDirWatcher.EVENT_HEADER.unpack_from(buffer, offset)
+                    name = buffer[offset + TaskDirWatcher.EVENT_HEADER.size:offset + TaskDirWatcher.EVENT_HEADER.size + length].rstrip(b"\0").decode("utf-8", "replace")
+                    offset += TaskDirWatcher.EVENT_HEADER.size + length
+                    self._handle_event(wd, mask, name)
+        except OSError as e:
+            error = e
+        finally:
+            self._close_inotify()
+
+        # If watching fails, e.g. as the watch limit has been reached by new task dirs, all tasks are reloaded once and changes are polled from then on
+        if error is not None and not self.stopped.is_set():
+            print("Warning: Watching the tasks directory with inotify failed (" + str(error) + "), falling back to polling")
+            with self.lock:
+                self.rescan = True
+            self._poll_dir(self.tasks_dir, False)
+            self._watch_poll()
+
+    def _handle_event(self, wd, mask, name):
+        if mask & TaskDirWatcher.IN_Q_OVERFLOW:
+            with self.lock:
+                self.rescan = True
+            return
+
+        if wd not in self.watches:
+            return
+        path, depth = self.watches[wd]
+
+        if mask & TaskDirWatcher.IN_IGNORED:
+            self.watches.pop(wd, None)
+            if self.watched_paths.get(path) == wd:
+                del self.watched_paths[path]
+        elif mask & TaskDirWatcher.IN_DELETE_SELF:
+            self._mark_changed(path)
+        elif mask & TaskDirWatcher.IN_ISDIR:
+            child = path / name
+            if mask & (TaskDirWatcher.IN_CREATE | TaskDirWatcher.IN_MOVED_TO):
+                if depth == 0 or (depth == 1 and self._is_shard(path)):
+                    try:
+                        self._watch_dir(child, depth + 1, True)
+                    except OSError as e:
+                        if e.errno == errno.ENOSPC:
+                            raise
+                        self._mark_changed(child)
+            elif mask & (TaskDirWatcher.IN_DELETE | TaskDirWatcher.IN_MOVED_FROM):
+                self._remove_watch(child)
+                self._mark_changed(child)
+                for watched_path in [watched_path for watched_path in self.watched_paths if watched_path.parent == child]:
+                    self._remove_watch(watched_path)
+                    self._mark_changed(watched_path)
+        elif name in TaskDirWatcher.WATCHED_FILES and depth > 0:
+            self._mark_changed(path)
+
+    def _poll_dir(self, path, mark_changed):
+        try:
+            mtime = os.stat(str(path)).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        # A directory modified just now is listed again, as further changes within the same timestamp granularity would go unnoticed
+        if mtime is not None and mtime == self.dir_mtimes.get(path) and time.time() - mtime / 1e9 > self.poll_interval + 1:
+            return
+        self.dir_mtimes[path] = mtime
+
+        try:
+            children = set(path / entry.name for entry in os.scandir(str(path)) if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            children = set()
+        previous_children = self.dir_entries.get(path, set())
+        self.dir_entries[path] = children
+
+        for child in children - previous_children:
+            if path == self.tasks_dir and self._is_shard(child):
+                self.shard_dirs.add(child)
+                self._poll_dir(child, mark_changed)
+            else:
+                self.signatures[child] = self._poll_signature(child)
+                if mark_changed:
+                    self._mark_changed(child)
+
+        for child in previous_children - children:
+            if child in self.shard_dirs:
+                self.shard_dirs.discard(child)
+                self.dir_mtimes.pop(child, None)
+                for task_path in self.dir_entries.pop(child, set()):
+                    self._forget(task_path)
+            else:
+                self._forget(child)
+
+    def _forget(self, path):
+        self.signatures.pop(path, None)
+        self._mark_changed(path)
+
+    def _poll(self):
+        self._poll_dir(self.tasks_dir, True)
+        for shard_dir in list(self.shard_dirs):
+            self._poll_dir(shard_dir, True)
+
+        for path in list(self.signatures.keys()):
+            signature = self._poll_signature(path)
+            if signature != self.signatures.get(path, signature):
+                self.signatures[path] = signature
+                self._mark_changed(path)
+
+    @staticmethod
+    def _poll_signature(path):
+        # metadata.json and metrics_cache.json are always replaced, which changes the mtime of the task dir, so only the journal, which is appended to, has to be checked on its own
+        signature = []
+        for name in [".", "metadata.journal"]:
+            try:
+                stat = os.stat(str(path / name))
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _signature(path):
+        signature = []
+        for name in TaskDirWatcher.WATCHED_FILES:
+            try:
+                stat = os.stat(str(path / name))
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _watch_poll(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self._poll()
+            except OSError:
+                continue
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
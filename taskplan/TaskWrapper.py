@@ -1,6 +1,10 @@
 import datetime
+import faulthandler
+import hashlib
 import importlib
+import signal
 import sys
+import threading
 import uuid
 from enum import Enum
 
@@ -9,16 +13,22 @@ try:
 except ImportError:
   from pathlib import Path
 from taskconf.util.Logger import Logger
+
+from taskplan.CheckpointStore import CheckpointStore
+from taskplan.CpuAffinity import CpuAffinity
+from taskplan.LogWriter import LogWriter
+from taskplan.MemoryWatchdog import MemoryWatchdog
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.ScratchFlusher import ScratchFlusher
+from taskplan.TaskArchive import TaskArchive
+from taskplan.TaskDetails import TaskDetails
 import shutil
 import traceback
 import logging
 import json
 import os
 import time
-from filelock import SoftFileLock
-import tensorflow as tf
 import sys
-import math
 
 class State(Enum):
     INIT = 0
@@ -37,32 +47,51 @@ class PipeMsg(Enum):
     NEW_CHECKPOINT = 7
     SAVED_FINISHED_ITERATIONS = 8
     CREATE_CHECKPOINT = 9
+    MEMORY_USAGE = 10
+    ERROR_INFO = 11
 
 class StdOut(object):
-    def __init__(self, logger):
-        self.logger = logger
-        self.buffer = ""
+    def __init__(self, log_writer, level=logging.INFO):
+        self.log_writer = log_writer
+        self.level = level
+        self.buffer = []
 
     def write(self, message):
-        self.buffer += message
-        while '\n' in self.buffer:
-            i = self.buffer.find('\n')
-            self.logger.log(self.buffer[:i + 1])
-            self.buffer = self.buffer[i + 1:]
+        if '\n' not in message:
+            self.buffer.append(message)
+            return
 
+        lines = message.split('\n')
+        self.buffer.append(lines[0])
+        lines[0] = "".join(self.buffer)
+        for line in lines[:-1]:
+            self.log_writer.write(line + '\n', self.level)
+        self.buffer = [lines[-1]] if lines[-1] != "" else []
 
     def flush(self):
-        if self.buffer != "":
-            self.logger.log(self.buffer)
-        self.buffer = ""
+        if len(self.buffer) > 0:
+            self.log_writer.write("".join(self.buffer), self.level)
+        self.buffer = []
 
 class TaskWrapper:
-    def __init__(self, task_dir, class_name, config, project, total_iterations, tasks_dir, is_test=False, tags=[]):
-        self._reset_state(task_dir, class_name, config, project, total_iterations, tasks_dir, is_test, tags)
-
-        self._create_metadata_lock()
-
-    def _reset_state(self, task_dir, class_name, config, project, total_iterations, tasks_dir, is_test, tags):
+    SAVE_STAGING_DIR = ".saving"
+    UNSAVED_FILES = ["main.log", "metadata.json", "metadata.journal", "metrics_cache.json", TaskArchive.ARCHIVE_NAME]
+    CHECKPOINT_IGNORE = ["checkpoints", "metadata.json.lock", SAVE_STAGING_DIR]
+    METADATA_FILES = ["metadata.json", "metadata.journal", "metrics_cache.json"]
+    # Tasks are kept in memory for the whole history of the project, so they use slots instead of a per-instance dict
+    __slots__ = ["task_dir", "class_name", "config", "device", "state", "uuid", "project", "sharded", "iteration_rate", "start_time", "creation_time", "saved_time",
+                 "queue_index", "details", "latest_code_version", "checkpoint_bytes", "tasks_dir", "is_test", "total_iterations", "finished_iterations",
+                 "saved_finished_iterations", "had_error", "_is_running", "iteration_update_time", "pausing", "saving", "creating_checkpoint", "tags", "name",
+                 "metrics", "last_metrics_update", "memory_limit", "peak_memory", "memory_exceeded", "oom_requeues", "retries", "checkpoint_retention",
+                 "checkpoint_sequence", "archived", "disk_usage", "saved_bytes", "retry_after", "last_error", "previous_failure", "terminated", "stalled",
+                 "requeue_after_stop", "requeue_index", "preempt_deadline", "_metadata_journal", "_task_archive"]
+
+    def __init__(self, task_dir, class_name, config, project, total_iterations, tasks_dir, is_test=False, tags=[], memory_limit=None):
+        self._reset_state(task_dir, class_name, config, project, total_iterations, tasks_dir, is_test, tags, memory_limit)
+
+        self._create_metadata_journal()
+
+    def _reset_state(self, task_dir, class_name, config, project, total_iterations, tasks_dir, is_test, tags, memory_limit):
         self.task_dir = task_dir
         self.class_name = class_name
         self.config = config
@@ -70,15 +99,17 @@ class TaskWrapper:
         self.state = State.INIT
         self.uuid = uuid.uuid4()
         self.project = project
+        self.sharded = project.shard_tasks_dir and not is_test
         self.iteration_rate = None
         self.start_time = None
         self.creation_time = datetime.datetime.now()
         self.saved_time = datetime.datetime.now()
         self.queue_index = 0
-        self.code_versions = {}
+        self.details = TaskDetails()
+        self.latest_code_version = None
+        self.checkpoint_bytes = 0
         self.tasks_dir = tasks_dir
         self.is_test = is_test
-        self.checkpoints = []
         self.total_iterations = total_iterations
         self.finished_iterations = 0
         self.saved_finished_iterations = 0
@@ -88,42 +119,140 @@ class TaskWrapper:
         self.pausing = False
         self.saving = False
         self.creating_checkpoint = False
-        self.notes = ""
         self.tags = tags
         self.name = []
         self.metrics = {}
         self.last_metrics_update = 0
+        self.memory_limit = memory_limit
+        self.peak_memory = None
+        self.memory_exceeded = False
+        self.oom_requeues = 0
+        self.retries = 0
+        self.checkpoint_retention = None
+        self.checkpoint_sequence = 0
+        self.archived = False
+        self.disk_usage = None
+        self.saved_bytes = None
+        self.retry_after = None
+        self.last_error = None
+        self.previous_failure = None
+        self.terminated = False
+        self.stalled = False
+        self.requeue_after_stop = False
+        self.requeue_index = None
+        self.preempt_deadline = None
+
+    def _hydrated_details(self):
+        if self.details is None:
+            # The task catalog only keeps summaries, so the details are read from the task dir itself
+            data = MetadataJournal(self.build_save_dir()).load()
+            self.details = TaskDetails.from_metadata(data) if "checkpoints" in data else TaskDetails()
+            self.project.note_hydrated(self)
+        return self.details
+
+    def dehydrate(self):
+        if self.state in [State.RUNNING, State.QUEUED]:
+            return False
+
+        if self.details is not None:
+            self.latest_code_version = self.details.latest_code_version()
+            self.checkpoint_bytes = self.details.checkpoint_bytes()
+            self.details = None
+        self._create_metadata_journal()
+        return True
+
+    @property
+    def code_versions(self):
+        return self._hydrated_details().code_versions
+
+    @code_versions.setter
+    def code_versions(self, code_versions):
+        self._hydrated_details().code_versions = code_versions
+
+    @property
+    def checkpoints(self):
+        return self._hydrated_details().checkpoints
+
+    @checkpoints.setter
+    def checkpoints(self, checkpoints):
+        self._hydrated_details().checkpoints = checkpoints
+
+    @property
+    def notes(self):
+        return self._hydrated_details().notes
 
-    def load_metric_cache(self, path):
-        if (path / "metrics_cache.json").exists():
+    @notes.setter
+    def notes(self, notes):
+        self._hydrated_details().notes = notes
+
+    def load_metric_cache(self, path, data=None):
+        if data is None and (path / "metrics_cache.json").exists():
             with open(str(path / "metrics_cache.json"), "r") as handle:
                 data = json.load(handle)
-                self.metrics = data["metrics"]
-                self.last_metrics_update = data["last_metrics_update"]
+
+        if data is not None:
+            self.metrics = data["metrics"]
+            self.last_metrics_update = data["last_metrics_update"]
 
     def save_metric_cache(self):
         path = self.build_save_dir()
         path.mkdir(parents=True, exist_ok=True)
         path = path / "metrics_cache.json"
 
-        with open(str(path), 'w') as handle:
-            json.dump({"metrics": self.metrics, "last_metrics_update": self.last_metrics_update}, handle)
-
-    def _create_metadata_lock(self):
-        path = self.build_save_dir()
-        path = path / "metadata.json.lock"
-        self.metadata_lock = SoftFileLock(path)
-
-    def start(self, print_log):
+        data = {"metrics": self.metrics, "last_metrics_update": self.last_metrics_update}
+        with self.metadata_journal.lock:
+            previous_signature = self.project.task_catalog.signature(path.parent)
+            # The cache is replaced instead of rewritten, so watchers polling the task dir's mtime notice the change
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(str(tmp_path), 'w') as handle:
+                json.dump(data, handle)
+            os.replace(str(tmp_path), str(path))
+            self.project.note_task_dir_written(path.parent)
+
+            if not self.is_test:
+                self.project.task_catalog.update(path.parent, metrics=data, previous_signature=previous_signature)
+
+    def _create_metadata_journal(self):
+        self._metadata_journal = None
+        self._task_archive = None
+
+    @property
+    def metadata_journal(self):
+        if self._metadata_journal is None:
+            self._metadata_journal = MetadataJournal(self.build_save_dir(), on_write=self.project.note_task_dir_written)
+        return self._metadata_journal
+
+    @property
+    def task_archive(self):
+        if self._task_archive is None:
+            self._task_archive = TaskArchive(self.build_save_dir())
+        return self._task_archive
+
+    def _prepare_start(self):
+        self.unarchive()
         sys.stdout.flush()
         self.pausing = False
         self._is_running = True
         self.had_error = False
+        self.memory_exceeded = False
+        self.stalled = False
+        self.requeue_after_stop = False
+        self.requeue_index = None
+        self.preempt_deadline = None
+        self.retry_after = None
+        self.last_error = None
+        self.terminated = False
         metadata = {
             "task_dir": self.build_save_dir(),
             "finished_iterations": self.finished_iterations,
             "total_iterations": self.total_iterations,
-            "task_uuid": str(self.uuid)
+            "task_uuid": str(self.uuid),
+            "log_settings": self.project.log_settings,
+            "shared_array_settings": self.project.shared_array_settings,
+            "memory_limit": self.memory_limit,
+            "checkpoint_sequence": self.checkpoint_sequence,
+            "saved_bytes": self.saved_bytes,
+            "checkpoint_store_dir": self.project.checkpoint_store.store_dir
         }
         did_update = self.project.configuration.renew_task_config(self)
         if did_update:
@@ -134,14 +263,33 @@ class TaskWrapper:
             recent_id = self.most_recent_code_version()
             if recent_id != commit_id:
                 self.code_versions[str(self.finished_iterations)] = commit_id
+                self.latest_code_version = commit_id
                 self.save_metadata(["code_versions"])
 
+        return metadata
+
+    def start(self, print_log):
+        metadata = self._prepare_start()
         self.device.run_task(self.task_dir, self.class_name, self.config.clone(), metadata, print_log)
         self.start_time = time.time()
         self.state = State.RUNNING
 
+    @staticmethod
+    def start_packed(tasks, print_log):
+        metadatas = [task._prepare_start() for task in tasks]
+        tasks[0].device.run_packed_tasks(tasks[0].task_dir, tasks[0].class_name, [task.config.clone() for task in tasks], metadatas, print_log)
+        for task in tasks:
+            task.start_time = time.time()
+            task.state = State.RUNNING
+
+    def memory_requirement(self):
+        return self.memory_limit if self.memory_limit is not None else self.peak_memory
+
+    def is_packable_with(self, other):
+        return not self.is_test and not other.is_test and self.project == other.project and self.task_dir == other.task_dir and self.class_name == other.class_name and self.most_recent_code_version() == other.most_recent_code_version()
+
     def most_recent_code_version(self):
-        return max(self.code_versions.items(), key=lambda x: int(x[0]))[1] if len(self.code_versions) > 0 else None
+        return self.latest_code_version
 
     def set_as_running(self, device, start_time):
         self.pausing = False
@@ -161,12 +309,38 @@ class TaskWrapper:
 
     def pause(self):
         if self.state == State.RUNNING:
-            self.device.send(PipeMsg.PAUSING, True)
+            self.device.send(PipeMsg.PAUSING, True, str(self.uuid))
+
+    def preempt(self, timeout):
+        if self.state == State.RUNNING and self.preempt_deadline is None:
+            self.pause()
+            self.preempt_deadline = time.time() + timeout
+
+    def preemption_timed_out(self):
+        return self.preempt_deadline is not None and time.time() > self.preempt_deadline
 
     def terminate(self):
         if self.state == State.RUNNING:
+            # Packed tasks share one process, so the other tasks of the pack are stopped as well and resume from their last save later
+            for other in self.device.runnings:
+                if other is not self and other.state == State.RUNNING and not other.terminated:
+                    other.terminated = True
+                    other.requeue_after_stop = True
+            self.terminated = True
             self.device.terminate()
 
+    def was_killed(self):
+        return self._is_running and not self.terminated and not self.memory_exceeded
+
+    def dump_stacks(self):
+        if self.state == State.RUNNING:
+            self.device.dump_stacks()
+
+    def seconds_since_progress(self):
+        if not isinstance(self.start_time, (int, float)):
+            return None
+        return time.time() - max(self.start_time, self.iteration_update_time)
+
     def finish(self):
         if self.state == State.STOPPED:
             self.total_iterations = self.finished_iterations
@@ -178,7 +352,7 @@ class TaskWrapper:
 
         self.state = State.STOPPED
         if self.device is not None:
-            self.device.join()
+            self.device.join(str(self.uuid))
             self.device = None
 
     def is_running(self):
@@ -189,92 +363,398 @@ class TaskWrapper:
 
     @staticmethod
     def _run(task_dir, class_name, config, metadata, print_log):
+        TaskWrapper._run_packed(task_dir, class_name, [config], [metadata], print_log)
 
-        logger = Logger(metadata["task_dir"], "main", terminal=sys.stdout if print_log else None)
-        sys.stdout = StdOut(logger)
-        sys.stderr = sys.stdout
+    @staticmethod
+    def _run_packed(task_dir, class_name, configs, metadatas, print_log):
+        loggers = [Logger(metadata["task_dir"], "main", terminal=sys.stdout if print_log and i == 0 else None) for i, metadata in enumerate(metadatas)]
+        log_writer = LogWriter(loggers[0], **metadatas[0].get("log_settings", {}))
+        sys.stdout = StdOut(log_writer)
+        sys.stderr = StdOut(log_writer)
+        finished_task_uuids = []
+
+        preemption = threading.Event()
+        scratch_flusher = ScratchFlusher(metadatas[0]["scratch_dir"]) if metadatas[0].get("scratch_dir") is not None else None
+        for metadata in metadatas:
+            metadata["preemption"] = preemption
+            metadata["scratch_flusher"] = scratch_flusher
+
+        def on_sigterm(signum, frame):
+            if not preemption.is_set():
+                preemption.set()
+                log_writer.write("Received SIGTERM, stopping after the current iteration has been finished and saved\n", logging.WARNING, loggers)
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+        def on_memory_exceeded(peak_memory):
+            log_writer.write("Stopping as the memory usage of " + str(int(peak_memory)) + "MB exceeded the limit of " + str(memory_watchdog.memory_limit) + "MB\n", logging.ERROR, loggers)
+            log_writer.close()
+            for metadata in metadatas:
+                if metadata["task_uuid"] not in finished_task_uuids:
+                    metadata["pipe"].send(PipeMsg.MEMORY_USAGE, {"peak_memory": TaskWrapper._memory_share(peak_memory, metadata, metadatas), "exceeded": True})
+
+        # The whole pack is stopped once the process exceeds the sum of its tasks' limits
+        memory_limits = [metadata.get("memory_limit") for metadata in metadatas]
+        memory_watchdog = MemoryWatchdog(None if None in memory_limits else sum(memory_limits), on_memory_exceeded)
+        memory_watchdog.start()
+
+        stack_dump_file = open(str(metadatas[0]["task_dir"] / "main.log"), "a")
+        faulthandler.register(signal.SIGUSR1, file=stack_dump_file, all_threads=True)
         try:
+            if metadatas[0].get("cpus") is not None:
+                CpuAffinity.apply(metadatas[0]["cpus"])
+
             sys.path = [str(task_dir)] + sys.path
             os.chdir(str(task_dir))
             task_class = getattr(importlib.import_module(class_name, "."), class_name[class_name.rfind(".") + 1:] if "." in class_name else class_name)
 
-            TaskWrapper._run_task(task_class, config, logger, metadata)
+            if len(metadatas) == 1:
+                TaskWrapper._run_task(task_class, configs[0], loggers[0], metadatas[0])
+            else:
+                TaskWrapper._run_packed_tasks(task_class, configs, loggers, metadatas, finished_task_uuids, log_writer)
+
+            if scratch_flusher is not None:
+                scratch_flusher.wait()
 
         except:
-            logger.log(traceback.format_exc(), logging.ERROR)
-            metadata["pipe"].send(PipeMsg.HAD_ERROR, True)
+            sys.stderr.flush()
+            log_writer.write(traceback.format_exc(), logging.ERROR, [logger for logger, metadata in zip(loggers, metadatas) if metadata["task_uuid"] not in finished_task_uuids])
+            error = TaskWrapper._classify_error(*sys.exc_info())
+            for metadata in metadatas:
+                if metadata["task_uuid"] not in finished_task_uuids:
+                    metadata["pipe"].send(PipeMsg.ERROR_INFO, error)
+                    metadata["pipe"].send(PipeMsg.HAD_ERROR, True)
+
+        if scratch_flusher is not None:
+            try:
+                scratch_flusher.close()
+            except:
+                log_writer.write(traceback.format_exc(), logging.ERROR)
+
+        MetadataJournal.sync_all()
+        memory_watchdog.stop()
+        faulthandler.unregister(signal.SIGUSR1)
+        stack_dump_file.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        log_writer.close()
+        for metadata in metadatas:
+            if metadata["task_uuid"] not in finished_task_uuids:
+                metadata["pipe"].send(PipeMsg.MEMORY_USAGE, {"peak_memory": TaskWrapper._memory_share(MemoryWatchdog.peak_memory(), metadata, metadatas), "exceeded": False})
+                metadata["pipe"].send(PipeMsg.IS_RUNNING, False)
 
-        metadata["pipe"].send(PipeMsg.IS_RUNNING, False)
+    @staticmethod
+    def _memory_share(peak_memory, metadata, metadatas):
+        # The memory of a pack's process is attributed to its tasks in proportion to their limits, or equally if not all of them have one
+        memory_limits = [other.get("memory_limit") for other in metadatas]
+        if None in memory_limits or sum(memory_limits) <= 0:
+            return peak_memory / len(metadatas)
+        return peak_memory * metadata["memory_limit"] / sum(memory_limits)
 
+    @staticmethod
+    def _is_unsaved_file(name):
+        return name in TaskWrapper.UNSAVED_FILES or name.startswith("events.out.tfevents.")
 
     @staticmethod
-    def _create_checkpoint(metadata_lock, task_dir, finished_iterations):
-        with metadata_lock:
-            checkpoint_dir = task_dir / Path("checkpoints")
-            checkpoint_dir.mkdir(exist_ok=True)
-            checkpoint_dir /= Path(str(finished_iterations))
+    def _saved_size(path):
+        size = 0
+        for root, dirs, filenames in os.walk(str(path)):
+            if root == str(path):
+                dirs[:] = [directory for directory in dirs if directory not in ["checkpoints", TaskWrapper.SAVE_STAGING_DIR]]
+                filenames = [filename for filename in filenames if not TaskWrapper._is_unsaved_file(filename)]
+            for filename in filenames:
+                try:
+                    size += os.lstat(os.path.join(root, filename)).st_size
+                except OSError:
+                    pass
+        return size
 
-            shutil.copytree(str(task_dir), str(checkpoint_dir), ignore=lambda directory, contents: ['checkpoints', 'metadata.json.lock'] if directory == str(task_dir) else [])
-            for file in checkpoint_dir.glob("events.out.tfevents.*"):
-                file.rename(str(file).replace("events.out.tfevents", "events.out.checkpoint"))
+    @staticmethod
+    def _disk_usage(path, saved_bytes):
+        # Files written by saves are counted incrementally, only logs, event files and metadata are stat'ed
+        size = saved_bytes
+        for entry in os.scandir(str(path)):
+            if TaskWrapper._is_unsaved_file(entry.name) and entry.is_file(follow_symlinks=False):
+                try:
+                    size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+        return size
+
+    @staticmethod
+    def _classify_error(error_type, error, error_traceback):
+        frames = "".join(frame.filename + ":" + frame.name + ":" + str(frame.lineno) + ";" for frame in traceback.extract_tb(error_traceback))
+        return {
+            "type": error_type.__name__,
+            "message": str(error),
+            "signature": hashlib.sha1((error_type.__name__ + ";" + frames).encode("utf-8")).hexdigest()[:16],
+            "types": [base.__name__ for base in error_type.__mro__]
+        }
+
+    @staticmethod
+    def _snapshot_checkpoint(task_dir, staging_dir):
+        event_files = {path.name: path.stat().st_size for path in task_dir.glob("events.out.tfevents.*")}
+        sizes = {}
+        for relative_path in CheckpointStore.list_files(task_dir, TaskWrapper.CHECKPOINT_IGNORE + list(event_files.keys())):
+            if not relative_path.endswith(".flushing"):
+                try:
+                    sizes[relative_path] = None if relative_path in TaskWrapper.METADATA_FILES else os.lstat(str(task_dir / relative_path)).st_size
+                except OSError:
+                    pass
+
+        for relative_path in CheckpointStore.list_files(staging_dir):
+            sizes[relative_path] = os.lstat(str(staging_dir / relative_path)).st_size
+        return sizes, event_files
+
+    @staticmethod
+    def _create_checkpoint(metadata_journal, checkpoint_store, task_dir, finished_iterations, sequence, metrics={}, snapshot=None):
+        with metadata_journal.lock:
+            if snapshot is None:
+                event_files = {path.name: path.stat().st_size for path in task_dir.glob("events.out.tfevents.*")}
+                manifest_id, stored_bytes = checkpoint_store.store(task_dir, ignore=TaskWrapper.CHECKPOINT_IGNORE + list(event_files.keys()))
+            else:
+                sizes, event_files = snapshot
+                manifest_id, stored_bytes = checkpoint_store.store(task_dir, sizes=sizes)
 
             checkpoint = {
                 "finished_iterations": finished_iterations,
-                "time": time.mktime(datetime.datetime.now().timetuple())
+                "sequence": sequence,
+                "time": time.mktime(datetime.datetime.now().timetuple()),
+                "manifest": manifest_id,
+                "stored_bytes": stored_bytes,
+                "event_files": event_files,
+                "metrics": metrics,
+                "tags": []
             }
 
-            with open(str(task_dir / Path("metadata.json")), 'r') as handle:
-                data = json.load(handle)
-            with open(str(task_dir / Path("metadata.json")), 'w') as handle:
-                data['checkpoints'].append(checkpoint)
-                data['finished_iterations'] = finished_iterations
-                json.dump(data, handle)
+            metadata_journal.update({"finished_iterations": finished_iterations, "checkpoint_sequence": sequence + 1}, {"checkpoints": checkpoint})
             return checkpoint
 
     @staticmethod
-    def _run_task(task_class, config, logger, metadata):
+    def _create_task(task_class, config, logger, metadata):
         config.set_logger(logger.get_with_module('config'))
         config.iteration_cursor = metadata["finished_iterations"]
 
         task = task_class(config, logger.get_with_module('task'), metadata)
-        metadata_lock = SoftFileLock(metadata["task_dir"] / "metadata.json.lock")
-
-        def save_func(finished_iterations):
-            with metadata_lock:
-                task.save(metadata["task_dir"])
-                with open(str(metadata["task_dir"] / Path("metadata.json")), 'r') as handle:
-                    data = json.load(handle)
-
-                with open(str(metadata["task_dir"] / Path("metadata.json")), 'w') as handle:
-                    data['saved_time'] = time.mktime(datetime.datetime.now().timetuple())
-                    data['finished_iterations'] = finished_iterations
-                    json.dump(data, handle)
-
-            metadata["pipe"].send(PipeMsg.SAVED_FINISHED_ITERATIONS, {"saved_finished_iterations": finished_iterations, "saved_time": data['saved_time']})
+        metadata_journal = MetadataJournal(metadata["task_dir"])
+        checkpoint_store = CheckpointStore(metadata["checkpoint_store_dir"])
+        scratch_flusher = metadata.get("scratch_flusher")
+        checkpoint_sequence = [metadata.get("checkpoint_sequence", 0)]
+        saved_bytes = [metadata.get("saved_bytes")]
+
+        def mark_as_saved(finished_iterations, written_bytes):
+            saved_time = time.mktime(datetime.datetime.now().timetuple())
+            if saved_bytes[0] is None:
+                saved_bytes[0] = TaskWrapper._saved_size(metadata["task_dir"])
+            else:
+                saved_bytes[0] += written_bytes
+            disk_usage = TaskWrapper._disk_usage(metadata["task_dir"], saved_bytes[0])
+            metadata_journal.update({"saved_time": saved_time, "finished_iterations": finished_iterations, "saved_bytes": saved_bytes[0], "disk_usage": disk_usage})
+            return {"saved_finished_iterations": finished_iterations, "saved_time": saved_time, "saved_bytes": saved_bytes[0], "disk_usage": disk_usage}
+
+        def save_func(finished_iterations, snapshot_checkpoint=False):
+            if scratch_flusher is not None:
+                staging_dir = scratch_flusher.staging_dir(metadata["task_uuid"])
+                task.save(staging_dir)
+
+                snapshot = None
+                if snapshot_checkpoint:
+                    # The content of the checkpoint is fixed now, the flusher only stores it after the save has been moved into the task dir
+                    scratch_flusher.wait()
+                    snapshot = TaskWrapper._snapshot_checkpoint(metadata["task_dir"], staging_dir)
+
+                def flush():
+                    with metadata_journal.lock:
+                        written_bytes = ScratchFlusher.move_files(staging_dir, metadata["task_dir"])
+                        saved = mark_as_saved(finished_iterations, written_bytes)
+                    metadata["pipe"].send(PipeMsg.SAVED_FINISHED_ITERATIONS, saved)
+                scratch_flusher.submit(flush)
+                return snapshot
+            else:
+                with metadata_journal.lock:
+                    # Saving into a staging directory tells exactly how many bytes the save has added
+                    staging_dir = metadata["task_dir"] / TaskWrapper.SAVE_STAGING_DIR
+                    if staging_dir.exists():
+                        shutil.rmtree(str(staging_dir))
+                    staging_dir.mkdir()
+                    task.save(staging_dir)
+                    written_bytes = ScratchFlusher.move_files(staging_dir, metadata["task_dir"], copy=False)
+                    saved = mark_as_saved(finished_iterations, written_bytes)
+                metadata["pipe"].send(PipeMsg.SAVED_FINISHED_ITERATIONS, saved)
 
         def checkpoint_func(finished_iterations):
-            save_func(finished_iterations)
-            checkpoint = TaskWrapper._create_checkpoint(metadata_lock, metadata["task_dir"], finished_iterations)
+            snapshot = save_func(finished_iterations, snapshot_checkpoint=True)
+            metrics = task.checkpoint_metrics()
+            sequence = checkpoint_sequence[0]
+            checkpoint_sequence[0] += 1
+            if scratch_flusher is not None:
+                scratch_flusher.submit(lambda: metadata["pipe"].send(PipeMsg.NEW_CHECKPOINT, TaskWrapper._create_checkpoint(metadata_journal, checkpoint_store, metadata["task_dir"], finished_iterations, sequence, metrics, snapshot)))
+                return None
+            checkpoint = TaskWrapper._create_checkpoint(metadata_journal, checkpoint_store, metadata["task_dir"], finished_iterations, sequence, metrics)
             return checkpoint
 
         if metadata["finished_iterations"] > 0:
             task.load(metadata["task_dir"])
+
+        return task, save_func, checkpoint_func
+
+    @staticmethod
+    def _run_task(task_class, config, logger, metadata):
+        task, save_func, checkpoint_func = TaskWrapper._create_task(task_class, config, logger, metadata)
         task.run(save_func, checkpoint_func)
 
         save_func(task.finished_iterations)
 
+    @staticmethod
+    def _run_packed_tasks(task_class, configs, loggers, metadatas, finished_task_uuids, log_writer):
+        # Output is written into the logs of the given tasks, so each task's main.log only contains what has been printed while its code was running
+        def select_func(task_ids):
+            sys.stdout.flush()
+            sys.stderr.flush()
+            log_writer.select([loggers[i] for i in task_ids])
+
+        tasks, save_funcs, checkpoint_funcs, finish_funcs, error_funcs = [], [], [], [], []
+        for config, logger, metadata in zip(configs, loggers, metadatas):
+            task, save_func, checkpoint_func = TaskWrapper._create_task(task_class, config, logger, metadata)
+
+            def finish_func(task=task, save_func=save_func, metadata=metadata):
+                save_func(task.finished_iterations)
+                if metadata.get("scratch_flusher") is not None:
+                    metadata["scratch_flusher"].wait()
+                finished_task_uuids.append(metadata["task_uuid"])
+                metadata["pipe"].send(PipeMsg.IS_RUNNING, False)
+
+            # A failing task is stopped on its own, the other tasks of the pack keep running
+            def error_func(logger=logger, metadata=metadata):
+                sys.stderr.flush()
+                log_writer.write(traceback.format_exc(), logging.ERROR, [logger])
+                finished_task_uuids.append(metadata["task_uuid"])
+                metadata["pipe"].send(PipeMsg.ERROR_INFO, TaskWrapper._classify_error(*sys.exc_info()))
+                metadata["pipe"].send(PipeMsg.HAD_ERROR, True)
+                metadata["pipe"].send(PipeMsg.MEMORY_USAGE, {"peak_memory": TaskWrapper._memory_share(MemoryWatchdog.peak_memory(), metadata, metadatas), "exceeded": False})
+                metadata["pipe"].send(PipeMsg.IS_RUNNING, False)
+
+            tasks.append(task)
+            save_funcs.append(save_func)
+            checkpoint_funcs.append(checkpoint_func)
+            finish_funcs.append(finish_func)
+            error_funcs.append(error_func)
+
+        task_class.run_packed(tasks, save_funcs, checkpoint_funcs, finish_funcs, select_func, error_funcs)
+        select_func(range(len(loggers)))
+
     def build_save_dir(self):
-        return self.tasks_dir / ("" if self.is_test else str(self.uuid))
+        if self.is_test:
+            return self.tasks_dir
+        elif self.sharded:
+            return self.tasks_dir / str(self.uuid)[:2] / str(self.uuid)
+        else:
+            return self.tasks_dir / str(self.uuid)
+
+    def set_sharded(self, sharded):
+        if self.is_test or self.sharded == sharded or self.state in [State.RUNNING, State.QUEUED]:
+            return False
+
+        old_save_dir = self.build_save_dir()
+        self.sharded = sharded
+        self.project.file_cloner.move_tree(old_save_dir, self.build_save_dir())
+        if old_save_dir.parent != self.tasks_dir and not any(old_save_dir.parent.iterdir()):
+            old_save_dir.parent.rmdir()
+        self.set_save_dir_layout(sharded)
+        return True
+
+    def set_save_dir_layout(self, sharded):
+        self.sharded = sharded
+        self._create_metadata_journal()
 
     def build_checkpoint_dir(self, checkpoint_id):
-        return self.build_save_dir() / "checkpoints" / str(self.checkpoints[checkpoint_id]["finished_iterations"])
+        checkpoint = self.checkpoints[checkpoint_id]
+        checkpoint_dir = self.checkpoint_dir(checkpoint)
+        self.unarchive()
+        if "manifest" in checkpoint and not checkpoint_dir.exists():
+            checkpoint_dir.parent.mkdir(parents=True, exist_ok=True)
+            self.project.checkpoint_store.materialize(checkpoint["manifest"], checkpoint_dir, prepare=lambda tmp_dir: self._link_checkpoint_event_files(checkpoint, tmp_dir))
+        return checkpoint_dir
+
+    def materialize_checkpoint(self, checkpoint_id, target_dir):
+        # The target becomes a task of its own, so the prefixes of the event files are written as regular event files
+        checkpoint = self.checkpoints[checkpoint_id]
+        self.unarchive()
+        return self.project.checkpoint_store.materialize(checkpoint["manifest"], target_dir, prepare=lambda tmp_dir: self._link_checkpoint_event_files(checkpoint, tmp_dir, "events.out.tfevents"))
+
+    def refresh_disk_usage(self, recount=False):
+        if self.archived:
+            self.disk_usage = TaskWrapper._disk_usage(self.build_save_dir(), 0)
+        else:
+            if recount or self.saved_bytes is None:
+                self.saved_bytes = TaskWrapper._saved_size(self.build_save_dir())
+            self.disk_usage = TaskWrapper._disk_usage(self.build_save_dir(), self.saved_bytes)
+        self.save_metadata(["saved_bytes", "disk_usage"])
+
+    def total_disk_usage(self):
+        if self.disk_usage is None:
+            return None
+        return self.disk_usage + (self.checkpoint_bytes if self.details is None else self.details.checkpoint_bytes())
+
+    def checkpoint_dir(self, checkpoint):
+        return self.build_save_dir() / "checkpoints" / str(checkpoint["finished_iterations"])
+
+    def remove_checkpoints(self, checkpoints):
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint not in checkpoints]
+        self.metadata_journal.update(removes={"checkpoints": checkpoints})
+
+    def set_checkpoint_tags(self, checkpoint_id, tags):
+        old_checkpoint = self.checkpoints[checkpoint_id]
+        self.checkpoints[checkpoint_id] = dict(old_checkpoint, tags=tags)
+        self.metadata_journal.update(appends={"checkpoints": self.checkpoints[checkpoint_id]}, removes={"checkpoints": [old_checkpoint]})
+
+    def archive(self):
+        if self.state in [State.RUNNING, State.QUEUED] or self.archived:
+            return False
+
+        self.metadata_journal.compact()
+        self.task_archive.pack(exclude=[self.checkpoint_dir(checkpoint) for checkpoint in self.checkpoints if "manifest" in checkpoint], **self.project.archive_settings)
+        self.archived = True
+        self.save_metadata(["archived"])
+        self.refresh_disk_usage()
+        return True
+
+    def unarchive(self):
+        if self.archived:
+            self.task_archive.unpack()
+            self.archived = False
+            self.save_metadata(["archived"])
+            self.refresh_disk_usage()
+
+    def readable_path(self, name):
+        if self.archived:
+            return self.task_archive.extract_file(name)
+        return self.build_save_dir() / name
+
+    def set_checkpoint_retention(self, checkpoint_retention):
+        self.checkpoint_retention = checkpoint_retention
+        self.save_metadata(["checkpoint_retention"])
+
+    def _link_checkpoint_event_files(self, checkpoint, checkpoint_dir, event_file_prefix="events.out.checkpoint"):
+        for name, offset in checkpoint.get("event_files", {}).items():
+            event_file = self.build_save_dir() / name
+            if event_file.exists() and event_file.stat().st_size >= offset:
+                self.project.file_cloner.clone_file_prefix(event_file, checkpoint_dir / name.replace("events.out.tfevents", event_file_prefix), offset)
+
+    def retain_checkpoints(self):
+        for checkpoint in self.checkpoints:
+            if "manifest" in checkpoint:
+                self.project.checkpoint_store.retain(checkpoint["manifest"])
+
+    def release_checkpoints(self):
+        for checkpoint in self.checkpoints:
+            if "manifest" in checkpoint:
+                self.project.checkpoint_collector.release(checkpoint["manifest"])
 
     def save_metadata(self, keys_only=None):
         path = self.build_save_dir()
         path.mkdir(parents=True, exist_ok=True)
-        path = path / "metadata.json"
 
-        with self.metadata_lock:
+        with self.metadata_journal.lock:
             new_data = {}
             new_data['uuid'] = str(self.uuid)
             new_data['finished_iterations'] = self.finished_iterations
@@ -282,59 +762,90 @@ class TaskWrapper:
             new_data['creation_time'] = time.mktime(self.creation_time.timetuple())
             new_data['saved_time'] = time.mktime(self.saved_time.timetuple()) if self.saved_time is not None else ""
             new_data['had_error'] = self.had_error
-            new_data['config'] = self.config.data
-            new_data['code_versions'] = self.code_versions
-            new_data['checkpoints'] = self.checkpoints
-            new_data['notes'] = self.notes
+            if keys_only is None or "config" in keys_only:
+                new_data['config'] = {"ref": self.project.config_store.store(self.config.data)}
             new_data['tags'] = self.tags
-
-            if path.exists():
-                with open(str(path), "r") as handle:
-                    old_data = json.load(handle)
-            else:
-                old_data = {}
-
-            for key in new_data.keys():
-                if keys_only is None or key in keys_only:
-                    old_data[key] = new_data[key]
-
-            with open(str(path), 'w') as handle:
-                json.dump(old_data, handle, indent=2, separators=(',', ': '))
-
-    def load_metadata(self, path, ignore_total_iterations=False):
-        with open(str(path / "metadata.json"), "r") as handle:
-            data = json.load(handle)
-            self.uuid = uuid.UUID(data['uuid'])
-            self.config = self.project.configuration.load_task(data['config'])
-            self.finished_iterations = data['finished_iterations']
-            self.saved_finished_iterations = self.finished_iterations
-            if not ignore_total_iterations:
-                self.total_iterations = data['total_iterations']
-            self.creation_time = datetime.datetime.fromtimestamp(data['creation_time'])
-            self.saved_time = datetime.datetime.fromtimestamp(data['saved_time']) if data['saved_time'] != "" else None
-            self.had_error = data['had_error']
-            self.code_versions = data['code_versions']
-            self.checkpoints = data['checkpoints']
-            self.notes = data['notes']
-            self.tags = data['tags'] if "tags" in data else []
-            self._create_metadata_lock()
+            new_data['memory_limit'] = self.memory_limit
+            new_data['peak_memory'] = self.peak_memory
+            new_data['oom_requeues'] = self.oom_requeues
+            new_data['retries'] = self.retries
+            new_data['checkpoint_retention'] = self.checkpoint_retention
+            new_data['checkpoint_sequence'] = self.checkpoint_sequence
+            new_data['archived'] = self.archived
+            new_data['disk_usage'] = self.disk_usage
+            new_data['saved_bytes'] = self.saved_bytes
+
+            with_details = self.details is not None or keys_only is None or any(key in keys_only for key in ["code_versions", "checkpoints", "notes"])
+            if with_details:
+                new_data['code_versions'] = self.code_versions
+                new_data['checkpoints'] = self.checkpoints
+                new_data['notes'] = self.notes
+
+            new_data = {key: value for key, value in new_data.items() if keys_only is None or key in keys_only}
+            previous_signature = self.project.task_catalog.signature(path)
+            self.metadata_journal.update(new_data)
+            if keys_only is None:
+                self.metadata_journal.compact()
+
+            if not self.is_test:
+                self.project.task_catalog.update(path, metadata=new_data, partial=keys_only is not None, previous_signature=previous_signature)
+
+    def load_metadata(self, path, ignore_total_iterations=False, data=None, hydrate=True):
+        if data is None:
+            data = MetadataJournal(path).load()
+        self.uuid = uuid.UUID(data['uuid'])
+        self.config = self.project.load_task_config(data['config'])
+        self.finished_iterations = data['finished_iterations']
+        self.saved_finished_iterations = self.finished_iterations
+        if not ignore_total_iterations:
+            self.total_iterations = data['total_iterations']
+        self.creation_time = datetime.datetime.fromtimestamp(data['creation_time'])
+        self.saved_time = datetime.datetime.fromtimestamp(data['saved_time']) if data['saved_time'] != "" else None
+        self.had_error = data['had_error']
+        if "checkpoints" in data:
+            self.details = TaskDetails.from_metadata(data)
+            self.latest_code_version = self.details.latest_code_version()
+            self.checkpoint_bytes = self.details.checkpoint_bytes()
+        else:
+            self.details = None
+            self.latest_code_version = data.get("latest_code_version")
+            self.checkpoint_bytes = data.get("checkpoint_bytes", 0)
+        if not hydrate:
+            self.details = None
+        elif self.details is not None:
+            self.project.note_hydrated(self)
+        self.tags = data['tags'] if "tags" in data else []
+        self.memory_limit = data['memory_limit'] if "memory_limit" in data else None
+        self.peak_memory = data['peak_memory'] if "peak_memory" in data else None
+        self.oom_requeues = data['oom_requeues'] if "oom_requeues" in data else 0
+        self.retries = data['retries'] if "retries" in data else 0
+        self.checkpoint_retention = data['checkpoint_retention'] if "checkpoint_retention" in data else None
+        self.checkpoint_sequence = data['checkpoint_sequence'] if "checkpoint_sequence" in data else 0
+        self.archived = data['archived'] if "archived" in data else False
+        self.disk_usage = data['disk_usage'] if "disk_usage" in data else None
+        self.saved_bytes = data['saved_bytes'] if "saved_bytes" in data else None
+        self._create_metadata_journal()
 
     def set_total_iterations(self, total_iterations):
         if self.state == State.RUNNING:
-            self.device.send(PipeMsg.TOTAL_ITERATIONS, total_iterations)
+            self.device.send(PipeMsg.TOTAL_ITERATIONS, total_iterations, str(self.uuid))
         elif total_iterations > self.finished_iterations:
             self.total_iterations = total_iterations
             self.save_metadata(["total_iterations"])
 
     def set_config(self, config):
         if self.state == State.RUNNING:
-            self.device.send(PipeMsg.CONFIG_CHANGED, config)
+            self.device.send(PipeMsg.CONFIG_CHANGED, config, str(self.uuid))
         else:
             self.config = config
             self.save_metadata(["config"])
 
     def remove_data(self):
+        self.release_checkpoints()
+        if self.archived:
+            self.task_archive.remove_extracted()
         save_dir = self.build_save_dir()
+        self.project.task_catalog.remove(save_dir)
         try:
             shutil.rmtree(save_dir)
         except OSError:
@@ -343,14 +854,13 @@ class TaskWrapper:
     def move_data(self, new_path):
         save_dir = self.build_save_dir()
         assert save_dir != new_path
-        shutil.copytree(save_dir, new_path)
-        shutil.rmtree(save_dir)
+        self.project.file_cloner.move_tree(save_dir, new_path)
         self.tasks_dir = new_path.parent
-        self._create_metadata_lock()
+        self._create_metadata_journal()
 
     def receive_updates(self):
         config_changed = False
-        msg_type, arg = self.device.recv()
+        msg_type, arg = self.device.recv(str(self.uuid))
         while msg_type is not None:
             if msg_type == PipeMsg.PAUSING:
                 self.pausing = arg
@@ -367,19 +877,29 @@ class TaskWrapper:
             elif msg_type == PipeMsg.SAVED_FINISHED_ITERATIONS:
                 self.saved_finished_iterations = arg["saved_finished_iterations"]
                 self.saved_time = datetime.datetime.fromtimestamp(arg["saved_time"])
+                self.saved_bytes = arg["saved_bytes"]
+                self.disk_usage = arg["disk_usage"]
             elif msg_type == PipeMsg.NEW_CHECKPOINT:
                 self.checkpoints.append(arg)
+                self.checkpoint_sequence = max(self.checkpoint_sequence, arg["sequence"] + 1)
+                self.project.prune_checkpoints(self)
             elif msg_type == PipeMsg.TOTAL_ITERATIONS:
                 self.total_iterations = arg
                 self.save_metadata(["total_iterations"])
             elif msg_type == PipeMsg.CONFIG_CHANGED:
-                self.config = arg
+                self.config = self.project.configuration.intern_task_config(arg)
                 self.save_metadata(["config"])
                 config_changed = True
             elif msg_type == PipeMsg.CREATE_CHECKPOINT:
                 self.creating_checkpoint = arg
+            elif msg_type == PipeMsg.ERROR_INFO:
+                self.last_error = arg
+            elif msg_type == PipeMsg.MEMORY_USAGE:
+                self.peak_memory = max(arg["peak_memory"], self.peak_memory or 0)
+                self.memory_exceeded = arg["exceeded"]
+                self.save_metadata(["peak_memory"])
 
-            msg_type, arg = self.device.recv()
+            msg_type, arg = self.device.recv(str(self.uuid))
 
         if config_changed:
             self.project.refresh_views()
@@ -388,11 +908,15 @@ class TaskWrapper:
 
     def save_now(self):
         if self.state == State.RUNNING:
-            self.device.send(PipeMsg.SAVING, True)
+            self.device.send(PipeMsg.SAVING, True, str(self.uuid))
 
     def create_checkpoint_now(self):
         if self.state == State.RUNNING:
-            self.device.send(PipeMsg.CREATE_CHECKPOINT, True)
+            self.device.send(PipeMsg.CREATE_CHECKPOINT, True, str(self.uuid))
+
+    def set_memory_limit(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.save_metadata(["memory_limit", "oom_requeues"])
 
     def set_notes(self, notes):
         self.notes = notes
@@ -404,15 +928,31 @@ class TaskWrapper:
 
     def create_checkpoint(self):
         if self.state != State.RUNNING:
-            checkpoint = TaskWrapper._create_checkpoint(self.metadata_lock, self.build_save_dir(), self.finished_iterations)
+            self.unarchive()
+            metrics = {tag: metric[2] for tag, metric in self.metrics.items() if metric[2] != "nan"}
+            checkpoint = TaskWrapper._create_checkpoint(self.metadata_journal, self.project.checkpoint_store, self.build_save_dir(), self.finished_iterations, self.checkpoint_sequence, metrics)
+            self.checkpoint_sequence += 1
             self.checkpoints.append(checkpoint)
+            self.project.prune_checkpoints(self)
 
-    def reload(self):
+    def read_saved_metadata(self):
         path = self.build_save_dir()
         if not path.exists():
-            return False
+            return None
+
+        if self.is_test:
+            return MetadataJournal(path).load()
+
+        data = self.project.task_catalog.load(path)
+        return None if data is None else data[0]
+
+    def reload(self, data=None):
+        if data is None:
+            data = self.read_saved_metadata()
+            if data is None:
+                return False
 
-        self.load_metadata(path)
+        self.load_metadata(self.build_save_dir(), data=data, hydrate=self.details is not None)
         return True
 
     def get_param_value_to_param(self, param, project_config, time_step="0"):
@@ -445,30 +985,7 @@ class TaskWrapper:
         return key
 
     def update_metrics(self, metric_superset=None):
-        return
-        current_time = time.time()
-        metrics_changed = False
-
-        for path in self.build_save_dir().glob("events.out.tfevents.*"):
-            if path.stat().st_mtime >= self.last_metrics_update:
-                for e in tf.compat.v1.train.summary_iterator(str(path)):
-                    for v in e.summary.value:
-                        if v.tag not in self.metrics or self.metrics[v.tag][0] < e.step or (self.metrics[v.tag][0] == e.step and self.metrics[v.tag][1] < e.wall_time):
-                            if v.tensor.dtype == 0:
-                                v.tensor.dtype = 1
-                            value = float(tf.make_ndarray(v.tensor))
-                            if math.isnan(value):
-                                value = "nan"
-                            self.metrics[v.tag] = (e.step, e.wall_time, value)
-                            metrics_changed = True
-
-        if metric_superset is not None:
-            for tag in self.metrics.keys():
-               metric_superset.add(tag)
-        self.last_metrics_update = current_time
-
-        if metrics_changed:
-            self.save_metric_cache()
+        pass
 
     def col_from_task(self, col_name, task_name):
         if col_name == "saved":
@@ -484,6 +1001,8 @@ class TaskWrapper:
             return self.metrics[col_name][2]
         elif col_name == "uuid":
             return str(self.uuid)
+        elif col_name == "disk_usage":
+            return self.total_disk_usage() or 0
         else:
             return 0
 
@@ -375,6 +375,23 @@ class View:
             node = node.parent
         return path
 
+    def relink_task(self, task):
+        if not self.enabled or self.root_path is None or str(task.uuid) not in self.task_by_uuid:
+            return
+
+        path, node = self.root_path, self.root_node.children["default"]
+        for key in self.path_of_task(task):
+            # A collapsed node only links its primary task
+            if type(node) == CollapseNode:
+                node = node.primary_child()
+                break
+            path, node = path / key, node.children[key]
+
+        if node is task:
+            if path.is_symlink():
+                path.unlink()
+            path.symlink_to(task.build_save_dir(), True)
+
     def enable(self, tasks):
         self.enabled = True
         self.refresh(tasks)
@@ -56,13 +56,13 @@ def run(refresh_interval, taskplan_config):
     @app.route('/start/<int:total_iterations>', methods=['POST'])
     def start(total_iterations):
         data = json.loads(request.form.get('data'))
-        controller.start_new_task(data["params"], data["config"], total_iterations, device_uuid=data["device"], tags=data["tags"])
+        controller.start_new_task(data["params"], data["config"], total_iterations, device_uuid=data["device"], tags=data["tags"], memory_limit=data.get("memory_limit"))
         return jsonify({})
 
     @app.route('/test/<int:total_iterations>', methods=['POST'])
     def test(total_iterations):
         data = json.loads(request.form.get('data'))
-        controller.start_new_task(data["params"], data["config"], total_iterations, is_test=True, device_uuid=data["device"], tags=data["tags"])
+        controller.start_new_task(data["params"], data["config"], total_iterations, is_test=True, device_uuid=data["device"], tags=data["tags"], memory_limit=data.get("memory_limit"))
         return jsonify({})
 
     @app.route('/edit_task/<string:task_uuid>/<int:total_iterations>', methods=['POST'])
@@ -81,6 +81,21 @@ def run(refresh_interval, taskplan_config):
         controller.pause_all_tasks()
         return jsonify({})
 
+    @app.route('/preempt/<string:task_uuid>')
+    def preempt(task_uuid):
+        controller.preempt_task(task_uuid)
+        return jsonify({})
+
+    @app.route('/archive/<string:task_uuid>')
+    def archive(task_uuid):
+        controller.archive_task(task_uuid)
+        return jsonify({})
+
+    @app.route('/unarchive/<string:task_uuid>')
+    def unarchive(task_uuid):
+        controller.unarchive_task(task_uuid)
+        return jsonify({})
+
     @app.route('/terminate/<string:task_uuid>')
     def terminate(task_uuid):
         controller.terminate_task(task_uuid)
@@ -203,8 +218,7 @@ def run(refresh_interval, taskplan_config):
     @app.route('/read_log/<string:task_uuid>')
     def read_log(task_uuid=""):
         if task_uuid is not "":
-            path = controller.get_task_dir(task_uuid)
-            log_path = str(path / "main.log")
+            log_path = str(controller.get_task_file(task_uuid, "main.log"))
         else:
             log_path = str(Path('.') / "global.log")
 
@@ -288,6 +302,27 @@ def run(refresh_interval, taskplan_config):
 
         return jsonify({})
 
+    @app.route('/set_memory_limit/<string:task_uuid>', methods=['POST'])
+    def set_memory_limit(task_uuid):
+        memory_limit = json.loads(request.form.get('data'))["memory_limit"]
+        controller.set_memory_limit(task_uuid, memory_limit)
+
+        return jsonify({})
+
+    @app.route('/set_checkpoint_retention/<string:task_uuid>', methods=['POST'])
+    def set_checkpoint_retention(task_uuid):
+        checkpoint_retention = json.loads(request.form.get('data'))["checkpoint_retention"]
+        controller.set_checkpoint_retention(task_uuid, checkpoint_retention)
+
+        return jsonify({})
+
+    @app.route('/set_checkpoint_tags/<string:task_uuid>/<int:checkpoint_id>', methods=['POST'])
+    def set_checkpoint_tags(task_uuid, checkpoint_id):
+        tags = json.loads(request.form.get('data'))["tags"]
+        controller.set_checkpoint_tags(task_uuid, checkpoint_id, tags)
+
+        return jsonify({})
+
     @app.route('/set_task_notes/<string:task_uuid>', methods=['POST'])
     def set_task_notes(task_uuid):
         new_notes = json.loads(request.form.get('data'))["notes"]
@@ -374,6 +409,15 @@ def run(refresh_interval, taskplan_config):
         controller.set_tags(task_uuid, data["tags"])
         return jsonify({})
 
+    @app.route('/migrate_task_layout/<int:sharded>')
+    def migrate_task_layout(sharded):
+        controller.migrate_task_layout(sharded == 1)
+        return jsonify({})
+
+    @app.route('/disk_usage')
+    def disk_usage():
+        return jsonify(controller.disk_usage_summary())
+
     @app.route('/fetch_metrics/<string:task_uuid>')
     def fetch_metrics(task_uuid):
         metrics = controller.fetch_metrics(task_uuid)
@@ -0,0 +1,54 @@
+import unittest
+
+from taskplan.CheckpointRetention import CheckpointRetention
+
+
+class TestCheckpointRetention(unittest.TestCase):
+
+    @staticmethod
+    def _checkpoint(sequence, metrics={}, tags=[]):
+        return {"finished_iterations": (sequence + 1) * 100, "sequence": sequence, "metrics": metrics, "tags": tags}
+
+    def _create_and_prune(self, retention, number):
+        checkpoints = []
+        for sequence in range(number):
+            checkpoints.append(self._checkpoint(sequence))
+            pruned = retention.checkpoints_to_prune(checkpoints)
+            checkpoints = [checkpoint for checkpoint in checkpoints if checkpoint not in pruned]
+        return checkpoints
+
+    def test_keep_every_is_stable_across_runs(self):
+        checkpoints = self._create_and_prune(CheckpointRetention(keep_last=1, keep_every=2), 10)
+        self.assertEqual([checkpoint["sequence"] for checkpoint in checkpoints], [1, 3, 5, 7, 9])
+
+    def test_keep_last(self):
+        checkpoints = self._create_and_prune(CheckpointRetention(keep_last=3), 10)
+        self.assertEqual([checkpoint["sequence"] for checkpoint in checkpoints], [7, 8, 9])
+
+    def test_keep_best(self):
+        retention = CheckpointRetention(keep_last=1, keep_best=2, metric="acc")
+        checkpoints = [self._checkpoint(i, {"acc": acc}) for i, acc in enumerate([0.5, 0.9, 0.7, 0.8, 0.1])]
+        pruned = retention.checkpoints_to_prune(checkpoints)
+        self.assertEqual([checkpoint["sequence"] for checkpoint in pruned], [0, 2])
+
+    def test_keep_tagged(self):
+        checkpoints = [self._checkpoint(0, tags=["important"]), self._checkpoint(1), self._checkpoint(2)]
+        pruned = CheckpointRetention(keep_last=1).checkpoints_to_prune(checkpoints)
+        self.assertEqual([checkpoint["sequence"] for checkpoint in pruned], [1])
+
+    def test_checkpoints_without_sequence_are_kept_by_keep_every(self):
+        checkpoints = [{"finished_iterations": 100}, self._checkpoint(1), self._checkpoint(2)]
+        pruned = CheckpointRetention(keep_last=1, keep_every=2).checkpoints_to_prune(checkpoints)
+        self.assertEqual(pruned, [])
+
+    def test_has_metric(self):
+        retention = CheckpointRetention(keep_best=1, metric="acc")
+        self.assertFalse(retention.has_metric([self._checkpoint(0)]))
+        self.assertTrue(retention.has_metric([self._checkpoint(0, {"acc": 1.0})]))
+
+    def test_inactive_policy_prunes_nothing(self):
+        self.assertEqual(CheckpointRetention().checkpoints_to_prune([self._checkpoint(0)]), [])
+
+    def test_keep_best_requires_metric(self):
+        with self.assertRaises(ValueError):
+            CheckpointRetention(keep_best=1)
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.CheckpointStore import CheckpointStore
+
+
+class TestCheckpointStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.task_dir = self.tmp_dir / "task"
+        self.task_dir.mkdir()
+        self.store = CheckpointStore(self.tmp_dir / "store", chunk_size=4)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _write(self, relative_path, content, task_dir=None):
+        path = (task_dir or self.task_dir) / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(path), "wb") as handle:
+            handle.write(content)
+
+    def _read_materialized(self, manifest_id, name):
+        target_dir = self.tmp_dir / ("materialized_" + manifest_id)
+        self.store.materialize(manifest_id, target_dir)
+        with open(str(target_dir / name), "rb") as handle:
+            return handle.read()
+
+    def test_store_and_materialize(self):
+        self._write("model.pk", b"0123456789")
+        self._write("sub/weights", b"abc")
+        manifest_id, stored_bytes = self.store.store(self.task_dir)
+
+        self.assertEqual(stored_bytes, 13)
+        self.assertEqual(self._read_materialized(manifest_id, "model.pk"), b"0123456789")
+        self.assertEqual(self._read_materialized(manifest_id, "sub/weights"), b"abc")
+
+    def test_unchanged_chunks_are_shared(self):
+        self._write("model.pk", b"01234567")
+        self.store.store(self.task_dir)
+        self._write("model.pk", b"0123xxxx")
+        manifest_id, stored_bytes = self.store.store(self.task_dir)
+
+        self.assertEqual(stored_bytes, 4)
+        self.assertEqual(self._read_materialized(manifest_id, "model.pk"), b"0123xxxx")
+
+    def test_store_with_sizes_stores_file_prefixes(self):
+        self._write("main.log", b"line 1\n")
+        self._write("model.pk", b"new")
+        sizes = {"main.log": 7, "model.pk": None, "removed": 5}
+        self._write("main.log", b"line 1\nline 2\n")
+
+        manifest_id, _ = self.store.store(self.task_dir, sizes=sizes)
+        self.assertEqual(self._read_materialized(manifest_id, "main.log"), b"line 1\n")
+        self.assertEqual(self._read_materialized(manifest_id, "model.pk"), b"new")
+        self.assertEqual(set(self.store.load_manifest(manifest_id)["files"].keys()), {"main.log", "model.pk"})
+
+    def _objects(self):
+        return set(path.parent.name + path.name for path in (self.tmp_dir / "store" / "objects").glob("*/*"))
+
+    def _chunks(self, manifest_id):
+        return set(chunk_hash for file in self.store.load_manifest(manifest_id)["files"].values() for chunk_hash in file["chunks"])
+
+    def test_release_collects_only_unreferenced_chunks(self):
+        self._write("model.pk", b"01234567")
+        first_id, _ = self.store.store(self.task_dir)
+        self._write("model.pk", b"0123xxxx")
+        second_id, _ = self.store.store(self.task_dir)
+
+        self.assertTrue(self.store.release(first_id))
+        self.store.collect_garbage()
+        self.assertEqual(self._objects(), self._chunks(second_id))
+        self.assertEqual(self._read_materialized(second_id, "model.pk"), b"0123xxxx")
+
+        self.assertTrue(self.store.release(second_id))
+        self.store.collect_garbage()
+        self.assertEqual(self._objects(), set())
+
+    def test_retained_manifest_survives_release(self):
+        self._write("model.pk", b"01234567")
+        manifest_id, _ = self.store.store(self.task_dir)
+        self.store.retain(manifest_id)
+
+        self.assertFalse(self.store.release(manifest_id))
+        self.store.collect_garbage()
+        self.assertEqual(self._read_materialized(manifest_id, "model.pk"), b"01234567")
+
+        self.assertTrue(self.store.release(manifest_id))
+        self.assertFalse(self.store.release(manifest_id))
+
+    def test_orphaned_chunks_are_collected(self):
+        self._write("model.pk", b"01234567")
+        manifest_id, _ = self.store.store(self.task_dir)
+        self.store._write_object("0" * 64, b"orphan")
+
+        self.assertEqual(self.store.collect_garbage(), 6)
+        self.assertEqual(self._objects(), self._chunks(manifest_id))
@@ -0,0 +1,105 @@
+import json
+import shutil
+import tempfile
+import unittest
+import weakref
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.ConfigStore import ConfigStore
+from taskplan.ProjectConfiguration import ProjectConfiguration
+
+
+class FakeConfig:
+
+    def __init__(self, data):
+        self.data = data
+        self.dynamic = False
+
+    def get_merged_config(self):
+        return dict(self.data["config"], merged=True)
+
+    def set_data(self, data):
+        self.data = data
+
+
+class FakeConfigurationManager:
+
+    def __init__(self):
+        self.added_configs = []
+
+    def add_config(self, data, path):
+        config = FakeConfig(data)
+        self.added_configs.append(config)
+        return config
+
+    def save(self):
+        pass
+
+
+class TestConfigStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.store = ConfigStore(self.tmp_dir / ConfigStore.DEFAULT_DIR)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_equal_configs_are_stored_once(self):
+        first_hash = self.store.store({"lr": 0.1, "model": {"layers": 2}})
+        second_hash = self.store.store({"model": {"layers": 2}, "lr": 0.1})
+
+        self.assertEqual(first_hash, second_hash)
+        self.assertNotEqual(first_hash, self.store.store({"lr": 0.2, "model": {"layers": 2}}))
+        self.assertEqual(len(list(self.store.store_dir.glob("*/*.json"))), 2)
+        self.assertEqual(self.store.load(first_hash), {"lr": 0.1, "model": {"layers": 2}})
+
+    def test_locate_searches_parents_of_the_task_dir(self):
+        config_hash = self.store.store({"lr": 0.1})
+        task_dir = self.tmp_dir / "tasks" / "ab" / "task"
+        task_dir.mkdir(parents=True)
+
+        self.assertEqual(ConfigStore.locate(task_dir, config_hash), ConfigStore._path(self.store.store_dir.resolve(), config_hash))
+        with self.assertRaises(LookupError):
+            ConfigStore.locate(task_dir, "0" * 64)
+
+    def test_locate_uses_the_store_dir_of_the_project(self):
+        store = ConfigStore(self.tmp_dir / "configs")
+        config_hash = store.store({"lr": 0.1})
+        with open(str(self.tmp_dir / "taskplan.json"), "w") as handle:
+            json.dump({"config_store_dir": "configs"}, handle)
+        task_dir = self.tmp_dir / "tasks" / "task"
+        task_dir.mkdir(parents=True)
+
+        self.assertEqual(ConfigStore.locate(task_dir, config_hash), ConfigStore._path(store.store_dir.resolve(), config_hash))
+
+
+class TestTaskConfigInterning(unittest.TestCase):
+
+    def setUp(self):
+        self.project_configuration = object.__new__(ProjectConfiguration)
+        self.project_configuration.configuration = FakeConfigurationManager()
+        self.project_configuration.task_configs = weakref.WeakValueDictionary()
+        self.project_configuration.built_task_configs = weakref.WeakValueDictionary()
+        self.project_configuration.revision = 0
+
+    def test_equal_task_configs_are_built_once(self):
+        first_config = self.project_configuration.add_task({"0": []}, {"lr": 0.1})
+        second_config = self.project_configuration.add_task({"0": []}, {"lr": 0.1})
+
+        self.assertIs(first_config, second_config)
+        self.assertEqual(len(self.project_configuration.configuration.added_configs), 1)
+        self.assertEqual(first_config.data["config"], {"lr": 0.1, "merged": True})
+
+    def test_task_configs_are_rebuilt_after_the_configuration_changed(self):
+        first_config = self.project_configuration.add_task({"0": []}, {"lr": 0.1})
+        self.project_configuration._save_configuration()
+        second_config = self.project_configuration.add_task({"0": []}, {"lr": 0.1})
+
+        self.assertEqual(len(self.project_configuration.configuration.added_configs), 2)
+        # The rebuilt config has the same data, so the interned one is kept
+        self.assertIs(first_config, second_config)
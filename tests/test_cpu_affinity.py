@@ -0,0 +1,22 @@
+import unittest
+from unittest import mock
+
+from taskplan.CpuAffinity import CpuAffinity
+
+
+class TestCpuAffinity(unittest.TestCase):
+
+    def _slots(self, number_of_slots, policy, cpus, nodes=None):
+        with mock.patch.object(CpuAffinity, "available_cpus", return_value=cpus), mock.patch.object(CpuAffinity, "numa_nodes", return_value=nodes or [cpus]):
+            return [CpuAffinity.cpus_for_slot(slot, number_of_slots, policy) for slot in range(number_of_slots)]
+
+    def test_packed_and_spread_are_disjoint(self):
+        self.assertEqual(self._slots(3, "packed", list(range(8))), [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual(self._slots(3, "spread", list(range(8))), [[0, 3, 6], [1, 4, 7], [2, 5]])
+
+    def test_numa_splits_each_node_between_its_slots(self):
+        slots = self._slots(4, "numa", list(range(8)), [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(slots, [[0, 1], [4, 5], [2, 3], [6, 7]])
+
+    def test_none_policy(self):
+        self.assertEqual(self._slots(2, "none", list(range(8))), [None, None])
@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.ScratchFlusher import ScratchFlusher
+from taskplan.TaskWrapper import TaskWrapper
+
+
+class TestDiskUsage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.task_dir = self.tmp_dir / "task"
+        self.task_dir.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _write(self, path, size):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(path), "wb") as handle:
+            handle.write(b"x" * size)
+
+    def _staged_save(self, files, copy):
+        staging_dir = self.tmp_dir / "staging"
+        for name, size in files.items():
+            self._write(staging_dir / name, size)
+        return ScratchFlusher.move_files(staging_dir, self.task_dir, copy=copy)
+
+    def test_move_files_returns_written_bytes(self):
+        for copy in [True, False]:
+            self.assertEqual(self._staged_save({"model.pk": 100, "weights/layer": 50}, copy), 150)
+            self.assertEqual(self._staged_save({"model.pk": 80}, copy), -20)
+            self.assertEqual(self._staged_save({"other": 10}, copy), 10)
+            self.assertEqual(TaskWrapper._saved_size(self.task_dir), 140)
+            shutil.rmtree(str(self.task_dir))
+            self.task_dir.mkdir()
+
+    def test_disk_usage_stats_only_unsaved_files(self):
+        self._write(self.task_dir / "model.pk", 100)
+        self._write(self.task_dir / "weights" / "layer", 50)
+        self._write(self.task_dir / "main.log", 7)
+        self._write(self.task_dir / "events.out.tfevents.1.host", 3)
+        self._write(self.task_dir / "checkpoints" / "10" / "model.pk", 100)
+
+        self.assertEqual(TaskWrapper._saved_size(self.task_dir), 150)
+        self.assertEqual(TaskWrapper._disk_usage(self.task_dir, 150), 160)
+        self.assertEqual(TaskWrapper._disk_usage(self.task_dir, 0), 10)
@@ -0,0 +1,48 @@
+import shutil
+import struct
+import tempfile
+import unittest
+
+from taskplan.EventWriter import EventWriter, crc32c, masked_crc32c
+
+
+class TestEventWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_records(self, path):
+        records = []
+        with open(str(path), "rb") as handle:
+            data = handle.read()
+
+        offset = 0
+        while offset < len(data):
+            header = data[offset:offset + 8]
+            length = struct.unpack("<Q", header)[0]
+            self.assertEqual(struct.unpack("<I", data[offset + 8:offset + 12])[0], masked_crc32c(header))
+            record = data[offset + 12:offset + 12 + length]
+            self.assertEqual(struct.unpack("<I", data[offset + 12 + length:offset + 16 + length])[0], masked_crc32c(record))
+            records.append(record)
+            offset += 16 + length
+        return records
+
+    def test_crc32c(self):
+        self.assertEqual(crc32c(b"123456789"), 0xE3069283)
+
+    def test_scalars_are_written_as_records(self):
+        writer = EventWriter(self.tmp_dir)
+        writer.add_scalar("loss", 0.5, 1)
+        writer.add_scalar_dict({"train/acc": 0.8, "val/acc": 0.7}, 2)
+        writer.close()
+
+        records = self._read_records(writer.path)
+        self.assertEqual(len(records), 3)
+        self.assertIn(b"brain.Event:2", records[0])
+        self.assertIn(b"loss", records[1])
+        self.assertIn(struct.pack("<f", 0.5), records[1])
+        self.assertIn(b"train/acc", records[2])
+        self.assertIn(b"val/acc", records[2])
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.FileCloner import FileCloner
+
+
+class TestFileCloner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.src_dir = self.tmp_dir / "src"
+        (self.src_dir / "sub").mkdir(parents=True)
+        (self.src_dir / "checkpoints").mkdir()
+        self._write(self.src_dir / "model.pk", b"0123456789" * 10)
+        self._write(self.src_dir / "sub" / "events", b"events")
+        self._write(self.src_dir / "checkpoints" / "model.pk", b"old")
+        os.symlink("model.pk", str(self.src_dir / "link"))
+        self.cloner = FileCloner(chunk_size=16)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _write(self, path, content):
+        with open(str(path), "wb") as handle:
+            handle.write(content)
+
+    def _read(self, path):
+        with open(str(path), "rb") as handle:
+            return handle.read()
+
+    def test_clone_tree(self):
+        dst_dir = self.tmp_dir / "dst"
+        self.cloner.clone_tree(self.src_dir, dst_dir, immutable=lambda path: path == "sub/events", ignore=["checkpoints"])
+
+        self.assertEqual(self._read(dst_dir / "model.pk"), b"0123456789" * 10)
+        self.assertEqual(self._read(dst_dir / "sub" / "events"), b"events")
+        self.assertFalse((dst_dir / "checkpoints").exists())
+        self.assertEqual(os.readlink(str(dst_dir / "link")), "model.pk")
+
+        # Immutable files are hard linked, all others are independent copies
+        self.assertTrue(os.path.samefile(str(self.src_dir / "sub" / "events"), str(dst_dir / "sub" / "events")))
+        self._write(self.src_dir / "model.pk", b"changed")
+        self.assertEqual(self._read(dst_dir / "model.pk"), b"0123456789" * 10)
+
+    def test_clone_file_prefix(self):
+        dst = self.tmp_dir / "prefix"
+        self.cloner.clone_file_prefix(self.src_dir / "model.pk", dst, 25)
+        self.assertEqual(self._read(dst), (b"0123456789" * 10)[:25])
+
+    def test_move_tree(self):
+        dst_dir = self.tmp_dir / "moved" / "task"
+        self.cloner.move_tree(self.src_dir, dst_dir)
+        self.assertFalse(self.src_dir.exists())
+        self.assertEqual(self._read(dst_dir / "sub" / "events"), b"events")
@@ -0,0 +1,56 @@
+import logging
+import unittest
+
+from taskplan.LogWriter import LogWriter
+
+
+class FakeLogger:
+
+    def __init__(self):
+        self.lines = []
+
+    def log(self, message, level=logging.INFO):
+        self.lines.append((message, level))
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def _write_lines(self, log_writer, number_of_lines):
+        for i in range(number_of_lines):
+            log_writer.write(str(i) + "\n")
+        log_writer.close()
+
+    def test_lines_are_written_in_order(self):
+        logger = FakeLogger()
+        self._write_lines(LogWriter(logger, flush_interval=0.01), 50)
+        self.assertEqual([line for line, level in logger.lines], [str(i) + "\n" for i in range(50)])
+
+    def test_drop_policy_keeps_warnings_and_reports_skipped_lines(self):
+        logger = FakeLogger()
+        log_writer = LogWriter(logger, flush_interval=60, max_lines_per_interval=5)
+        log_writer.write("warning\n", logging.WARNING)
+        self._write_lines(log_writer, 10)
+
+        messages = [line for line, level in logger.lines]
+        self.assertEqual(messages[:5], ["warning\n", "0\n", "1\n", "2\n", "3\n"])
+        self.assertIn("Skipped 6 log lines", messages[-1])
+
+    def test_sample_policy_keeps_every_nth_line(self):
+        logger = FakeLogger()
+        log_writer = LogWriter(logger, flush_interval=60, max_lines_per_interval=2, overflow_policy="sample", sample_every=3)
+        self._write_lines(log_writer, 10)
+
+        self.assertEqual([line for line, level in logger.lines][:-1], ["0\n", "1\n", "4\n", "7\n"])
+
+    def test_lines_go_to_the_loggers_selected_when_written(self):
+        first, second = FakeLogger(), FakeLogger()
+        log_writer = LogWriter(first, flush_interval=60)
+        log_writer.write("a\n")
+        log_writer.select([second])
+        log_writer.write("b\n")
+        log_writer.select([first, second])
+        log_writer.write("c\n")
+        log_writer.close()
+
+        self.assertEqual([line for line, level in first.lines], ["a\n", "c\n"])
+        self.assertEqual([line for line, level in second.lines], ["b\n", "c\n"])
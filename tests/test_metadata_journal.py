@@ -0,0 +1,85 @@
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.MetadataJournal import MetadataJournal
+
+
+class TestMetadataJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.task_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.task_dir))
+
+    def test_replays_updates(self):
+        journal = MetadataJournal(self.task_dir)
+        journal.update({"uuid": "task", "finished_iterations": 0})
+        journal.update({"finished_iterations": 10}, {"checkpoints": {"finished_iterations": 10}})
+        journal.update(appends={"checkpoints": {"finished_iterations": 20}})
+        journal.update(removes={"checkpoints": [{"finished_iterations": 10}]})
+
+        self.assertEqual(MetadataJournal(self.task_dir).load(), {"uuid": "task", "finished_iterations": 10, "checkpoints": [{"finished_iterations": 20}]})
+
+    def test_replace_in_single_record(self):
+        journal = MetadataJournal(self.task_dir)
+        checkpoint = {"finished_iterations": 10, "tags": []}
+        journal.update(appends={"checkpoints": checkpoint})
+        journal.update(appends={"checkpoints": checkpoint}, removes={"checkpoints": [checkpoint]})
+
+        self.assertEqual(journal.load()["checkpoints"], [checkpoint])
+
+    def test_compaction(self):
+        journal = MetadataJournal(self.task_dir, min_compaction_size=256)
+        for i in range(50):
+            journal.update({"finished_iterations": i}, {"checkpoints": {"finished_iterations": i}})
+
+        self.assertTrue(journal.snapshot_path.exists())
+        self.assertLess(journal.journal_path.stat().st_size if journal.journal_path.exists() else 0, 2 * journal.snapshot_path.stat().st_size)
+        data = MetadataJournal(self.task_dir).load()
+        self.assertEqual(data["finished_iterations"], 49)
+        self.assertEqual(len(data["checkpoints"]), 50)
+
+    def test_replay_after_interrupted_compaction_does_not_duplicate(self):
+        journal = MetadataJournal(self.task_dir)
+        journal.update({"uuid": "task"}, {"checkpoints": {"finished_iterations": 10}})
+        data = journal.load()
+        with open(str(journal.snapshot_path), "w") as handle:
+            json.dump(data, handle)
+
+        self.assertEqual(MetadataJournal(self.task_dir).load()["checkpoints"], [{"finished_iterations": 10}])
+
+    def test_ignores_torn_last_record(self):
+        journal = MetadataJournal(self.task_dir)
+        journal.update({"finished_iterations": 10})
+        with open(str(journal.journal_path), "a") as handle:
+            handle.write('{"set": {"finished_iter')
+        journal.update({"had_error": True})
+
+        self.assertEqual(MetadataJournal(self.task_dir).load(), {"finished_iterations": 10, "had_error": True})
+
+    def test_skipped_fsyncs_are_deferred(self):
+        journal = MetadataJournal(self.task_dir, fsync_interval=0.2)
+        journal.update({"finished_iterations": 1})
+        journal.update({"finished_iterations": 2})
+        self.assertIn(str(journal.journal_path), MetadataJournal.pending_syncs)
+
+        deadline = time.time() + 5
+        while str(journal.journal_path) in MetadataJournal.pending_syncs and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertNotIn(str(journal.journal_path), MetadataJournal.pending_syncs)
+
+    def test_sync_all_flushes_pending_journals(self):
+        journal = MetadataJournal(self.task_dir, fsync_interval=60)
+        journal.update({"finished_iterations": 1})
+        journal.update({"finished_iterations": 2})
+        MetadataJournal.sync_all()
+        self.assertNotIn(str(journal.journal_path), MetadataJournal.pending_syncs)
@@ -0,0 +1,129 @@
+import unittest
+
+from taskplan.Device import Device
+from taskplan.Task import Task
+from taskplan.TaskWrapper import PipeMsg, State, TaskWrapper
+
+
+class FakePipe:
+
+    def __init__(self):
+        self.messages = []
+
+    def poll(self, timeout):
+        return False
+
+    def send(self, msg_type, arg):
+        self.messages.append((msg_type, arg))
+
+
+class FakeConfig:
+
+    def __init__(self):
+        self.iteration_cursor = 0
+
+    def get_int(self, key):
+        return 0
+
+
+class FakeLogger:
+
+    def log(self, message, level=None):
+        pass
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.closed = False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class PrintingTask(Task):
+
+    def __init__(self, name, selections, logs, fail_at=None):
+        super().__init__(FakeConfig(), FakeLogger(), {"finished_iterations": 0, "total_iterations": 3, "pipe": FakePipe(), "task_dir": "."})
+        self.name = name
+        self.selections = selections
+        self.logs = logs
+        self.fail_at = fail_at
+
+    def _create_tensorboard_writer(self, task_dir):
+        self.writer = FakeWriter()
+        return self.writer
+
+    def step(self, tensorboard_writer, current_iteration):
+        if current_iteration == self.fail_at:
+            raise ValueError(self.name)
+        # Output is written into the logs of the tasks that are selected at that moment
+        for task_id in self.selections[-1]:
+            self.logs[task_id].append(self.name + " " + str(current_iteration))
+
+
+class KillableDevice(Device):
+
+    def __init__(self):
+        super().__init__()
+        self.kills = 0
+
+    def terminate(self):
+        self.kills += 1
+
+
+class TestPackedTasks(unittest.TestCase):
+
+    def _run(self, fail_at):
+        selections, logs, finished, failed = [], {0: [], 1: [], 2: []}, [], []
+        tasks = [PrintingTask(str(i), selections, logs, fail_at[i]) for i in range(3)]
+        PrintingTask.run_packed(tasks, [lambda finished_iterations: None] * 3, [lambda finished_iterations: None] * 3,
+                                [lambda i=i: finished.append(i) for i in range(3)], lambda task_ids: selections.append(list(task_ids)),
+                                [lambda i=i: failed.append(i) for i in range(3)])
+        return tasks, logs, finished, failed
+
+    def test_output_goes_to_the_running_task(self):
+        tasks, logs, finished, failed = self._run([None, None, None])
+
+        self.assertEqual(finished, [0, 1, 2])
+        self.assertEqual(failed, [])
+        for i in range(3):
+            self.assertEqual(logs[i], [str(i) + " " + str(iteration) for iteration in range(3)])
+            self.assertEqual(tasks[i].finished_iterations, 3)
+            self.assertTrue(tasks[i].writer.closed)
+
+    def test_failing_task_does_not_stop_the_pack(self):
+        tasks, logs, finished, failed = self._run([None, 1, None])
+
+        self.assertEqual(failed, [1])
+        self.assertEqual(finished, [0, 2])
+        self.assertEqual([task.finished_iterations for task in tasks], [3, 1, 3])
+        self.assertTrue(all(task.writer.closed for task in tasks))
+        self.assertEqual(logs[1], ["1 0"])
+        self.assertEqual(sum(1 for msg_type, arg in tasks[1].pipe.messages if msg_type == PipeMsg.FINISHED_ITERATIONS), 1)
+
+    def test_terminating_packed_task_requeues_the_other_tasks(self):
+        device = KillableDevice()
+        for i in range(3):
+            task = object.__new__(TaskWrapper)
+            task.state = State.RUNNING
+            task.terminated = False
+            task.requeue_after_stop = False
+            task.device = device
+            device.runnings.append(task)
+
+        device.runnings[0].terminate()
+
+        self.assertEqual(device.kills, 1)
+        self.assertTrue(all(task.terminated for task in device.runnings))
+        self.assertEqual([task.requeue_after_stop for task in device.runnings], [False, True, True])
+
+    def test_memory_is_attributed_to_packed_tasks(self):
+        metadatas = [{"memory_limit": 100}, {"memory_limit": 300}]
+        self.assertEqual([TaskWrapper._memory_share(200, metadata, metadatas) for metadata in metadatas], [50, 150])
+
+        metadatas = [{"memory_limit": 100}, {}]
+        self.assertEqual([TaskWrapper._memory_share(200, metadata, metadatas) for metadata in metadatas], [100, 100])
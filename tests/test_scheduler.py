@@ -0,0 +1,196 @@
+import unittest
+import uuid
+
+from taskplan.Device import Device
+from taskplan.Scheduler import Scheduler
+from taskplan.TaskWrapper import State, TaskWrapper
+
+
+class FakeEventManager:
+
+    def throw(self, *args):
+        pass
+
+    def log(self, *args):
+        pass
+
+
+class FakeDevice(Device):
+
+    def is_connected(self):
+        return True
+
+    def supports_packing(self):
+        return False
+
+
+class FakeTask:
+
+    def __init__(self):
+        self.uuid = uuid.uuid4()
+        self.device = None
+        self.state = State.INIT
+        self.queue_index = 0
+        self.finished_iterations = 5
+        self.saved_finished_iterations = 5
+        self.total_iterations = 10
+        self.memory_limit = 100
+        self.peak_memory = 150
+        self.memory_exceeded = False
+        self.oom_requeues = 0
+        self.had_error = False
+        self.killed = False
+        self.last_error = None
+        self.previous_failure = None
+        self.retries = 0
+        self.retry_after = None
+        self.requeue_after_stop = False
+        self.requeue_index = None
+        self.running = False
+
+    def is_running(self):
+        return self.running
+
+    def preemption_timed_out(self):
+        return False
+
+    def seconds_since_progress(self):
+        return None
+
+    def stop(self):
+        self.state = State.STOPPED
+
+    def was_killed(self):
+        return self.killed
+
+    def save_metadata(self, keys_only=None):
+        pass
+
+    def set_memory_limit(self, memory_limit):
+        self.memory_limit = memory_limit
+
+
+class TestSchedulerRequeue(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(FakeEventManager(), {"local_slots": 0, "retry_backoff": 0}, False, False)
+        self.device = FakeDevice()
+        self.scheduler.devices = [self.device]
+
+        # Keeps the device busy, so requeued tasks are not started right away
+        blocking_task = FakeTask()
+        blocking_task.running = True
+        blocking_task.device = self.device
+        self.device.runnings.append(blocking_task)
+
+    def _stop_running(self, task):
+        task.device = self.device
+        self.device.runnings.append(task)
+        self.scheduler.scheduled_tasks[str(task.uuid)] = task
+        self.scheduler.schedule()
+
+    def _assert_queued_once(self, task):
+        self.assertEqual(self.device.queue.count(task), 1)
+        self.assertFalse(task.requeue_after_stop)
+
+    def test_requeues_stopped_task(self):
+        task = FakeTask()
+        task.requeue_after_stop = True
+        self._stop_running(task)
+        self._assert_queued_once(task)
+
+    def test_preempted_task_with_error_is_queued_once(self):
+        task = FakeTask()
+        task.requeue_after_stop = True
+        task.requeue_index = 1
+        task.had_error = True
+        task.last_error = {"type": "OSError", "signature": "abc", "types": ["OSError", "Exception", "BaseException", "object"]}
+        self._stop_running(task)
+        self._assert_queued_once(task)
+        self.assertEqual(task.retries, 1)
+
+    def test_stalled_task_exceeding_memory_is_queued_once(self):
+        task = FakeTask()
+        task.requeue_after_stop = True
+        task.memory_exceeded = True
+        self._stop_running(task)
+        self._assert_queued_once(task)
+        self.assertEqual(task.oom_requeues, 1)
+
+    def test_deterministic_failure_is_not_requeued_after_preemption(self):
+        task = FakeTask()
+        task.requeue_after_stop = True
+        task.had_error = True
+        task.last_error = {"type": "ValueError", "signature": "abc", "types": ["ValueError", "Exception", "BaseException", "object"]}
+        self._stop_running(task)
+        self.assertNotIn(task, self.device.queue)
+        self.assertFalse(task.requeue_after_stop)
+
+
+    def test_configured_transient_error_is_retried(self):
+        self.scheduler.transient_errors = ["OSError", "ConnectionError", "RuntimeError"]
+        task = FakeTask()
+        task.had_error = True
+        task.last_error = TaskWrapper._classify_error(RuntimeError, RuntimeError("CUDA error: unspecified launch failure"), None)
+        self._stop_running(task)
+        self._assert_queued_once(task)
+        self.assertEqual(task.retries, 1)
+
+    def test_subclass_of_transient_error_is_retried(self):
+        task = FakeTask()
+        task.had_error = True
+        task.last_error = TaskWrapper._classify_error(ConnectionResetError, ConnectionResetError(), None)
+        self._stop_running(task)
+        self._assert_queued_once(task)
+
+
+class FakeLocalSlot(FakeDevice):
+
+    def __init__(self, memory):
+        super().__init__()
+        self.memory = memory
+        self.memory_reads = 0
+
+    def available_memory(self):
+        self.memory_reads += 1
+        return self.memory
+
+    def memory_host(self):
+        return "local"
+
+
+class StartableTask(FakeTask):
+
+    def __init__(self, memory_requirement):
+        super().__init__()
+        self.tasks_dir = "."
+        self.project = None
+        self.requirement = memory_requirement
+
+    def memory_requirement(self):
+        return self.requirement
+
+    def start(self, print_log):
+        self.running = True
+        self.state = State.RUNNING
+
+    def __str__(self):
+        return str(self.uuid)
+
+
+class TestSchedulerMemory(unittest.TestCase):
+
+    def test_slots_reserve_memory_from_one_snapshot(self):
+        scheduler = Scheduler(FakeEventManager(), {"local_slots": 0}, False, False)
+        slots = [FakeLocalSlot(1000), FakeLocalSlot(1000)]
+        scheduler.devices = slots
+        tasks = [StartableTask(600), StartableTask(600)]
+        for slot, task in zip(slots, tasks):
+            task.device = slot
+            slot.queue.append(task)
+
+        scheduler.schedule()
+
+        self.assertEqual([task.running for task in tasks], [True, False])
+        self.assertEqual(slots[1].queue, [tasks[1]])
+        self.assertEqual(slots[0].memory_reads + slots[1].memory_reads, 1)
@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.CheckpointStore import CheckpointStore
+from taskplan.FileCloner import FileCloner
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.ScratchFlusher import ScratchFlusher
+from taskplan.TaskDetails import TaskDetails
+from taskplan.TaskWrapper import TaskWrapper
+
+
+class TestScratchCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.task_dir = self.tmp_dir / "task"
+        self.staging_dir = self.tmp_dir / "staging"
+        self.task_dir.mkdir()
+        self.staging_dir.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _write(self, path, content, mode="wb"):
+        with open(str(path), mode) as handle:
+            handle.write(content)
+
+    def test_checkpoint_contains_state_at_save_time(self):
+        journal = MetadataJournal(self.task_dir)
+        journal.update({"uuid": "task", "finished_iterations": 0})
+        store = CheckpointStore(self.tmp_dir / "store")
+        self._write(self.task_dir / "main.log", b"iteration 1\n")
+        self._write(self.task_dir / "events.out.tfevents.1.host", b"events 1")
+        self._write(self.task_dir / "model.pk", b"old model")
+        self._write(self.staging_dir / "model.pk", b"new model")
+
+        snapshot = TaskWrapper._snapshot_checkpoint(self.task_dir, self.staging_dir)
+
+        # Written after the save, while the flush is still pending
+        self._write(self.task_dir / "main.log", b"iteration 2\n", "ab")
+        self._write(self.task_dir / "events.out.tfevents.1.host", b"events 2", "ab")
+        ScratchFlusher.move_files(self.staging_dir, self.task_dir)
+
+        checkpoint = TaskWrapper._create_checkpoint(journal, store, self.task_dir, 10, 0, snapshot=snapshot)
+        self.assertEqual(checkpoint["event_files"], {"events.out.tfevents.1.host": 8})
+
+        checkpoint_dir = store.materialize(checkpoint["manifest"], self.tmp_dir / "checkpoint")
+        with open(str(checkpoint_dir / "main.log"), "rb") as handle:
+            self.assertEqual(handle.read(), b"iteration 1\n")
+        with open(str(checkpoint_dir / "model.pk"), "rb") as handle:
+            self.assertEqual(handle.read(), b"new model")
+        self.assertFalse((checkpoint_dir / "events.out.tfevents.1.host").exists())
+
+    def test_checkpoint_is_materialized_into_a_new_task(self):
+        journal = MetadataJournal(self.task_dir)
+        journal.update({"uuid": "task", "finished_iterations": 0})
+        store = CheckpointStore(self.tmp_dir / "store")
+        self._write(self.task_dir / "model.pk", b"model")
+        self._write(self.task_dir / "events.out.tfevents.1.host", b"events 1")
+        checkpoint = TaskWrapper._create_checkpoint(journal, store, self.task_dir, 10, 0, snapshot=TaskWrapper._snapshot_checkpoint(self.task_dir, self.staging_dir))
+        self._write(self.task_dir / "events.out.tfevents.1.host", b"events 2", "ab")
+
+        task = object.__new__(TaskWrapper)
+        task.is_test = True
+        task.tasks_dir = self.task_dir
+        task.archived = False
+        task.details = TaskDetails(checkpoints=[checkpoint])
+        task.project = SimpleNamespace(checkpoint_store=store, file_cloner=FileCloner())
+
+        new_task_dir = task.materialize_checkpoint(0, self.tmp_dir / "new_task")
+        with open(str(new_task_dir / "events.out.tfevents.1.host"), "rb") as handle:
+            self.assertEqual(handle.read(), b"events 1")
+        self.assertFalse((self.task_dir / "checkpoints").exists())
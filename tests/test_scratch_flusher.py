@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.ScratchFlusher import ScratchFlusher
+
+
+class TestScratchFlusher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.flusher = ScratchFlusher(self.tmp_dir / "scratch")
+
+    def tearDown(self):
+        self.flusher.close()
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _write(self, path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(path), "wb") as handle:
+            handle.write(content)
+
+    def test_move_files_returns_net_written_bytes(self):
+        target_dir = self.tmp_dir / "task"
+        self._write(target_dir / "model.pk", b"0123456789")
+        staging_dir = self.flusher.staging_dir("task")
+        self._write(staging_dir / "model.pk", b"0123")
+        self._write(staging_dir / "sub" / "weights", b"abc")
+
+        self.assertEqual(ScratchFlusher.move_files(staging_dir, target_dir), -3)
+        self.assertFalse(staging_dir.exists())
+        with open(str(target_dir / "sub" / "weights"), "rb") as handle:
+            self.assertEqual(handle.read(), b"abc")
+        self.assertEqual(list(target_dir.glob("**/*.flushing")), [])
+
+    def test_jobs_run_in_order(self):
+        results = []
+        release = threading.Event()
+        self.flusher.submit(release.wait)
+        for i in range(5):
+            self.flusher.submit(lambda i=i: results.append(i))
+            if i == 0:
+                release.set()
+        self.flusher.wait()
+        self.assertEqual(results, list(range(5)))
+
+    def test_errors_are_raised_by_wait_and_skip_later_jobs(self):
+        results = []
+
+        def fail():
+            raise OSError("disk full")
+
+        self.flusher.submit(fail)
+        self.flusher.submit(lambda: results.append(1))
+        with self.assertRaises(OSError):
+            self.flusher.wait()
+        self.assertEqual(results, [])
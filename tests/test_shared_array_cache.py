@@ -0,0 +1,53 @@
+import fcntl
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from taskplan.SharedArrayCache import SharedArrayCache
+
+
+class TestSharedArrayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = SharedArrayCache(self.cache_dir, max_size_mb=1)
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _builder(self, name, size=10):
+        def build():
+            self.builds.append(name)
+            return np.zeros(size, dtype=np.uint8)
+        return build
+
+    def _files(self):
+        return sorted(path.name for path in self.cache.cache_dir.iterdir())
+
+    def test_arrays_are_built_once_per_config(self):
+        self.cache.get("data", self._builder("a"), {"split": 1})
+        self.cache.get("data", self._builder("b"), {"split": 1})
+        self.cache.get("data", self._builder("c"), {"split": 2})
+
+        self.assertEqual(self.builds, ["a", "c"])
+
+    def test_eviction_removes_lock_files(self):
+        self.cache.get("first", self._builder("first", 800 * 1024), {})
+        self.cache.get("second", self._builder("second", 800 * 1024), {})
+
+        self.assertEqual(len(self._files()), 2)
+        self.assertTrue(all(name.startswith("second-") for name in self._files()))
+
+    def test_entries_in_use_are_not_evicted(self):
+        self.cache.get("first", self._builder("first", 800 * 1024), {})
+        key = self.cache._key("first", {})
+        with self.cache._lock(key, fcntl.LOCK_SH):
+            self.cache.get("second", self._builder("second", 800 * 1024), {})
+            self.assertIn(key + ".npy", self._files())
+
+        array = self.cache.get("first", self._builder("rebuilt", 800 * 1024), {})
+        self.assertEqual(array.shape, (800 * 1024,))
+        self.assertEqual(self.builds, ["first", "second"])
@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.TaskArchive import TaskArchive
+
+
+class TestTaskArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.task_dir = self.tmp_dir / "task"
+        self.task_dir.mkdir()
+        with open(str(self.task_dir / "main.log"), "w") as handle:
+            handle.write("log")
+        with open(str(self.task_dir / "metadata.json"), "w") as handle:
+            handle.write("{}")
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_pack_and_unpack(self):
+        TaskArchive(self.task_dir).pack(compression="deflate")
+        self.assertEqual(sorted(path.name for path in self.task_dir.iterdir()), ["archive.zip", "metadata.json"])
+        self.assertEqual(TaskArchive(self.task_dir).read("main.log"), b"log")
+
+        TaskArchive(self.task_dir).unpack()
+        self.assertEqual(sorted(path.name for path in self.task_dir.iterdir()), ["main.log", "metadata.json"])
+
+    def test_extracted_files_are_removed_on_unpack(self):
+        TaskArchive(self.task_dir).pack(compression="deflate")
+        extracted = TaskArchive(self.task_dir).extract_file("main.log")
+        with open(str(extracted), "r") as handle:
+            self.assertEqual(handle.read(), "log")
+        self.assertEqual(extracted.parent.parent, TaskArchive.extract_root)
+
+        # The extracted files are found again by a new archive object, e.g. after the task has been dehydrated
+        TaskArchive(self.task_dir).unpack()
+        self.assertFalse(extracted.exists())
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.TaskCatalog import TaskCatalog
+
+
+class TestTaskCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.task_dir = self.tmp_dir / "task"
+        self.task_dir.mkdir()
+        self.journal = MetadataJournal(self.task_dir)
+        self.journal.update({"uuid": "task", "finished_iterations": 0, "had_error": False})
+        self.catalog = TaskCatalog(self.tmp_dir / "catalog.sqlite")
+
+    def tearDown(self):
+        self.catalog.connection.close()
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _touch_later(self, path):
+        stat = path.stat()
+        os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_load_uses_cached_row_while_files_are_unchanged(self):
+        self.assertEqual(self.catalog.load(self.task_dir)[0]["finished_iterations"], 0)
+        self.catalog.connection.execute("UPDATE tasks SET metadata = ?", ('{"uuid": "task", "finished_iterations": 42}',))
+        self.assertEqual(self.catalog.load(self.task_dir)[0]["finished_iterations"], 42)
+
+    def test_load_invalidates_row_when_files_change(self):
+        self.catalog.load(self.task_dir)
+        self.journal.update({"finished_iterations": 10})
+        self._touch_later(self.journal.journal_path)
+        self.assertEqual(self.catalog.load(self.task_dir)[0]["finished_iterations"], 10)
+
+    def test_partial_update_is_merged_into_row(self):
+        self.catalog.load(self.task_dir)
+        previous_signature = self.catalog.signature(self.task_dir)
+        self.journal.update({"had_error": True})
+        self._touch_later(self.journal.journal_path)
+        self.catalog.update(self.task_dir, metadata={"had_error": True}, partial=True, previous_signature=previous_signature)
+
+        self.catalog.connection.execute("UPDATE tasks SET metadata = json_set(metadata, '$.finished_iterations', 42)")
+        metadata = self.catalog.load(self.task_dir)[0]
+        self.assertEqual(metadata["had_error"], True)
+        self.assertEqual(metadata["finished_iterations"], 42)
+
+    def test_partial_update_does_not_validate_stale_row(self):
+        self.catalog.load(self.task_dir)
+        self.journal.update({"finished_iterations": 10})
+        self._touch_later(self.journal.journal_path)
+
+        previous_signature = self.catalog.signature(self.task_dir)
+        self.journal.update({"had_error": True})
+        self._touch_later(self.journal.journal_path)
+        self.catalog.update(self.task_dir, metadata={"had_error": True}, partial=True, previous_signature=previous_signature)
+
+        metadata = self.catalog.load(self.task_dir)[0]
+        self.assertEqual(metadata["had_error"], True)
+        self.assertEqual(metadata["finished_iterations"], 10)
+
+    def test_prune_removes_rows_of_missing_tasks(self):
+        self.catalog.load(self.task_dir)
+        self.catalog.prune([])
+        self.assertEqual(self.catalog.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 0)
+
+    def test_rows_only_keep_the_summary(self):
+        self.journal.update({"code_versions": {"0": "a", "10": "b"}, "checkpoints": [{"finished_iterations": 5, "stored_bytes": 100}], "notes": "long notes"})
+        metadata = self.catalog.load(self.task_dir)[0]
+        self.assertEqual(metadata["notes"], "long notes")
+
+        metadata = self.catalog.load(self.task_dir)[0]
+        self.assertNotIn("checkpoints", metadata)
+        self.assertNotIn("notes", metadata)
+        self.assertEqual(metadata["latest_code_version"], "b")
+        self.assertEqual(metadata["checkpoint_bytes"], 100)
@@ -0,0 +1,130 @@
+import errno
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.MetadataJournal import MetadataJournal
+from taskplan.TaskDirWatcher import TaskDirWatcher
+
+
+class TestTaskDirWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks_dir = Path(tempfile.mkdtemp())
+        self.watchers = []
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.stop()
+        shutil.rmtree(str(self.tasks_dir))
+
+    def _start_watcher(self, **kwargs):
+        watcher = TaskDirWatcher(self.tasks_dir, poll_interval=0.05, **kwargs)
+        watcher.start()
+        self.watchers.append(watcher)
+        return watcher
+
+    def _create_task(self, path):
+        path.mkdir(parents=True)
+        MetadataJournal(path).update({"uuid": path.name})
+
+    def _wait_for_changes(self, watcher, expected_dirs, timeout=5):
+        changed_dirs = set()
+        deadline = time.time() + timeout
+        while time.time() < deadline and not expected_dirs <= changed_dirs:
+            changed_dirs |= watcher.pop_changes()[0]
+            time.sleep(0.02)
+        return changed_dirs
+
+    def _test_detects_changes(self, mode):
+        flat_task = self.tasks_dir / "0c1a3e4b-flat"
+        sharded_task = self.tasks_dir / "ab" / "ab3c5e7f-sharded"
+        self._create_task(flat_task)
+        watcher = self._start_watcher(mode=mode)
+
+        self._create_task(sharded_task)
+        MetadataJournal(flat_task).update({"finished_iterations": 10})
+        self.assertTrue({flat_task, sharded_task} <= self._wait_for_changes(watcher, {flat_task, sharded_task}))
+
+        MetadataJournal(sharded_task).update({"finished_iterations": 10})
+        self.assertIn(sharded_task, self._wait_for_changes(watcher, {sharded_task}))
+
+        shutil.rmtree(str(flat_task))
+        self.assertIn(flat_task, self._wait_for_changes(watcher, {flat_task}))
+
+    def test_poll_detects_changes(self):
+        self._test_detects_changes("poll")
+
+    def test_inotify_detects_changes(self):
+        try:
+            self._test_detects_changes("inotify")
+        except (OSError, AttributeError):
+            self.skipTest("inotify is not available")
+
+    def test_own_writes_are_ignored(self):
+        task = self.tasks_dir / "0c1a3e4b-own"
+        self._create_task(task)
+        watcher = self._start_watcher(mode="poll")
+
+        journal = MetadataJournal(task, on_write=watcher.note_written)
+        journal.update({"finished_iterations": 10})
+        time.sleep(0.3)
+        self.assertNotIn(task, watcher.pop_changes()[0])
+
+        MetadataJournal(task).update({"finished_iterations": 20})
+        self.assertIn(task, self._wait_for_changes(watcher, {task}))
+
+    def test_polls_on_network_filesystems(self):
+        watcher = TaskDirWatcher(self.tasks_dir, poll_interval=0.05)
+        watcher.filesystem_type = lambda path: "nfs4"
+        watcher.start()
+        self.watchers.append(watcher)
+        self.assertIsNone(watcher.inotify_fd)
+
+    def test_poll_checks_all_tasks_in_one_pass(self):
+        tasks = [self.tasks_dir / ("0c1a3e4b-" + str(i)) for i in range(20)]
+        for task in tasks:
+            self._create_task(task)
+        watcher = TaskDirWatcher(self.tasks_dir, mode="poll")
+        watcher._poll_dir(self.tasks_dir, False)
+
+        for task in tasks:
+            MetadataJournal(task).update({"finished_iterations": 10})
+        watcher._poll()
+        self.assertEqual(watcher.pop_changes()[0], set(tasks))
+
+    def test_replaced_files_are_detected_by_poll(self):
+        task = self.tasks_dir / "0c1a3e4b-replaced"
+        self._create_task(task)
+        watcher = TaskDirWatcher(self.tasks_dir, mode="poll")
+        watcher._poll_dir(self.tasks_dir, False)
+
+        MetadataJournal(task).compact()
+        watcher._poll()
+        self.assertIn(task, watcher.pop_changes()[0])
+
+    def test_watch_limit_falls_back_to_polling(self):
+        task = self.tasks_dir / "0c1a3e4b-limit"
+        watcher = self._start_watcher(mode="auto")
+        if watcher.inotify_fd is None:
+            self.skipTest("inotify is not available")
+
+        def add_watch(path, depth):
+            raise OSError(errno.ENOSPC, "No space left on device")
+        watcher._add_watch = add_watch
+
+        self._create_task(task)
+        deadline = time.time() + 5
+        while time.time() < deadline and watcher.inotify_fd is not None:
+            time.sleep(0.02)
+        self.assertIsNone(watcher.inotify_fd)
+        self.assertTrue(watcher.pop_changes()[1])
+
+        MetadataJournal(task).update({"finished_iterations": 10})
+        self.assertIn(task, self._wait_for_changes(watcher, {task}))
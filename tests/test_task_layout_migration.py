@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import types
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+try:
+  from pathlib2 import Path
+except ImportError:
+  from pathlib import Path
+
+from taskplan.FileCloner import FileCloner
+from taskplan.Project import Project
+from taskplan.TaskWrapper import State, TaskWrapper
+from taskplan.View import View
+
+
+def create_task(tasks_dir, index, project):
+    # Only the attributes used for the save dir layout are set
+    task = object.__new__(TaskWrapper)
+    task.uuid = uuid.uuid4()
+    task.creation_time = datetime.now() + timedelta(seconds=index)
+    task.tasks_dir = tasks_dir
+    task.is_test = False
+    task.sharded = False
+    task.state = State.STOPPED
+    task.project = project
+    task.build_save_dir().mkdir(parents=True)
+    return task
+
+
+class TestTaskLayoutMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        task_project = types.SimpleNamespace(file_cloner=FileCloner())
+        tasks = [create_task(self.tmp_dir / "tasks", i, task_project) for i in range(4)]
+        view = View(None, self.tmp_dir / "view", [], {}, None, False)
+        view.refresh(tasks)
+        default_view = View(None, None, [], {}, None, False)
+        self.project = types.SimpleNamespace(tasks=tasks, views={"view": view}, default_view=default_view, slim_mode=False, shard_tasks_dir=False)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def _links(self):
+        return sorted((self.tmp_dir / "view").iterdir())
+
+    def test_view_links_resolve_while_migration_is_half_done(self):
+        self.assertEqual(Project.migrate_task_layout(self.project, True, max_tasks=2), (2, 2))
+
+        self.assertEqual(len(self._links()), 4)
+        for link in self._links():
+            self.assertTrue(link.is_symlink())
+            self.assertTrue(link.resolve(True).is_dir())
+        self.assertEqual(set(link.resolve() for link in self._links()), set(task.build_save_dir() for task in self.project.tasks))
+
+        self.assertEqual(Project.migrate_task_layout(self.project, True, max_tasks=2), (2, 0))
+        self.assertTrue(all(link.resolve(True).parent.parent == self.tmp_dir / "tasks" for link in self._links()))